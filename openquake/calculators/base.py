@@ -19,6 +19,7 @@ from __future__ import division
 import sys
 import abc
 import pdb
+import hashlib
 import math
 import socket
 import logging
@@ -56,6 +57,24 @@ class AssetSiteAssociationError(Exception):
 rlz_dt = numpy.dtype([('uid', (bytes, 200)), ('weight', F32)])
 
 
+def inputs_checksum(oqparam):
+    """
+    :param oqparam: an :class:`openquake.commonlib.oqvalidation.OqParam`
+    :returns:
+        a SHA1 hex digest of the content of the input files and of the
+        parameter `concurrent_tasks`, which determines the task splitting
+    """
+    sha1 = hashlib.sha1()
+    for key, fnames in sorted(oqparam.inputs.items()):
+        if not isinstance(fnames, list):
+            fnames = [fnames]
+        for fname in fnames:
+            with open(fname, 'rb') as f:
+                sha1.update(f.read())
+    sha1.update(repr(oqparam.concurrent_tasks).encode('utf8'))
+    return sha1.hexdigest()
+
+
 def set_array(longarray, shortarray):
     """
     :param longarray: a numpy array of floats of length L >= l
@@ -76,6 +95,7 @@ class BaseCalculator(with_metaclass(abc.ABCMeta)):
     :param oqparam: OqParam object
     :param monitor: monitor object
     :param calc_id: numeric calculation ID
+    :param resume: if True, resume the calculation `calc_id`
     """
     sitemesh = datastore.persistent_attribute('sitemesh')
     sitecol = datastore.persistent_attribute('sitecol')
@@ -92,9 +112,11 @@ class BaseCalculator(with_metaclass(abc.ABCMeta)):
     def taxonomies(self):
         return self.datastore['assetcol/taxonomies'].value
 
-    def __init__(self, oqparam, monitor=Monitor(), calc_id=None):
+    def __init__(self, oqparam, monitor=Monitor(), calc_id=None,
+                 resume=False):
         self.monitor = monitor
         self.datastore = datastore.DataStore(calc_id)
+        self.resuming = resume
         self.monitor.calc_id = self.datastore.calc_id
         self.monitor.hdf5path = self.datastore.hdf5path
         self.datastore.export_dir = oqparam.export_dir
@@ -124,6 +146,8 @@ class BaseCalculator(with_metaclass(abc.ABCMeta)):
         if (concurrent_tasks is not None and concurrent_tasks !=
                 OqParam.concurrent_tasks.default):
             self.oqparam.concurrent_tasks = concurrent_tasks
+        if self.oqparam.checkpoints:
+            self.init_checkpoints()
         self.save_params(**kw)
         exported = {}
         try:
@@ -148,6 +172,46 @@ class BaseCalculator(with_metaclass(abc.ABCMeta)):
         self.clean_up()
         return exported
 
+    def init_checkpoints(self):
+        """
+        When resuming a calculation, check that the datastore contains the
+        checkpoints of a previous run of the same calculation and remove the
+        other outputs, so that the calculation can be resumed by resubmitting
+        only the missing tasks. For a new calculation create the
+        `checkpoints` group, unless it was already created by the
+        calculator sharing the datastore with this precalculator.
+        """
+        checksum = inputs_checksum(self.oqparam)
+        if self.resuming:
+            if 'checkpoints' not in self.datastore:
+                raise ValueError(
+                    'Cannot resume calculation #%d: it was run without '
+                    'checkpoints' % self.datastore.calc_id)
+            expected = self.datastore.get_attr('checkpoints', 'checksum')
+            if checksum != expected:
+                raise ValueError(
+                    'Cannot resume calculation #%d: the input files or the '
+                    'parameter concurrent_tasks changed' %
+                    self.datastore.calc_id)
+            for key in list(self.datastore):
+                if key not in ('checkpoints', 'oqparam'):
+                    del self.datastore[key]
+            logging.info('Resuming calculation #%d', self.datastore.calc_id)
+        elif 'checkpoints' not in self.datastore:
+            self.datastore.hdf5.create_group('checkpoints')
+            self.datastore.set_attrs('checkpoints', checksum=checksum)
+        self.datastore.flush()
+
+    def get_checkpoint(self, name):
+        """
+        :param name: the name of a task
+        :returns:
+            a :class:`openquake.commonlib.datastore.Checkpoint` instance
+            if the parameter `checkpoints` is set, otherwise None
+        """
+        if self.oqparam.checkpoints:
+            return datastore.Checkpoint(self.datastore, name)
+
     def core_task(*args):
         """
         Core routine running on the workers.
@@ -300,7 +364,7 @@ class HazardCalculator(BaseCalculator):
             if precalc_id is None:  # recompute everything
                 precalc = calculators[self.pre_calculator](
                     self.oqparam, self.monitor('precalculator'),
-                    self.datastore.calc_id)
+                    self.datastore.calc_id, resume=self.resuming)
                 precalc.run()
                 if 'scenario' not in self.oqparam.calculation_mode:
                     self.csm = precalc.csm
@@ -509,7 +573,9 @@ class HazardCalculator(BaseCalculator):
             self.csm, self.core_task.__func__,
             oq.maximum_distance, self.datastore,
             self.monitor.new(oqparam=oq),
-            self.random_seed, oq.filter_sources, num_tiles=num_tiles)
+            self.random_seed, oq.filter_sources, num_tiles=num_tiles,
+            checkpoint=self.get_checkpoint(self.core_task.__name__),
+            concurrent_tasks=oq.concurrent_tasks)
         siteidx = 0
         for i, tile in enumerate(tiles, 1):
             if num_tiles > 1:
@@ -583,24 +649,19 @@ class RiskCalculator(HazardCalculator):
             for block in blocks:
                 indices = numpy.array([idx for idx, _weight in block])
                 reduced_assets = self.assets_by_site[indices]
-                # dictionary of epsilons for the reduced assets
-                reduced_eps = collections.defaultdict(F32)
+                # rows of the epsilon matrix for the reduced assets
                 if len(eps):
-                    for assets in reduced_assets:
-                        for asset in assets:
-                            reduced_eps[asset.ordinal] = eps[asset.ordinal]
-
-                # collect the hazards by key into hazards by imt
-                hdata = collections.defaultdict(lambda: [{} for _ in indices])
-                for key, hazards_by_imt in hazards_by_key.items():
-                    for imt in imtls:
-                        hazards_by_site = hazards_by_imt[imt]
-                        for i, haz in enumerate(hazards_by_site[indices]):
-                            hdata[imt][i][key] = haz
-                # build the riskinputs
-                for imt in hdata:
+                    aids = sorted(asset.ordinal for assets in reduced_assets
+                                  for asset in assets)
+                    reduced_eps = eps[aids]
+                else:
+                    reduced_eps = None
+                # build the riskinputs with the hazards of the reduced sites
+                for imt in imtls:
+                    hdata = {key: hazards_by_imt[imt][indices]
+                             for key, hazards_by_imt in hazards_by_key.items()}
                     ri = self.riskmodel.build_input(
-                        imt, hdata[imt], reduced_assets, reduced_eps)
+                        imt, hdata, reduced_assets, reduced_eps)
                     if ri.weight > 0:
                         riskinputs.append(ri)
             assert riskinputs
@@ -627,7 +688,9 @@ class RiskCalculator(HazardCalculator):
         all_args = [(riskinput, self.riskmodel, self.rlzs_assoc) +
                     self.extra_args + (self.monitor,)
                     for riskinput in self.riskinputs]
-        res = starmap(self.core_task.__func__, all_args).reduce()
+        name = self.core_task.__name__
+        res = starmap(self.core_task.__func__, all_args,
+                      checkpoint=self.get_checkpoint(name)).reduce()
         return res
 
 
@@ -662,19 +725,22 @@ def get_gmfs(dstore):
         haz_sitecol = dstore.parent['sitecol']  # N' values
     else:
         haz_sitecol = sitecol
-    risk_indices = set(sitecol.indices)  # N'' values
     N = len(haz_sitecol.complete)
+    is_risk_site = numpy.zeros(N, bool)
+    is_risk_site[sitecol.indices] = True  # N'' values
     imt_dt = numpy.dtype([(bytes(imt), F32) for imt in oq.imtls])
     E = oq.number_of_ground_motion_fields
-    # build a matrix N x E for each GSIM realization
-    gmfs = {(trt_id, gsim): numpy.zeros((N, E), imt_dt)
-            for trt_id, gsim in rlzs_assoc}
+    # build a matrix N x E for each GSIM realization, by scattering
+    # the stored records (sid, eid, imti, gmv) into it
+    gmfs = {}
     for i, rlz in enumerate(rlzs):
-        data = general.group_array(dstore['gmf_data/%04d' % i], 'sid')
-        for sid, array in data.items():
-            if sid in risk_indices:
-                for imti, imt in enumerate(oq.imtls):
-                    a = general.get_array(array, imti=imti)
-                    gs = str(rlz.gsim_rlz)
-                    gmfs[0, gs][imt][sid, a['eid']] = a['gmv']
+        data = dstore['gmf_data/%04d' % i].value
+        data = data[is_risk_site[data['sid']]]
+        key = 0, str(rlz.gsim_rlz)
+        if key not in gmfs:
+            gmfs[key] = numpy.zeros((N, E), imt_dt)
+        gmfa = gmfs[key]
+        for imti, imt in enumerate(oq.imtls):
+            a = data[data['imti'] == imti]
+            gmfa[imt][a['sid'], a['eid']] = a['gmv']
     return dstore['etags'].value, gmfs
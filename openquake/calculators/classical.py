@@ -21,6 +21,7 @@ import operator
 import collections
 from functools import partial
 import numpy
+import h5py
 
 from openquake.hazardlib.geo.utils import get_spherical_bounding_box
 from openquake.hazardlib.geo.utils import get_longitudinal_extent
@@ -28,7 +29,9 @@ from openquake.hazardlib.geo.geodetic import npoints_between
 from openquake.hazardlib.calc.filters import source_site_distance_filter
 from openquake.hazardlib.calc.hazard_curve import (
     hazard_curves_per_trt, zero_curves, zero_maps,
-    array_of_curves, ProbabilityMap)
+    array_of_curves)
+from openquake.hazardlib.probability_map import (
+    ProbabilityCurve, ProbabilityMap)
 from openquake.risklib import scientific
 from openquake.commonlib import parallel, datastore, source
 from openquake.baselib.general import AccumDict
@@ -276,74 +279,110 @@ class ClassicalCalculator(base.HazardCalculator):
         :param curves_by_trt_id:
             a dictionary trt_id -> hazard curves
         """
-        nsites = len(self.sitecol)
-        imtls = self.oqparam.imtls
-        curves_by_trt_gsim = {}
-
         with self.monitor('saving probability maps', autoflush=True):
             for trt_id in curves_by_trt_id:
                 key = 'poes/%04d' % trt_id
                 self.datastore[key] = curves_by_trt_id[trt_id]
                 self.datastore.set_attrs(
                     key, trt=self.csm.info.get_trt(trt_id))
-                gsims = self.rlzs_assoc.gsims_by_trt_id[trt_id]
-                for i, gsim in enumerate(gsims):
-                    curves_by_trt_gsim[trt_id, gsim] = (
-                        curves_by_trt_id[trt_id].extract(i))
             self.datastore.set_nbytes('poes')
+        self.datastore.flush()
+        sids_by_trt_id = {
+            trt_id: self.datastore.get_attr('poes/%04d' % trt_id, 'sids')
+            for trt_id in curves_by_trt_id}
+        self.save_curves_by_block(
+            partial(self.read_curves_block, sids_by_trt_id))
 
-        with self.monitor('combine curves_by_rlz', autoflush=True):
-            curves_by_rlz = self.rlzs_assoc.combine_curves(curves_by_trt_gsim)
-
-        self.save_curves({rlz: array_of_curves(curves, nsites, imtls)
-                          for rlz, curves in curves_by_rlz.items()})
+    def read_curves_block(self, sids_by_trt_id, start, stop):
+        """
+        Read the block of sites [start, stop) of the probability maps
+        stored in `poes` and combine them by realization.
 
-    def save_curves(self, curves_by_rlz):
+        :param sids_by_trt_id: a dictionary trt_id -> stored site IDs
+        :param start: index of the first site of the block
+        :param stop: index of the last site of the block + 1
+        :returns: a dictionary rlz -> array of stop - start curves
+        """
+        blocks = {}  # (trt_id, gsim) -> ProbabilityMap
+        for trt_id, sids in sids_by_trt_id.items():
+            gsims = self.rlzs_assoc.gsims_by_trt_id[trt_id]
+            pmaps = read_pmap_block(
+                self.datastore, 'poes/%04d' % trt_id, sids, start, stop,
+                len(gsims))
+            for gsim, pmap in zip(gsims, pmaps):
+                blocks[trt_id, gsim] = pmap
+        keys_by_rlz = collections.defaultdict(list)
+        for key in sorted(self.rlzs_assoc):
+            for rlz in self.rlzs_assoc[key]:
+                keys_by_rlz[rlz].append(key)
+        return {rlz: array_of_curves(
+                    combine_pmaps(blocks, keys_by_rlz[rlz]), stop - start,
+                    self.oqparam.imtls)
+                for rlz in self.rlzs_assoc.realizations}
+
+    def save_curves_by_block(self, read_block):
         """
-        Save the dictionary curves_by_rlz
+        Save the curves by realization and compute and save the statistics
+        by blocks of `sites_per_block` sites, so that the curves by
+        realization, whose size is the number of realizations times the
+        number of sites, are never built for all the sites at once. Only
+        the mean curves are kept in memory for all the sites.
+
+        :param read_block:
+            a function taking the indices (start, stop) of a block of sites
+            and returning a dictionary rlz -> array of stop - start curves
         """
         oq = self.oqparam
-        rlzs = self.rlzs_assoc.realizations
         nsites = len(self.sitecol)
-        if oq.individual_curves:
-            with self.monitor('save curves_by_rlz', autoflush=True):
-                for rlz, curves in curves_by_rlz.items():
-                    self.store_curves('rlz-%03d' % rlz.ordinal, curves, rlz)
-
-            if len(rlzs) == 1:  # cannot compute statistics
-                [self.mean_curves] = curves_by_rlz.values()
-                return
-
-        with self.monitor('compute and save statistics', autoflush=True):
-            weights = (None if oq.number_of_logic_tree_samples
-                       else [rlz.weight for rlz in rlzs])
-
-            # mean curves are always computed but stored only on request
-            zc = zero_curves(nsites, oq.imtls)
-            self.mean_curves = numpy.array(zc)
-            for imt in oq.imtls:
-                self.mean_curves[imt] = scientific.mean_curve(
-                    [curves_by_rlz.get(rlz, zc)[imt] for rlz in rlzs], weights)
-
-            self.quantile = {}
-            for q in oq.quantile_hazard_curves:
-                self.quantile[q] = qc = numpy.array(zc)
+        rlzs = self.rlzs_assoc.realizations
+        # with a single realization the statistics are not computed
+        stats = not (oq.individual_curves and len(rlzs) == 1)
+        weights = (None if oq.number_of_logic_tree_samples
+                   else self.rlzs_assoc.weights)
+        quantiles = oq.quantile_hazard_curves if stats else ()
+        # mean curves are always computed but stored only on request
+        self.mean_curves = zero_curves(nsites, oq.imtls)
+        rlz_mon = self.monitor('save curves_by_rlz')
+        stat_mon = self.monitor('compute and save statistics')
+        for start in range(0, nsites, oq.sites_per_block):
+            stop = min(start + oq.sites_per_block, nsites)
+            curves_by_rlz = read_block(start, stop)
+            if oq.individual_curves:
+                with rlz_mon:
+                    for rlz in rlzs:
+                        if rlz in curves_by_rlz:
+                            self.store_curves_block(
+                                'rlz-%03d' % rlz.ordinal, curves_by_rlz[rlz],
+                                start, nsites, rlz)
+            zc = zero_curves(stop - start, oq.imtls)
+            if not stats:
+                self.mean_curves[start:stop] = curves_by_rlz.get(rlzs[0], zc)
+                continue
+            with stat_mon:
+                qcurves = [zero_curves(stop - start, oq.imtls)
+                           for q in quantiles]
                 for imt in oq.imtls:
-                    curves = [curves_by_rlz[rlz][imt] for rlz in rlzs]
-                    qc[imt] = scientific.quantile_curve(
-                        curves, q, weights).reshape((nsites, -1))
-
-            if oq.mean_hazard_curves:
-                self.store_curves('mean', self.mean_curves)
-            for q in self.quantile:
-                self.store_curves('quantile-%s' % q, self.quantile[q])
+                    data = [curves_by_rlz.get(rlz, zc)[imt] for rlz in rlzs]
+                    self.mean_curves[imt][start:stop] = (
+                        scientific.mean_curve(data, weights))
+                    if quantiles:
+                        qcs = scientific.quantile_curves(
+                            data, quantiles, weights)
+                        for qc, curve in zip(qcurves, qcs):
+                            qc[imt] = curve
+                for q, qc in zip(quantiles, qcurves):
+                    self.store_curves_block(
+                        'quantile-%s' % q, qc, start, nsites)
+        rlz_mon.flush()
+        stat_mon.flush()
+        if stats and oq.mean_hazard_curves:
+            self.store_curves('mean', self.mean_curves)
 
     def hazard_maps(self, curves):
         """
         Compute the hazard maps associated to the curves
         """
-        maps = zero_maps(
-            len(self.sitecol), self.oqparam.imtls, self.oqparam.poes)
+        maps = zero_maps(len(curves), self.oqparam.imtls, self.oqparam.poes)
         for imt in curves.dtype.fields:
             # build a matrix of size (N, P)
             data = calc.compute_hazard_maps(
@@ -370,6 +409,38 @@ class ClassicalCalculator(base.HazardCalculator):
             self._store('hmaps/' + kind, hmaps, rlz,
                         poes=oq.poes, nbytes=hmaps.nbytes)
 
+    def store_curves_block(self, kind, curves, start, nsites, rlz=None):
+        """
+        Store a block of curves, optionally computing the corresponding
+        block of the hazard maps. The datasets are created at the first
+        block.
+
+        :param kind: the kind of curves to store
+        :param curves: an array of n curves to store
+        :param start: the index of the first site of the block
+        :param nsites: the total number of sites
+        :param rlz: hazard realization, if any
+        """
+        oq = self.oqparam
+        stop = start + len(curves)
+        blocks = [('hcurves/' + kind, curves, {})]
+        if oq.hazard_maps or oq.uniform_hazard_spectra:
+            blocks.append(('hmaps/' + kind, self.hazard_maps(curves),
+                           dict(poes=oq.poes)))
+        for name, array, attrs in blocks:
+            if start == 0:
+                dset = self.datastore.hdf5.create_dataset(
+                    name, (nsites,), array.dtype)
+                attrs['nbytes'] = nsites * array.dtype.itemsize
+                if rlz is not None:
+                    attrs['uid'] = rlz.uid
+                for k, v in attrs.items():
+                    dset.attrs[k] = v
+            self.datastore.hdf5[name][start:stop] = array
+        if start == 0:
+            self.datastore['hcurves'].attrs['imtls'] = [
+                (imt, len(imls)) for imt, imls in oq.imtls.items()]
+
     def _store(self, name, curves, rlz, **kw):
         self.datastore.hdf5[name] = curves
         dset = self.datastore.hdf5[name]
@@ -379,6 +450,57 @@ class ClassicalCalculator(base.HazardCalculator):
             dset.attrs[k] = v
 
 
+def extract_block(pmap, sids):
+    """
+    :param pmap: a ProbabilityMap
+    :param sids: a sequence of site IDs
+    :returns: a ProbabilityMap with the curves of the given sites,
+              renumbered from 0 to len(sids) - 1
+    """
+    block = ProbabilityMap()
+    for i, sid in enumerate(sids):
+        if sid in pmap:
+            block[i] = pmap[sid]
+    return block
+
+
+def read_pmap_block(dstore, key, sids, start, stop, num_gsims):
+    """
+    Read from the datastore the curves of the sites in [start, stop) of
+    a ProbabilityMap, without reading the other sites.
+
+    :param dstore: a DataStore instance
+    :param key: the key of a ProbabilityMap stored as an array of shape
+                (S, L, G), with the ordered site IDs in the attribute `sids`
+    :param sids: the content of the attribute `sids`
+    :param start: index of the first site of the block
+    :param stop: index of the last site of the block + 1
+    :param num_gsims: the number of GSIMs G
+    :returns: G ProbabilityMaps, with the site IDs renumbered from 0
+    """
+    pmaps = [ProbabilityMap() for _ in range(num_gsims)]
+    i, j = numpy.searchsorted(sids, [start, stop])
+    if i == j:  # no sites in the block
+        return pmaps
+    array = h5py.File.__getitem__(dstore.hdf5, key)[i:j]  # shape (n, L, G)
+    for sid, probs in zip(sids[i:j], array):
+        for g, pmap in enumerate(pmaps):
+            pmap[sid - start] = ProbabilityCurve(probs[:, g:g + 1])
+    return pmaps
+
+
+def combine_pmaps(pmap_by_key, keys):
+    """
+    :param pmap_by_key: a dictionary (trt_id, gsim) -> ProbabilityMap
+    :param keys: the keys associated to a realization
+    :returns: the composition of the ProbabilityMaps with the given keys
+    """
+    pmap = ProbabilityMap()
+    for key in keys:
+        pmap |= pmap_by_key[key]
+    return pmap
+
+
 def nonzero(val):
     """
     :returns: the sum of the composite array `val`
@@ -19,9 +19,11 @@
 import numpy
 
 from openquake.commonlib import parallel
+from openquake.risklib import riskmodels
 from openquake.calculators import base, classical_risk
 
 F32 = numpy.float32
+U32 = numpy.uint32
 
 bcr_dt = numpy.dtype([('annual_loss_orig', F32), ('annual_loss_retro', F32),
                       ('bcr', F32)])
@@ -30,7 +32,9 @@ bcr_dt = numpy.dtype([('annual_loss_orig', F32), ('annual_loss_retro', F32),
 @parallel.litetask
 def classical_bcr(riskinput, riskmodel, rlzs_assoc, bcr_dt, monitor):
     """
-    Compute and return the average losses for each asset.
+    Compute and return the BCR data for each asset, as a composite
+    array of shape (N', R), where N' is the number of assets in the
+    riskinput, together with the array of the asset ordinals.
 
     :param riskinput:
         a :class:`openquake.risklib.riskinput.RiskInput` object
@@ -43,14 +47,21 @@ def classical_bcr(riskinput, riskmodel, rlzs_assoc, bcr_dt, monitor):
     :param monitor:
         :class:`openquake.baselib.performance.Monitor` instance
     """
-    result = {}  # (N, R) -> data
+    R = len(rlzs_assoc.realizations)
+    aids = numpy.array(sorted(asset.ordinal
+                              for assets in riskinput.assets_by_site
+                              for asset in assets), U32)
+    bcr_data = numpy.zeros((len(aids), R), riskmodel.loss_type_dt(bcr_dt))
     for out_by_lr in riskmodel.gen_outputs(riskinput, rlzs_assoc, monitor):
+        idx = numpy.searchsorted(
+            aids, [asset.ordinal for asset in out_by_lr.assets])
         for (l, r), out in sorted(out_by_lr.items()):
-            for asset, (eal_orig, eal_retro, bcr) in zip(out.assets, out.data):
-                aval = asset.value(out.loss_type)
-                result[asset.ordinal, out.loss_type, out.hid] = numpy.array([
-                    (eal_orig * aval, eal_retro * aval, bcr)], bcr_dt)
-    return result
+            avals = riskmodels.get_values(out.loss_type, out.assets)
+            data = bcr_data[out.loss_type]
+            data['annual_loss_orig'][idx, r] = out.data[:, 0] * avals
+            data['annual_loss_retro'][idx, r] = out.data[:, 1] * avals
+            data['bcr'][idx, r] = out.data[:, 2]
+    return {'bcr_data': [(aids, bcr_data)]}
 
 
 @base.calculators.add('classical_bcr')
@@ -67,6 +78,6 @@ class ClassicalBCRCalculator(classical_risk.ClassicalRiskCalculator):
     def post_execute(self, result):
         bcr_data = numpy.zeros(
             (self.N, self.R), self.riskmodel.loss_type_dt(bcr_dt))
-        for (aid, lt, r), data in result.items():
-            bcr_data[lt][aid, r] = data
+        for aids, data in result['bcr_data']:
+            bcr_data[aids] = data
         self.datastore['bcr-rlzs'] = bcr_data
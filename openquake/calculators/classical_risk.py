@@ -17,11 +17,9 @@
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-import operator
 
 import numpy
 
-from openquake.baselib.general import groupby
 from openquake.hazardlib.calc.hazard_curve import array_of_curves
 from openquake.risklib import scientific, riskinput
 from openquake.commonlib import readinput, parallel, datastore, source
@@ -29,12 +27,27 @@ from openquake.calculators import base
 
 
 F32 = numpy.float32
+U32 = numpy.uint32
+
+
+def _set_curves(array, idx, r, curves):
+    # fill array[idx, r] with curves of shape (N, C), padding on the right
+    # with NaNs if C is smaller than the curve resolution, like set_array
+    C = curves.shape[-1]
+    array[idx, r, :C] = curves
+    array[idx, r, C:] = numpy.nan
 
 
 @parallel.litetask
 def classical_risk(riskinput, riskmodel, rlzs_assoc, monitor):
     """
-    Compute and return the average losses for each asset.
+    Compute and return the loss curves and maps for each asset.
+    The curves and the maps are returned as composite arrays of shape
+    (N', R), where N' is the number of assets in the riskinput, together
+    with the array of the asset ordinals, so that they can be stored
+    directly in the datastore. If there are several realizations, the
+    statistical curves and maps are returned in the same form, with
+    shape (N', Q1).
 
     :param riskinput:
         a :class:`openquake.risklib.riskinput.RiskInput` object
@@ -47,48 +60,56 @@ def classical_risk(riskinput, riskmodel, rlzs_assoc, monitor):
     """
     oq = monitor.oqparam
     ins = oq.insured_losses
+    P = len(oq.conditional_loss_poes)
     R = len(rlzs_assoc.realizations)
+    ltypes = riskmodel.loss_types
+    loss_curve_dt, loss_maps_dt = riskmodel.build_loss_dtypes(
+        oq.conditional_loss_poes, ins)
+    aids = numpy.array(sorted(asset.ordinal
+                              for assets in riskinput.assets_by_site
+                              for asset in assets), U32)
+    curves = numpy.zeros((len(aids), R), loss_curve_dt)
+    maps = numpy.zeros((len(aids), R), loss_maps_dt) if P else None
     result = dict(
-        loss_curves=[], loss_maps=[], stat_curves=[], stat_maps=[])
+        loss_curves=[(aids, curves)],
+        loss_maps=[(aids, maps)] if P else [],
+        stat_curves=[], stat_maps=[])
     for out_by_lr in riskmodel.gen_outputs(riskinput, rlzs_assoc, monitor):
+        idx = numpy.searchsorted(
+            aids, [asset.ordinal for asset in out_by_lr.assets])
         for (l, r), out in sorted(out_by_lr.items()):
-            for i, asset in enumerate(out.assets):
-                aid = asset.ordinal
-                avg = out.average_losses[i]
-                avg_ins = (out.average_insured_losses[i]
-                           if ins else numpy.nan)
-                lcurve = (
-                    out.loss_curves[i, 0],
-                    out.loss_curves[i, 1], avg)
-                if ins:
-                    lcurve += (
-                        out.insured_curves[i, 0],
-                        out.insured_curves[i, 1], avg_ins)
-                else:
-                    lcurve += (None, None, None)
-                result['loss_curves'].append((l, r, aid, lcurve))
-
-                # no insured, shape (P, N)
-                result['loss_maps'].append(
-                    (l, r, aid, out.loss_maps[:, i]))
-
-        # compute statistics
-        if R > 1:
-            for l, lrs in groupby(out_by_lr, operator.itemgetter(0)).items():
-                outs = [out_by_lr[lr] for lr in lrs]
-                curve_resolution = outs[0].loss_curves.shape[-1]
-                statsbuilder = scientific.StatsBuilder(
-                    oq.quantile_loss_curves,
-                    oq.conditional_loss_poes, oq.poes_disagg,
-                    curve_resolution, insured_losses=oq.insured_losses)
-                stats = statsbuilder.build(outs)
-                stat_curves, stat_maps = statsbuilder.get_curves_maps(stats)
-                for i, asset in enumerate(out_by_lr.assets):
-                    result['stat_curves'].append(
-                        (l, asset.ordinal, stat_curves[:, i]))
-                    if len(stat_maps):
-                        result['stat_maps'].append(
-                            (l, asset.ordinal, stat_maps[:, i]))
+            lc = curves[ltypes[l]]
+            _set_curves(lc['losses'], idx, r, out.loss_curves[:, 0])
+            _set_curves(lc['poes'], idx, r, out.loss_curves[:, 1])
+            lc['avg'][idx, r] = out.average_losses
+            if ins and out.insured_curves is not None:
+                _set_curves(lc['losses_ins'], idx, r,
+                            out.insured_curves[:, 0])
+                _set_curves(lc['poes_ins'], idx, r, out.insured_curves[:, 1])
+                lc['avg_ins'][idx, r] = out.average_insured_losses
+            if P:  # no insured, shape (P, N)
+                lm = maps[ltypes[l]]
+                for name, lmap in zip(lm.dtype.names[:P], out.loss_maps):
+                    lm[name][idx, r] = lmap
+
+    # compute statistics
+    if R > 1:
+        weights = [rlz.weight for rlz in rlzs_assoc.realizations]
+        Q1 = len(oq.quantile_loss_curves) + 1
+        stat_curves = numpy.zeros((len(aids), Q1), loss_curve_dt)
+        stat_maps = numpy.zeros((len(aids), Q1), loss_maps_dt) if P else None
+        statsbuilder = scientific.StatsBuilder(
+            oq.quantile_loss_curves, oq.conditional_loss_poes,
+            oq.poes_disagg, insured_losses=ins)
+        for loss_type in loss_curve_dt.names:
+            sc, sm = statsbuilder.build_curves_maps(
+                curves[loss_type], weights)
+            stat_curves[loss_type] = sc
+            if P:
+                stat_maps[loss_type] = sm
+        result['stat_curves'].append((aids, stat_curves))
+        if P:
+            result['stat_maps'].append((aids, stat_maps))
 
     return result
 
@@ -158,29 +179,16 @@ class ClassicalRiskCalculator(base.RiskCalculator):
 
         :param result: aggregated result of the task classical_risk
         """
-        ltypes = self.riskmodel.loss_types
         loss_curves = numpy.zeros((self.N, self.R), self.loss_curve_dt)
-        for l, r, aid, lcurve in result['loss_curves']:
-            loss_curves_lt = loss_curves[ltypes[l]]
-            for i, name in enumerate(loss_curves_lt.dtype.names):
-                if name.startswith('avg'):
-                    loss_curves_lt[name][aid, r] = lcurve[i]
-                else:
-                    base.set_array(loss_curves_lt[name][aid, r], lcurve[i])
+        for aids, curves in result['loss_curves']:
+            loss_curves[aids] = curves
         self.datastore['loss_curves-rlzs'] = loss_curves
 
         # loss curves stats
         if self.R > 1:
             stat_curves = numpy.zeros((self.N, self.Q1), self.loss_curve_dt)
-            for l, aid, statcurve in result['stat_curves']:
-                stat_curves_lt = stat_curves[ltypes[l]]
-                for name in stat_curves_lt.dtype.names:
-                    for s in range(self.Q1):
-                        if name.startswith('avg'):
-                            stat_curves_lt[name][aid, s] = statcurve[name][s]
-                        else:
-                            base.set_array(stat_curves_lt[name][aid, s],
-                                           statcurve[name][s])
+            for aids, curves in result['stat_curves']:
+                stat_curves[aids] = curves
             self.datastore['loss_curves-stats'] = stat_curves
 
     def save_loss_maps(self, result):
@@ -189,20 +197,14 @@ class ClassicalRiskCalculator(base.RiskCalculator):
 
         :param result: aggregated result of the task classical_risk
         """
-        ltypes = self.riskmodel.loss_types
         loss_maps = numpy.zeros((self.N, self.R), self.loss_maps_dt)
-        for l, r, aid, lmaps in result['loss_maps']:
-            loss_maps_lt = loss_maps[ltypes[l]]
-            for i, name in enumerate(loss_maps_lt.dtype.names):
-                loss_maps_lt[name][aid, r] = lmaps[i]
+        for aids, maps in result['loss_maps']:
+            loss_maps[aids] = maps
         self.datastore['loss_maps-rlzs'] = loss_maps
 
         # loss maps stats
         if self.R > 1:
             stat_maps = numpy.zeros((self.N, self.Q1), self.loss_maps_dt)
-            for l, aid, statmaps in result['stat_maps']:
-                statmaps_lt = stat_maps[ltypes[l]]
-                for name in statmaps_lt.dtype.names:
-                    for s in range(self.Q1):
-                        statmaps_lt[name][aid, s] = statmaps[name][s]
+            for aids, maps in result['stat_maps']:
+                stat_maps[aids] = maps
             self.datastore['loss_maps-stats'] = stat_maps
@@ -23,93 +23,125 @@ from __future__ import division
 import sys
 import math
 import logging
-from collections import namedtuple
+import operator
+from collections import namedtuple, defaultdict
 import numpy
+from scipy.stats import truncnorm
 
-from openquake.baselib.general import split_in_blocks
+from openquake.baselib.general import split_in_blocks, groupby
+from openquake.baselib.python3compat import pickle
+from openquake.hazardlib import const
 from openquake.hazardlib.calc import disagg
 from openquake.hazardlib.imt import from_string
 from openquake.hazardlib.site import SiteCollection
 from openquake.hazardlib.gsim.base import ContextMaker
 from openquake.commonlib import parallel
-from openquake.calculators.calc import gen_ruptures_for_site
+from openquake.calculators.calc import gen_ruptures
 from openquake.calculators import base, classical
 
-DISAGG_RES_FMT = 'disagg/poe-%(poe)s-rlz-%(rlz)s-%(imt)s-%(lon)s-%(lat)s'
+F64 = numpy.float64
 
 
 # a 6-uple containing float 4 arrays mags, dists, lons, lats,
-# 1 int array trts and a list of dictionaries pnes
+# 1 int array trts and a float array pnes of shape (U, R, P, M, E), i.e.
+# (ruptures, realizations, poes, imts, epsilons)
 BinData = namedtuple('BinData', 'mags, dists, lons, lats, trts, pnes')
 
 
-def _collect_bins_data(trt_num, source_ruptures, site, curves, trt_model_id,
-                       rlzs_assoc, gsims, imtls, poes, truncation_level,
-                       n_epsilons, mon):
-    # returns a BinData instance
-    sitecol = SiteCollection([site])
-    mags = []
-    dists = []
-    lons = []
-    lats = []
-    trts = []
-    pnes = []
-    sitemesh = sitecol.mesh
+def _get_imls(curves, rlzis, imtls, poes):
+    """
+    :param curves: a dictionary (rlzi, imt) -> hazard curve
+    :param rlzis: a list of R realization indices
+    :param imtls: intensity measure types and levels
+    :param poes: a list of P disaggregation PoEs
+    :returns: an array of shape (R, P, M) with the IMLs to disaggregate
+    """
+    imls = numpy.zeros((len(rlzis), len(poes), len(imtls)))
+    for m, imt in enumerate(imtls):
+        levels = numpy.array(imtls[imt][::-1])
+        for r, rlzi in enumerate(rlzis):
+            imls[r, :, m] = numpy.interp(poes, curves[rlzi, imt][::-1], levels)
+    return imls
+
+
+def _disaggregate_poes(gsim, sctx, rctx, dctx, imts, imls, distribution,
+                       cdf_edges):
+    """
+    Compute the probabilities of exceeding the given IMLs, for each
+    epsilon bin, by computing the mean and the standard deviation once per
+    IMT. It is the vectorized equivalent of calling `gsim.disaggregate_poe`
+    for each site and IML.
+
+    :param imts: a list of M IMT objects
+    :param imls: an array of shape (N, R, P, M), N being the number of sites
+    :param distribution: the truncated normal distribution
+    :param cdf_edges: the values of its CDF on the E + 1 epsilon edges
+    :returns: an array of shape (N, R, P, M, E)
+    """
+    poes = numpy.zeros(imls.shape + (len(cdf_edges) - 1,))
+    for m, imt in enumerate(imts):
+        mean, [stddev] = gsim.get_mean_and_stddevs(
+            sctx, rctx, dctx, imt, [const.StdDev.TOTAL])
+        standard_imls = (gsim.to_distribution_values(imls[:, :, :, m]) -
+                         mean[:, None, None]) / stddev[:, None, None]
+        # the contribution of each epsilon bin above the standard IML;
+        # the bin containing the standard IML contributes partially
+        cdf = distribution.cdf(standard_imls)[:, :, :, None]
+        poes[:, :, :, m] = numpy.clip(
+            cdf_edges[1:] - numpy.maximum(cdf_edges[:-1], cdf), 0, None)
+    return poes
+
+
+def _collect_bins_data(trt_num, source_rupture_sites, imls_by_gsim, gsims,
+                       imtls, truncation_level, n_epsilons, mon):
+    # returns a dictionary site index -> BinData instance
+    data = defaultdict(lambda: ([], [], [], [], [], []))
     make_ctxt = mon('making contexts', measuremem=False)
     disagg_poe = mon('disaggregate_poe', measuremem=False)
     cmaker = ContextMaker(gsims)
-    for source, ruptures in source_ruptures:
+    imts = [from_string(imt) for imt in imtls]
+    distribution = truncnorm(-truncation_level, truncation_level)
+    cdf_edges = distribution.cdf(numpy.linspace(
+        -truncation_level, truncation_level, n_epsilons + 1))
+    for source, rupture, r_sites in source_rupture_sites:
         try:
             tect_reg = trt_num[source.tectonic_region_type]
-            for rupture in ruptures:
-                with make_ctxt:
-                    sctx, rctx, dctx = cmaker.make_contexts(sitecol, rupture)
-                # extract rupture parameters of interest
-                mags.append(rupture.mag)
-                dists.append(dctx.rjb[0])  # single site => single distance
-                [closest_point] = rupture.surface.get_closest_points(sitemesh)
-                lons.append(closest_point.longitude)
-                lats.append(closest_point.latitude)
-                trts.append(tect_reg)
-
-                pne_dict = {}
-                # a dictionary rlz.id, poe, imt_str -> prob_no_exceed
-                for gsim in gsims:
-                    gs = str(gsim)
-                    for imt_str, imls in imtls.iteritems():
-                        imt = from_string(imt_str)
-                        imls = numpy.array(imls[::-1])
-                        for rlz in rlzs_assoc[trt_model_id, gs]:
-                            rlzi = rlz.ordinal
-                            curve_poes = curves[rlzi, imt_str][::-1]
-                            for poe in poes:
-                                iml = numpy.interp(poe, curve_poes, imls)
-                                # compute probability of exceeding iml given
-                                # the current rupture and epsilon_bin, that is
-                                # ``P(IMT >= iml | rup, epsilon_bin)``
-                                # for each of the epsilon bins
-                                with disagg_poe:
-                                    [poes_given_rup_eps] = \
-                                        gsim.disaggregate_poe(
-                                            sctx, rctx, dctx, imt, iml,
-                                            truncation_level, n_epsilons)
-                                pne = rupture.get_probability_no_exceedance(
-                                    poes_given_rup_eps)
-                                pne_dict[rlzi, poe, imt_str] = (iml, pne)
-
-                pnes.append(pne_dict)
+            with make_ctxt:
+                sctx, rctx, dctx = cmaker.make_contexts(r_sites, rupture)
+            closest_points = rupture.surface.get_closest_points(r_sites.mesh)
+            # compute the probability of exceeding the IMLs given
+            # the current rupture and epsilon_bin, that is
+            # ``P(IMT >= iml | rup, epsilon_bin)`` for all the affected
+            # sites, realizations, poes, IMTs and epsilon bins at once
+            with disagg_poe:
+                poes = numpy.concatenate([
+                    _disaggregate_poes(gsim, sctx, rctx, dctx, imts,
+                                       imls[r_sites.sids], distribution,
+                                       cdf_edges)
+                    for gsim, imls in zip(gsims, imls_by_gsim)], axis=1)
+                pnes = rupture.get_probability_no_exceedance(poes)
         except Exception as err:
             etype, err, tb = sys.exc_info()
             msg = 'An error occurred with source id=%s. Error: %s'
             msg %= (source.source_id, err)
             raise etype, msg, tb
-
-    return BinData(numpy.array(mags, float),
-                   numpy.array(dists, float),
-                   numpy.array(lons, float),
-                   numpy.array(lats, float),
-                   numpy.array(trts, int),
-                   pnes)
+        # extract rupture parameters of interest, for each site
+        for i, sid in enumerate(r_sites.sids):
+            mags, dists, lons, lats, trts, pnes_ = data[sid]
+            mags.append(rupture.mag)
+            dists.append(dctx.rjb[i])
+            lons.append(closest_points.lons[i])
+            lats.append(closest_points.lats[i])
+            trts.append(tect_reg)
+            pnes_.append(pnes[i])
+
+    return {sid: BinData(numpy.array(mags, float),
+                         numpy.array(dists, float),
+                         numpy.array(lons, float),
+                         numpy.array(lats, float),
+                         numpy.array(trts, int),
+                         numpy.array(pnes_, float))
+            for sid, (mags, dists, lons, lats, trts, pnes_) in data.items()}
 
 
 @parallel.litetask
@@ -147,58 +179,61 @@ def compute_disagg(sitecol, sources, trt_model_id, rlzs_assoc,
         max_dist = oqparam.maximum_distance['default']
     trt_num = dict((trt, i) for i, trt in enumerate(trt_names))
     gsims = rlzs_assoc.gsims_by_trt_id[trt_model_id]
+    rlzs_by_gsim = rlzs_assoc.get_rlzs_by_gsim(trt_model_id)
+    rlzis_by_gsim = [[rlz.ordinal for rlz in rlzs_by_gsim[gsim]]
+                     for gsim in gsims]
+    rlzis = sum(rlzis_by_gsim, [])
+    poes = oqparam.poes_disagg
     result = {}  # site.id, rlz.id, poe, imt, iml, trt_names -> array
 
     collecting_mon = monitor('collecting bins')
     arranging_mon = monitor('arranging bins')
 
-    for site in sitecol:
-        # edges as wanted by disagg._arrange_data_in_bins
-        try:
-            edges = bin_edges[site.id]
-        except KeyError:
-            # bin_edges for a given site are missing if the site is far away
-            continue
-
-        # generate source, rupture, sites once per site
-        source_ruptures = list(
-            gen_ruptures_for_site(site, sources, max_dist, monitor))
-        if not source_ruptures:
-            continue
-        with collecting_mon:
-            bdata = _collect_bins_data(
-                trt_num, source_ruptures, site, curves_dict[site.id],
-                trt_model_id, rlzs_assoc, gsims, oqparam.imtls,
-                oqparam.poes_disagg, oqparam.truncation_level,
-                oqparam.num_epsilon_bins, monitor)
-
-        if not bdata.pnes:  # no contributions for this site
+    # bin_edges for a given site are missing if the site is far away
+    sites = [site for site in sitecol if site.id in bin_edges]
+    if not sites:
+        return result
+    # the IMLs to disaggregate, with shape (N, R, P, M) for each gsim
+    imls_by_gsim = [
+        numpy.array([_get_imls(curves_dict[site.id], rlzis_, oqparam.imtls,
+                               poes) for site in sites])
+        for rlzis_ in rlzis_by_gsim]
+    imls = numpy.concatenate(imls_by_gsim, axis=1)
+
+    # generate the ruptures once for all sites, each rupture being
+    # associated to the indices of the sites affected by it
+    with collecting_mon:
+        bdata_by_site = _collect_bins_data(
+            trt_num, gen_ruptures(sources, SiteCollection(sites), max_dist,
+                                  monitor),
+            imls_by_gsim, gsims, oqparam.imtls, oqparam.truncation_level,
+            oqparam.num_epsilon_bins, monitor)
+
+    for idx, site in enumerate(sites):
+        if idx not in bdata_by_site:  # no contributions for this site
             continue
-
-        for poe in oqparam.poes_disagg:
-            for imt in oqparam.imtls:
-                for gsim in gsims:
-                    for rlz in rlzs_assoc[trt_model_id, gsim]:
-                        rlzi = rlz.ordinal
-                        # extract the probabilities of non-exceedance for the
-                        # given realization, disaggregation PoE, and IMT
-                        iml_pne_pairs = [pne[rlzi, poe, imt]
-                                         for pne in bdata.pnes]
-                        iml = iml_pne_pairs[0][0]
-                        probs = numpy.array(
-                            [p for (i, p) in iml_pne_pairs], float)
-                        # bins in a format handy for hazardlib
-                        bins = [bdata.mags, bdata.dists,
-                                bdata.lons, bdata.lats,
-                                bdata.trts, None, probs]
-
-                        # call disagg._arrange_data_in_bins
-                        with arranging_mon:
-                            key = (site.id, rlzi, poe, imt, iml, trt_names)
-                            matrix = disagg._arrange_data_in_bins(
-                                bins, edges + (trt_names,))
-                            result[key] = numpy.array(
-                                [fn(matrix) for fn in disagg.pmf_map.values()])
+        bdata = bdata_by_site[idx]
+        # edges as wanted by disagg._arrange_data_in_bins
+        edges = bin_edges[site.id]
+        for p, poe in enumerate(poes):
+            for m, imt in enumerate(oqparam.imtls):
+                for r, rlzi in enumerate(rlzis):
+                    # extract the probabilities of non-exceedance for the
+                    # given realization, disaggregation PoE, and IMT
+                    iml = imls[idx, r, p, m]
+                    probs = bdata.pnes[:, r, p, m]
+                    # bins in a format handy for hazardlib
+                    bins = [bdata.mags, bdata.dists,
+                            bdata.lons, bdata.lats,
+                            bdata.trts, None, probs]
+
+                    # call disagg._arrange_data_in_bins
+                    with arranging_mon:
+                        key = (site.id, rlzi, poe, imt, iml, trt_names)
+                        matrix = disagg._arrange_data_in_bins(
+                            bins, edges + (trt_names,))
+                        result[key] = numpy.array(
+                            [fn(matrix) for fn in disagg.pmf_map.values()])
     return result
 
 
@@ -255,6 +290,7 @@ class DisaggregationCalculator(classical.ClassicalCalculator):
                      min(eps_edges), max(eps_edges))
 
         self.bin_edges = {}
+        self.trt_names = {}  # sm_id -> trt_names
         curves_dict = {sid: self.get_curves(sid) for sid in sitecol.sids}
         all_args = []
         num_trts = sum(len(sm.trt_models) for sm in self.csm.source_models)
@@ -262,6 +298,7 @@ class DisaggregationCalculator(classical.ClassicalCalculator):
         for smodel in self.csm.source_models:
             sm_id = smodel.ordinal
             trt_names = tuple(mod.trt for mod in smodel.trt_models)
+            self.trt_names[sm_id] = trt_names
             max_mag = max(mod.max_mag for mod in smodel.trt_models)
             min_mag = min(mod.min_mag for mod in smodel.trt_models)
             mag_edges = mag_bin_width * numpy.arange(
@@ -315,65 +352,50 @@ class DisaggregationCalculator(classical.ClassicalCalculator):
         Save all the results of the disaggregation. NB: the number of results
         to save is #sites * #rlzs * #disagg_poes * #IMTs.
 
+        The matrices are stored in dense datasets `disagg/<dim_labels>`,
+        one for each kind of PMF, with shape (N, R, P, M) + PMF shape,
+        padded with zeros, since the number of bins depends on the site.
+        The interpolated IMLs are stored in `disagg/iml`, with NaNs for
+        the missing results, and the bin edges are stored once per
+        (source model, site) in `disagg-bins`, as a pickled dictionary.
+
         :param results:
             a dictionary of probability arrays
         """
-        # build a dictionary rlz.ordinal -> source_model.ordinal
-        sm_id = {}
-        for i, rlzs in enumerate(self.rlzs_assoc.rlzs_by_smodel):
-            for rlz in rlzs:
-                sm_id[rlz.ordinal] = i
+        if not results:
+            logging.warn('There are no disaggregation results to save')
+            return
+        oq = self.oqparam
+        imts = list(oq.imtls)
+        shape = (len(self.sitecol.complete), len(self.rlzs_assoc.realizations),
+                 len(oq.poes_disagg), len(imts))
+        imls = numpy.zeros(shape)
+        imls.fill(numpy.nan)
+        dsets = []
+        for i, dim_labels in enumerate(disagg.pmf_map):
+            pmf_shape = tuple(numpy.max(
+                [probs[i].shape for probs in results.values()], axis=0))
+            dsets.append(self.datastore.hdf5.create_dataset(
+                'disagg/' + '_'.join(dim_labels), shape + pmf_shape, F64))
 
         # since an extremely small subset of the full disaggregation matrix
-        # is saved this method can be run sequentially on the controller node
-        for key, probs in sorted(results.iteritems()):
-            sid, rlz_id, poe, imt, iml, trt_names = key
-            edges = self.bin_edges[sm_id[rlz_id], sid]
-            self.save_disagg_result(
-                sid, edges, trt_names, probs, rlz_id,
-                self.oqparam.investigation_time, imt, iml, poe)
-
-    def save_disagg_result(self, site_id, bin_edges, trt_names, matrix,
-                           rlz_id, investigation_time, imt_str, iml, poe):
-        """
-        Save a computed disaggregation matrix to `hzrdr.disagg_result` (see
-        :class:`~openquake.engine.db.models.DisaggResult`).
-
-        :param site_id:
-            id of the current site
-        :param bin_edges:
-            The 5-uple mag, dist, lon, lat, eps
-        :param trt_names:
-            The list of Tectonic Region Types
-        :param matrix:
-            A probability array
-        :param rlz_id:
-            ordinal of the realization to which the results belong.
-        :param float investigation_time:
-            Investigation time (years) for the calculation.
-        :param imt_str:
-            Intensity measure type string (PGA, SA, etc.)
-        :param float iml:
-            Intensity measure level interpolated (using `poe`) from the hazard
-            curve at the `site`.
-        :param float poe:
-            Disaggregation probability of exceedance value for this result.
-        """
-        lon, lat = self.sitemesh[site_id]
-        mag, dist, lons, lats, eps = bin_edges
-        disp_name = DISAGG_RES_FMT % dict(
-            poe=poe, rlz=rlz_id, imt=imt_str, lon=lon, lat=lat)
-
-        self.datastore[disp_name] = matrix
-        attrs = self.datastore.hdf5[disp_name].attrs
-        attrs['rlzi'] = rlz_id
-        attrs['imt'] = imt_str
-        attrs['iml'] = iml
-        attrs['poe'] = poe
-        attrs['trts'] = trt_names
-        attrs['mag_bin_edges'] = mag
-        attrs['dist_bin_edges'] = dist
-        attrs['lon_bin_edges'] = lons
-        attrs['lat_bin_edges'] = lats
-        attrs['eps_bin_edges'] = eps
-        attrs['location'] = self.sitemesh[site_id]
+        # is saved this method can be run sequentially on the controller node;
+        # the matrices are written one site at the time
+        by_sid = groupby(results, operator.itemgetter(0))
+        for sid in sorted(by_sid):
+            matrices = [numpy.zeros(dset.shape[1:]) for dset in dsets]
+            for key in by_sid[sid]:
+                _sid, rlzi, poe, imt, iml, trt_names = key
+                idx = (rlzi, oq.poes_disagg.index(poe), imts.index(imt))
+                imls[(sid,) + idx] = iml
+                for matrix, pmf in zip(matrices, results[key]):
+                    matrix[idx + tuple(slice(0, n) for n in pmf.shape)] = pmf
+            for dset, matrix in zip(dsets, matrices):
+                dset[sid] = matrix
+        self.datastore['disagg/iml'] = imls
+        # the edges are ragged and keyed by tuples, so they are pickled
+        bins = {(sm_id, sid): edges + (self.trt_names[sm_id],)
+                for (sm_id, sid), edges in self.bin_edges.items()}
+        self.datastore['disagg-bins'] = numpy.array(
+            pickle.dumps(bins, pickle.HIGHEST_PROTOCOL))
+        self.datastore.set_nbytes('disagg')
@@ -38,7 +38,8 @@ from openquake.commonlib.util import max_rel_diff_index, Rupture
 from openquake.risklib.riskinput import create
 from openquake.calculators import base
 from openquake.calculators.calc import gmvs_to_poe_map
-from openquake.calculators.classical import ClassicalCalculator
+from openquake.calculators.classical import (
+    ClassicalCalculator, extract_block)
 
 # ######################## rupture calculator ############################ #
 
@@ -612,6 +613,23 @@ class EventBasedCalculator(ClassicalCalculator):
             self.datastore.set_nbytes('gmf_data')
         return acc
 
+    def read_curves_block(self, result, start, stop):
+        """
+        Extract the block of sites [start, stop) from the probability maps
+        by realization computed from the GMFs.
+
+        :param result: a dictionary rlzi -> ProbabilityMap
+        :param start: index of the first site of the block
+        :param stop: index of the last site of the block + 1
+        :returns: a dictionary rlz -> array of stop - start curves
+        """
+        rlzs = self.rlzs_assoc.realizations
+        sids = range(start, stop)
+        return {rlzs[rlzi]: array_of_curves(
+                    extract_block(result[rlzi], sids), len(sids),
+                    self.oqparam.imtls)
+                for rlzi in result}
+
     def post_execute(self, result):
         """
         :param result:
@@ -622,12 +640,8 @@ class EventBasedCalculator(ClassicalCalculator):
         if not oq.hazard_curves_from_gmfs and not oq.ground_motion_fields:
             return
         elif oq.hazard_curves_from_gmfs:
-            rlzs = self.rlzs_assoc.realizations
-            dic = {}
-            for rlzi in result:
-                dic[rlzs[rlzi]] = array_of_curves(
-                    result[rlzi], len(self.sitecol), oq.imtls)
-            self.save_curves(dic)
+            self.save_curves_by_block(
+                functools.partial(self.read_curves_block, result))
         if oq.compare_with_classical:  # compute classical curves
             export_dir = os.path.join(oq.export_dir, 'cl')
             if not os.path.exists(export_dir):
@@ -324,7 +324,8 @@ class EventBasedRiskCalculator(base.RiskCalculator):
                 self.core_task.__func__,
                 ((riskinput, self.riskmodel, self.rlzs_assoc,
                   self.assetcol, self.monitor.new('task'))
-                 for riskinput in riskinputs))
+                 for riskinput in riskinputs),
+                checkpoint=self.get_checkpoint('event_based_risk'))
         return tm.reduce(agg=self.agg, posthook=self.save_data_transfer)
 
     def agg(self, acc, result):
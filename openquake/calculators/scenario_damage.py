@@ -16,13 +16,13 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
-import itertools
 import numpy
 
-from openquake.commonlib import parallel, riskmodels
 from openquake.risklib import scientific
+from openquake.commonlib import parallel, riskmodels
 from openquake.calculators import base
 
+U32 = numpy.uint32
 F32 = numpy.float32
 F64 = numpy.float64
 
@@ -37,14 +37,14 @@ def dist_by_asset(data, multi_stat_dt):
     out = numpy.zeros((N, R), multi_stat_dt)
     for l, lt in enumerate(multi_stat_dt.names):
         out_lt = out[lt]
-        for n, r in itertools.product(range(N), range(R)):
-            out_lt[n, r] = data[n, l, r]
+        out_lt['mean'] = data[:, l, :, 0]
+        out_lt['stddev'] = data[:, l, :, 1]
     return out
 
 
 def dist_by_taxon(data, multi_stat_dt):
     """
-    :param data: array of shape (T, L, R, ...)
+    :param data: array of shape (T, L, R, E, ...)
     :param multi_stat_dt: numpy dtype for statistical outputs
     :returns: array of shape (T, R) with records of type multi_stat_dt
     """
@@ -52,14 +52,14 @@ def dist_by_taxon(data, multi_stat_dt):
     out = numpy.zeros((T, R), multi_stat_dt)
     for l, lt in enumerate(multi_stat_dt.names):
         out_lt = out[lt]
-        for t, r in itertools.product(range(T), range(R)):
-            out_lt[t, r] = scientific.mean_std(data[t, l, r])
+        out_lt['mean'] = data[:, l].mean(axis=2)
+        out_lt['stddev'] = data[:, l].std(axis=2, ddof=1)
     return out
 
 
 def dist_total(data, multi_stat_dt):
     """
-    :param data: array of shape (T, L, R, ...)
+    :param data: array of shape (T, L, R, E, ...)
     :param multi_stat_dt: numpy dtype for statistical outputs
     :returns: array of shape (R,) with records of type multi_stat_dt
     """
@@ -68,8 +68,8 @@ def dist_total(data, multi_stat_dt):
     out = numpy.zeros(R, multi_stat_dt)
     for l, lt in enumerate(multi_stat_dt.names):
         out_lt = out[lt]
-        for r in range(R):
-            out_lt[r] = scientific.mean_std(total[l, r])
+        out_lt['mean'] = total[l].mean(axis=1)
+        out_lt['stddev'] = total[l].std(axis=1, ddof=1)
     return out
 
 
@@ -87,15 +87,17 @@ def scenario_damage(riskinput, riskmodel, rlzs_assoc, monitor):
     :param monitor:
         :class:`openquake.baselib.performance.Monitor` instance
     :returns:
-        a dictionary {'d_asset': [(l, r, a, mean-stddev), ...],
+        a dictionary {'d_asset': [(l, r, aids, (mean, stddev)), ...],
                       'd_taxonomy': damage array of shape T, L, R, E, D,
-                      'c_asset': [(l, r, a, mean-stddev), ...],
+                      'c_asset': [(l, r, aids, (mean, stddev)), ...],
                       'c_taxonomy': damage array of shape T, L, R, E}
 
     `d_asset` and `d_taxonomy` are related to the damage distributions
     whereas `c_asset` and `c_taxonomy` are the consequence distributions.
     If there is no consequence model `c_asset` is an empty list and
-    `c_taxonomy` is a zero-value array.
+    `c_taxonomy` is a zero-value array. For each loss type and realization
+    `aids` is an array of N asset ordinals and mean and stddev are arrays
+    of shape (N, D) for the damages and (N,) for the consequences.
     """
     c_models = monitor.consequence_models
     L = len(riskmodel.loss_types)
@@ -104,28 +106,38 @@ def scenario_damage(riskinput, riskmodel, rlzs_assoc, monitor):
     E = monitor.oqparam.number_of_ground_motion_fields
     T = len(monitor.taxonomies)
     taxo2idx = {taxo: i for i, taxo in enumerate(monitor.taxonomies)}
+    c_means = {}  # loss_type -> matrix T x D of mean consequence ratios
+    for loss_type, c_model in c_models.items():
+        if not c_model:
+            continue
+        c_means[loss_type] = means = numpy.zeros((T, D))
+        for taxo, t in taxo2idx.items():
+            # NB: the first column is 0 for the nodamage state
+            means[t, 1:] = [par[0] for par in c_model[taxo].params]
     result = dict(d_asset=[], d_taxon=numpy.zeros((T, L, R, E, D), F64),
                   c_asset=[], c_taxon=numpy.zeros((T, L, R, E), F64))
     for out_by_lr in riskmodel.gen_outputs(
             riskinput, rlzs_assoc, monitor):
         for (l, r), out in sorted(out_by_lr.items()):
-            c_model = c_models.get(out.loss_type)
-            for asset, fraction in zip(out.assets, out.damages):
-                t = taxo2idx[asset.taxonomy]
-                damages = fraction * asset.number
-                if c_model:  # compute consequences
-                    means = [par[0] for par in c_model[asset.taxonomy].params]
-                    # NB: we add a 0 in front for nodamage state
-                    c_ratio = numpy.dot(fraction, [0] + means)
-                    consequences = c_ratio * asset.value(out.loss_type)
-                    result['c_asset'].append(
-                        (l, r, asset.ordinal,
-                         scientific.mean_std(consequences)))
-                    result['c_taxon'][t, l, r, :] += consequences
-                    # TODO: consequences for the occupants
-                result['d_asset'].append(
-                    (l, r, asset.ordinal, scientific.mean_std(damages)))
-                result['d_taxon'][t, l, r, :] += damages
+            aids = numpy.array([asset.ordinal for asset in out.assets], U32)
+            taxis = numpy.array(
+                [taxo2idx[asset.taxonomy] for asset in out.assets])
+            fractions = numpy.array(out.damages)  # shape (N, E, D)
+            numbers = numpy.array([asset.number for asset in out.assets])
+            damages = fractions * numbers[:, None, None]
+            result['d_asset'].append(
+                (l, r, aids, scientific.mean_std(damages, axis=1)))
+            numpy.add.at(result['d_taxon'][:, l, r], taxis, damages)
+            if out.loss_type in c_means:  # compute consequences
+                values = numpy.array(
+                    [asset.value(out.loss_type) for asset in out.assets])
+                c_ratios = numpy.einsum(
+                    'ned,nd->ne', fractions, c_means[out.loss_type][taxis])
+                consequences = c_ratios * values[:, None]  # shape (N, E)
+                result['c_asset'].append(
+                    (l, r, aids, scientific.mean_std(consequences, axis=1)))
+                numpy.add.at(result['c_taxon'][:, l, r], taxis, consequences)
+                # TODO: consequences for the occupants
     return result
 
 
@@ -167,8 +179,9 @@ class ScenarioDamageCalculator(base.RiskCalculator):
                                                 ('stddev', (F32, D))])))
         multi_stat_dt = numpy.dtype(dt_list)
         d_asset = numpy.zeros((N, L, R, 2, D), F32)
-        for (l, r, a, stat) in result['d_asset']:
-            d_asset[a, l, r] = stat
+        for (l, r, aids, (mean, std)) in result['d_asset']:
+            d_asset[aids, l, r, 0] = mean
+            d_asset[aids, l, r, 1] = std
         self.datastore['dmg_by_asset'] = dist_by_asset(
             d_asset, multi_stat_dt)
         self.datastore['dmg_by_taxon'] = dist_by_taxon(
@@ -179,8 +192,9 @@ class ScenarioDamageCalculator(base.RiskCalculator):
         # consequence distributions
         if result['c_asset']:
             c_asset = numpy.zeros((N, L, R, 2), F32)
-            for (l, r, a, stat) in result['c_asset']:
-                c_asset[a, l, r] = stat
+            for (l, r, aids, (mean, std)) in result['c_asset']:
+                c_asset[aids, l, r, 0] = mean
+                c_asset[aids, l, r, 1] = std
             multi_stat_dt = numpy.dtype(
                 [(lt, [('mean', F32), ('stddev', F32)]) for lt in ltypes])
             self.datastore['csq_by_asset'] = dist_by_asset(
@@ -27,6 +27,7 @@ from openquake.calculators import base
 
 F32 = numpy.float32
 F64 = numpy.float64  # higher precision to avoid task order dependency
+U32 = numpy.uint32
 
 
 @parallel.litetask
@@ -45,31 +46,36 @@ def scenario_risk(riskinput, riskmodel, rlzs_assoc, monitor):
     :returns:
         a dictionary {
         'agg': array of shape (E, L, R, 2),
-        'avg': list of tuples (lt_idx, rlz_idx, asset_idx, statistics)
+        'avg': list of pairs (asset_ordinals, statistics)
         }
         where E is the number of simulated events, L the number of loss types,
-        R the number of realizations  and statistics is an array of shape
-        (n, R, 4), with n the number of assets in the current riskinput object
+        R the number of realizations and statistics is an array of shape
+        (n, L, R, 4), with n the number of assets in the current riskinput
+        object, sorted by ordinal
     """
     E = monitor.oqparam.number_of_ground_motion_fields
     L = len(riskmodel.loss_types)
     R = len(rlzs_assoc.realizations)
-    result = dict(agg=numpy.zeros((E, L, R, 2), F64), avg=[])
+    aids = numpy.array(sorted(asset.ordinal
+                              for assets in riskinput.assets_by_site
+                              for asset in assets), U32)
+    # this is ugly but using a composite array (i.e.
+    # stats['mean'], stats['stddev'], ...) may return
+    # bogus numbers! even with the SAME version of numpy,
+    # hdf5 and h5py!! the numbers are around 1E-300 and
+    # different on different systems; we found issues
+    # with Ubuntu 12.04 and Red Hat 7 (MS and DV)
+    stats = numpy.zeros((len(aids), L, R, 4), F32)
+    result = dict(agg=numpy.zeros((E, L, R, 2), F64), avg=[(aids, stats)])
     for out_by_lr in riskmodel.gen_outputs(riskinput, rlzs_assoc, monitor):
         for (l, r), out in sorted(out_by_lr.items()):
-            stats = numpy.zeros((len(out.assets), 4), F32)
-            # this is ugly but using a composite array (i.e.
-            # stats['mean'], stats['stddev'], ...) may return
-            # bogus numbers! even with the SAME version of numpy,
-            # hdf5 and h5py!! the numbers are around 1E-300 and
-            # different on different systems; we found issues
-            # with Ubuntu 12.04 and Red Hat 7 (MS and DV)
-            stats[:, 0] = out.loss_matrix.mean(axis=1)
-            stats[:, 1] = out.loss_matrix.std(ddof=1, axis=1)
-            stats[:, 2] = out.insured_loss_matrix.mean(axis=1)
-            stats[:, 3] = out.insured_loss_matrix.std(ddof=1, axis=1)
-            for asset, stat in zip(out.assets, stats):
-                result['avg'].append((l, r, asset.ordinal, stat))
+            idx = numpy.searchsorted(
+                aids, [asset.ordinal for asset in out.assets])
+            stats[idx, l, r, 0] = out.loss_matrix.mean(axis=1)
+            stats[idx, l, r, 1] = out.loss_matrix.std(ddof=1, axis=1)
+            stats[idx, l, r, 2] = out.insured_loss_matrix.mean(axis=1)
+            stats[idx, l, r, 3] = out.insured_loss_matrix.std(
+                ddof=1, axis=1)
             result['agg'][:, l, r, 0] += out.aggregate_losses
             result['agg'][:, l, r, 1] += out.insured_losses
     return result
@@ -127,7 +133,29 @@ class ScenarioRiskCalculator(base.RiskCalculator):
 
             # average losses
             avglosses = numpy.zeros((N, R), multi_stat_dt)
-            for (l, r, aid, stat) in result['avg']:
-                avglosses[ltypes[l]][aid, r] = stat
+            for aids, stats in result['avg']:
+                for l, lt in enumerate(ltypes):
+                    for i, name in enumerate(stat_dt.names):
+                        avglosses[lt][name][aids] = stats[:, l, :, i]
             self.datastore['losses_by_asset'] = avglosses
             self.datastore['agglosses-rlzs'] = agglosses
+
+        if self.oqparam.agg_losses_per_event:
+            self.save_agg_losses(result['agg'])
+
+    def save_agg_losses(self, agg):
+        """
+        Save the aggregate losses per event as an array of shape (E, R, 2)
+
+        :param agg: an array of shape (E, L, R, 2)
+        """
+        ltypes = self.riskmodel.loss_types
+        with self.monitor('saving agg_losses-rlzs', autoflush=True):
+            E, R = agg.shape[0], agg.shape[2]
+            loss_dt = numpy.dtype([(lt, F32) for lt in ltypes])
+            agg_losses = numpy.zeros((E, R, 2), loss_dt)
+            for l, lt in enumerate(ltypes):
+                agg_losses[lt][:, :, 0] = agg[:, l, :, 0]
+                if self.oqparam.insured_losses:
+                    agg_losses[lt][:, :, 1] = agg[:, l, :, 1]
+            self.datastore['agg_losses-rlzs'] = agg_losses
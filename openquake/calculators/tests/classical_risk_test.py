@@ -66,6 +66,17 @@ class ClassicalRiskTestCase(CalculatorTestCase):
         [fname] = out['loss_curves-rlzs', 'csv']
         self.assertEqualFiles('expected/loss_curves-000.csv', fname)
 
+    @attr('qa', 'risk', 'classical_risk')
+    def test_case_3_checkpoints(self):
+        # a new calculation with checkpoints and a precalculator sharing
+        # the datastore: the precalculator must not resume the calculation
+        out = self.run_calc(case_3.__file__, 'job.ini', exports='csv',
+                            checkpoints='true')
+        [fname] = out['loss_curves-rlzs', 'csv']
+        self.assertEqualFiles('expected/loss_curves-000.csv', fname)
+        self.assertEqual(sorted(self.calc.datastore['checkpoints']),
+                         ['classical', 'classical_risk'])
+
     @attr('qa', 'risk', 'classical_risk')
     def test_case_4(self):
         out = self.run_calc(case_4.__file__, 'job_haz.ini,job_risk.ini',
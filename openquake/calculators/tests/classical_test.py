@@ -163,6 +163,29 @@ hazard_uhs-smltp_SM2_a3pt2b0pt8-gsimltp_CB2008_@.csv'''.split(),
         self.assertEqualFiles('expected/hazard_uhs-mean-0.1.xml', fnames[1])
         self.assertEqualFiles('expected/hazard_uhs-mean-0.2.xml', fnames[2])
 
+    @attr('qa', 'hazard', 'classical')
+    def test_case_15_by_block(self):  # 3 sites in 2 blocks
+        self.assert_curves_ok('''\
+hazard_curve-mean.csv
+hazard_curve-smltp_SM1-gsimltp_BA2008_C2003.csv
+hazard_curve-smltp_SM1-gsimltp_BA2008_T2002.csv
+hazard_curve-smltp_SM1-gsimltp_CB2008_C2003.csv
+hazard_curve-smltp_SM1-gsimltp_CB2008_T2002.csv
+hazard_curve-smltp_SM2_a3b1-gsimltp_BA2008_@.csv
+hazard_curve-smltp_SM2_a3b1-gsimltp_CB2008_@.csv
+hazard_curve-smltp_SM2_a3pt2b0pt8-gsimltp_BA2008_@.csv
+hazard_curve-smltp_SM2_a3pt2b0pt8-gsimltp_CB2008_@.csv
+hazard_uhs-mean.csv
+hazard_uhs-smltp_SM1-gsimltp_BA2008_C2003.csv
+hazard_uhs-smltp_SM1-gsimltp_BA2008_T2002.csv
+hazard_uhs-smltp_SM1-gsimltp_CB2008_C2003.csv
+hazard_uhs-smltp_SM1-gsimltp_CB2008_T2002.csv
+hazard_uhs-smltp_SM2_a3b1-gsimltp_BA2008_@.csv
+hazard_uhs-smltp_SM2_a3b1-gsimltp_CB2008_@.csv
+hazard_uhs-smltp_SM2_a3pt2b0pt8-gsimltp_BA2008_@.csv
+hazard_uhs-smltp_SM2_a3pt2b0pt8-gsimltp_CB2008_@.csv'''.split(),
+                              case_15.__file__, sites_per_block='2')
+
     @attr('qa', 'hazard', 'classical')
     def test_case_16(self):   # sampling
         self.assert_curves_ok(
@@ -16,10 +16,102 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
+import unittest
+import collections
+import numpy
+from scipy.stats import truncnorm
 from nose.plugins.attrib import attr
+
+from openquake.baselib.performance import Monitor
+from openquake.hazardlib import const
+from openquake.hazardlib.geo import Point
+from openquake.hazardlib.geo.surface.planar import PlanarSurface
+from openquake.hazardlib.gsim.base import ContextMaker
+from openquake.hazardlib.gsim.sadigh_1997 import SadighEtAl1997
+from openquake.hazardlib.imt import PGA
+from openquake.hazardlib.site import Site, SiteCollection
+from openquake.hazardlib.source.point import PointSource
+from openquake.hazardlib.source.rupture import ParametricProbabilisticRupture
+from openquake.hazardlib.calc import disagg
+from openquake.hazardlib.tom import PoissonTOM
+from openquake.calculators.disaggregation import (
+    _disaggregate_poes, _collect_bins_data)
 from openquake.calculators.tests import CalculatorTestCase, check_platform
 from openquake.qa_tests_data.disagg import case_1, case_2
 
+FakeSource = collections.namedtuple(
+    'FakeSource', 'source_id tectonic_region_type')
+TRT = const.TRT.ACTIVE_SHALLOW_CRUST
+
+
+class DisaggregatePoesTestCase(unittest.TestCase):
+    # compare the vectorized disaggregation for a rupture affecting
+    # several sites with hazardlib's disaggregate_poe called site by site
+
+    def setUp(self):
+        surface = PlanarSurface.from_corner_points(
+            1., Point(0., 0., 5.), Point(0., 0.2, 5.),
+            Point(0., 0.2, 15.), Point(0., 0., 15.))
+        self.rupture = ParametricProbabilisticRupture(
+            6.5, 0., TRT, Point(0., 0.1, 10.), surface, PointSource,
+            0.01, PoissonTOM(50.))
+        self.sitecol = SiteCollection([
+            Site(Point(lon, 0.1), 760., True, 100., 1.)
+            for lon in (0.1, 0.3, 0.5)])
+        self.gsim = SadighEtAl1997()
+        self.tl = 3.
+        self.n_epsilons = 3  # epsilon edges -3, -1, 1, 3
+        self.distribution = truncnorm(-self.tl, self.tl)
+        self.cdf_edges = self.distribution.cdf(numpy.linspace(
+            -self.tl, self.tl, self.n_epsilons + 1))
+        sctx, rctx, dctx = ContextMaker([self.gsim]).make_contexts(
+            self.sitecol, self.rupture)
+        mean, [stddev] = self.gsim.get_mean_and_stddevs(
+            sctx, rctx, dctx, PGA(), [const.StdDev.TOTAL])
+        # IMLs of shape (N, R, P, M) = (3, 1, 2, 1), different for each
+        # site, falling inside the central and the first epsilon bin
+        self.imls = numpy.zeros((3, 1, 2, 1))
+        self.imls[:, 0, 0, 0] = numpy.exp(mean + 0.5 * stddev)
+        self.imls[:, 0, 1, 0] = numpy.exp(mean - 2.5 * stddev)
+
+    def test_disaggregate_poes(self):
+        sctx, rctx, dctx = ContextMaker([self.gsim]).make_contexts(
+            self.sitecol, self.rupture)
+        poes = _disaggregate_poes(
+            self.gsim, sctx, rctx, dctx, [PGA()], self.imls,
+            self.distribution, self.cdf_edges)
+        self.assertEqual(poes.shape, (3, 1, 2, 1, 3))
+        for i in range(3):
+            for p in range(2):
+                expected = self.gsim.disaggregate_poe(
+                    sctx, rctx, dctx, PGA(), self.imls[i, 0, p, 0],
+                    self.tl, self.n_epsilons)[i]
+                numpy.testing.assert_allclose(poes[i, 0, p, 0], expected)
+        # the IMLs inside a bin give a partial contribution to that bin
+        self.assertGreater(poes[0, 0, 0, 0, 1], 0)
+        self.assertLess(poes[0, 0, 0, 0, 1], poes[0, 0, 1, 0, 1])
+
+    def test_sids_as_positions(self):
+        # the rupture affects only the first and the last site: the
+        # sids of the filtered collection must be used as positions in
+        # the array of IMLs and as keys of the result
+        r_sites = self.sitecol.filter(numpy.array([True, False, True]))
+        source = FakeSource('src', TRT)
+        bdata = _collect_bins_data(
+            {TRT: 0}, [(source, self.rupture, r_sites)], [self.imls],
+            [self.gsim], {'PGA': [0.01, 0.1, 1.]}, self.tl,
+            self.n_epsilons, Monitor())
+        self.assertEqual(sorted(bdata), [0, 2])
+        sctx, rctx, dctx = ContextMaker([self.gsim]).make_contexts(
+            self.sitecol, self.rupture)
+        poes = _disaggregate_poes(
+            self.gsim, sctx, rctx, dctx, [PGA()], self.imls,
+            self.distribution, self.cdf_edges)
+        pnes = self.rupture.get_probability_no_exceedance(poes)
+        for sid in (0, 2):
+            numpy.testing.assert_allclose(bdata[sid].pnes[0], pnes[sid])
+            numpy.testing.assert_allclose(bdata[sid].dists, [dctx.rjb[sid]])
+
 
 class DisaggregationTestCase(CalculatorTestCase):
 
@@ -57,3 +149,24 @@ class DisaggregationTestCase(CalculatorTestCase):
              'poe-0.1-rlz-2-PGA-0.0-0.0.xml',
              'poe-0.1-rlz-3-PGA-0.0-0.0.xml'],
             case_2.__file__)
+
+    @attr('qa', 'hazard', 'classical')
+    def test_case_1_datastore_layout(self):
+        # check the disagg/* datasets and the pickled disagg-bins,
+        # then export them with the XML exporter
+        check_platform('trusty', 'xenial')
+        out = self.run_calc(case_1.__file__, 'job.ini', exports='xml')
+        dstore = self.calc.datastore
+        imls = dstore['disagg/iml'].value
+        self.assertEqual(imls.shape, (2, 1, 2, 2))  # (N, R, P, M)
+        # only the first site has disaggregation results
+        self.assertFalse(numpy.isnan(imls[0]).any())
+        self.assertTrue(numpy.isnan(imls[1]).all())
+        for dim_labels in disagg.pmf_map:
+            dset = dstore['disagg/' + '_'.join(dim_labels)]
+            self.assertEqual(dset.shape[:4], imls.shape)
+        bins = dstore['disagg-bins']
+        self.assertEqual(list(bins), [(0, 0)])
+        mags, dists, lons, lats, eps, trts = bins[0, 0]
+        self.assertEqual(len(eps) - 1, dstore['oqparam'].num_epsilon_bins)
+        self.assertEqual(len(out['disagg', 'xml']), 4)
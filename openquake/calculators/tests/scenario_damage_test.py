@@ -18,6 +18,8 @@
 
 import os
 import unittest
+import mock
+import numpy
 from nose.plugins.attrib import attr
 
 from openquake.qa_tests_data.scenario_damage import (
@@ -25,6 +27,7 @@ from openquake.qa_tests_data.scenario_damage import (
     case_6, case_7)
 
 from openquake.calculators.tests import CalculatorTestCase
+from openquake.calculators.scenario_damage import scenario_damage
 
 try:
     from shapely.geos import geos_version
@@ -107,3 +110,59 @@ class ScenarioDamageTestCase(CalculatorTestCase):
     def test_case_7(self):
         # this is a case with three loss types
         self.assert_ok(case_7, 'job_h.ini,job_r.ini', exports='csv')
+
+
+class ScenarioDamageTaskTestCase(unittest.TestCase):
+    # compare the vectorized task with a loop on the assets
+
+    def test_small_case(self):
+        E, D = 3, 3  # 3 events, 3 damage states
+        taxonomies = ['RC', 'RM']
+        csq_params = {'RC': [(0.1, 0), (0.6, 0)], 'RM': [(0.2, 0), (0.9, 0)]}
+        c_model = {taxo: mock.Mock(params=params)
+                   for taxo, params in csq_params.items()}
+        fractions = numpy.random.RandomState(42).dirichlet(
+            numpy.ones(D), (4, E))  # shape (4, E, D)
+        assets = [mock.Mock(ordinal=aid, taxonomy=taxo, number=number,
+                            value=mock.Mock(return_value=value))
+                  for aid, taxo, number, value in [
+                      (0, 'RM', 10, 1000.), (1, 'RC', 1, 500.),
+                      (2, 'RC', 3, 200.), (3, 'RM', 2, 700.)]]
+        # the assets are split in two groups, as by gen_outputs
+        outputs = [{(0, 0): mock.Mock(assets=assets[i:i + 2],
+                                      damages=fractions[i:i + 2],
+                                      loss_type='structural')}
+                   for i in (0, 2)]
+        riskmodel = mock.Mock(loss_types=['structural'],
+                              damage_states=['no_damage', 'ds1', 'ds2'])
+        riskmodel.gen_outputs.return_value = iter(outputs)
+        rlzs_assoc = mock.Mock(realizations=[0])
+        monitor = mock.Mock(consequence_models=dict(structural=c_model),
+                            taxonomies=taxonomies)
+        monitor.oqparam.number_of_ground_motion_fields = E
+        res = scenario_damage.task_func(
+            mock.Mock(), riskmodel, rlzs_assoc, monitor)
+
+        # loop on the assets
+        d_taxon = numpy.zeros((2, E, D))
+        c_taxon = numpy.zeros((2, E))
+        d_asset, c_asset = {}, {}
+        for asset, fraction in zip(assets, fractions):
+            t = taxonomies.index(asset.taxonomy)
+            damages = fraction * asset.number
+            means = [0] + [par[0] for par in csq_params[asset.taxonomy]]
+            csq = fraction.dot(means) * asset.value('structural')
+            d_asset[asset.ordinal] = (damages.mean(axis=0),
+                                      damages.std(axis=0, ddof=1))
+            c_asset[asset.ordinal] = csq.mean(), csq.std(ddof=1)
+            d_taxon[t] += damages
+            c_taxon[t] += csq
+
+        aac = numpy.testing.assert_allclose
+        aac(res['d_taxon'][:, 0, 0], d_taxon)
+        aac(res['c_taxon'][:, 0, 0], c_taxon)
+        for key, expected in [('d_asset', d_asset), ('c_asset', c_asset)]:
+            for _, _, aids, (mean, std) in res[key]:
+                for aid, m, s in zip(aids, mean, std):
+                    aac(m, expected[aid][0])
+                    aac(s, expected[aid][1])
@@ -31,10 +31,15 @@ class ScenarioRiskTestCase(CalculatorTestCase):
 
     @attr('qa', 'risk', 'scenario_risk')
     def test_case_1(self):
-        out = self.run_calc(case_1.__file__, 'job_risk.ini', exports='csv')
+        out = self.run_calc(case_1.__file__, 'job_risk.ini', exports='csv',
+                            agg_losses_per_event='true')
         [fname] = out['agglosses-rlzs', 'csv']
         self.assertEqualFiles('expected/agg.csv', fname)
 
+        # check the aggregate losses per event
+        [fname] = out['agg_losses-rlzs', 'csv']
+        self.assertEqualFiles('expected/agg_losses-rlz000.csv', fname)
+
         # check the exported GMFs
         [gmf1, gmf2] = export(('gmfs:0,1', 'csv'), self.calc.datastore)
         self.assertEqualFiles('expected/gmf1.csv', gmf1)
@@ -17,9 +17,19 @@
 #  along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
 
 import h5py
+import numpy
 import unittest
+from openquake.hazardlib.geo.point import Point
+from openquake.hazardlib.geo.geodetic import geodetic_distance
+from openquake.hazardlib.scalerel.wc1994 import WC1994
+from openquake.hazardlib.site import Site, SiteCollection
+from openquake.hazardlib.tom import PoissonTOM
 from openquake.qa_tests_data import ucerf
 from openquake.calculators.tests import CalculatorTestCase
+from openquake.calculators.ucerf_event_based import (
+    RuptureCache, HDD, NPD, bg_rupture_dt, get_horizontal_reach,
+    sample_background_points, filter_background_ruptures,
+    build_background_ruptures, sample_background_model)
 
 
 class UcerfTestCase(CalculatorTestCase):
@@ -30,3 +40,108 @@ class UcerfTestCase(CalculatorTestCase):
         num_exported = len(out['gmf_data', 'txt'])
         # just check that two realizations are exported
         self.assertEqual(num_exported, 2)
+
+
+class RuptureCacheTestCase(unittest.TestCase):
+    def test_eviction(self):
+        cache = RuptureCache(maxbytes=10)
+        self.assertEqual(cache.get('a', lambda: ('A', 4)), 'A')
+        self.assertEqual(cache.get('b', lambda: ('B', 4)), 'B')
+        # 'a' is used again, so 'b' is the least recently used object
+        self.assertEqual(cache.get('a', lambda: ('X', 4)), 'A')
+        self.assertEqual(cache.get('c', lambda: ('C', 4)), 'C')
+        self.assertEqual(list(cache.data), ['a', 'c'])
+        self.assertEqual(cache.nbytes, 8)
+
+
+class BackgroundFilterTestCase(unittest.TestCase):
+    # three background points: one at the site, one close to the
+    # integration distance and one very far away
+    locations = numpy.array([[0., 0.], [0.5, 0.], [2., 0.]])
+    sites = SiteCollection([Site(Point(0., 0.), 760., True, 100., 1.)])
+    usd, lsd = 0., 15.
+    mag = 7.
+
+    def setUp(self):
+        depths = numpy.array([depth for _prob, depth in HDD.data])
+        self.reaches = {}  # (dip, rake) -> horizontal reach per depth
+        for _prob, np in NPD.data:
+            self.reaches[np.dip, np.rake] = dict(zip(
+                depths, get_horizontal_reach(
+                    self.mag, np, depths, WC1994(), 1.5, self.usd,
+                    self.lsd)))
+        self.dist = geodetic_distance(0., 0., 0.5, 0.)  # ~55.6 km
+        # the second point is beyond the integration distance, but the
+        # ruptures are within it when their extent is considered
+        min_reach = min(min(r.values()) for r in self.reaches.values())
+        self.integration_distance = self.dist - min_reach / 2.
+        assert self.dist > self.integration_distance
+
+    def test_filter_background_ruptures(self):
+        numpy.random.seed(42)
+        array = sample_background_points(
+            self.locations, numpy.ones(3), self.mag, NPD, HDD)
+        ok = filter_background_ruptures(
+            array, self.sites, self.integration_distance, NPD,
+            self.usd, self.lsd)
+        numpy.testing.assert_equal(ok, [True, True, False])
+        for rec in array[:2]:
+            reach = self.reaches[rec['dip'], rec['rake']][rec['depth']]
+            dist = geodetic_distance(0., 0., rec['lon'], rec['lat'])
+            self.assertLessEqual(dist - reach, self.integration_distance)
+
+        # no filtering without sites
+        ok = filter_background_ruptures(
+            array, None, self.integration_distance, NPD, self.usd, self.lsd)
+        numpy.testing.assert_equal(ok, [True, True, True])
+
+    def test_sample_background_model(self):
+        hdf5 = {'Grid/Magnitudes': numpy.array([6., self.mag]),
+                'Grid/RateArray': numpy.ones((3, 2)),
+                'Grid/Locations': self.locations}
+        filter_idx = numpy.arange(3)
+        tom = PoissonTOM(50.)
+
+        def sample(integration_distance):
+            numpy.random.seed(42)
+            return sample_background_model(
+                hdf5, tom, filter_idx, self.mag, NPD, HDD, self.usd,
+                self.lsd, sites=self.sites,
+                integration_distance=integration_distance)
+
+        all_rups, all_occ = sample(None)
+        rups, occ = sample(self.integration_distance)
+        self.assertEqual(len(all_rups), 3)
+        # the filtering happens after the sampling, so the random draws
+        # are the same and the far away rupture is simply discarded
+        self.assertEqual(len(rups), 2)
+        self.assertEqual(occ, all_occ[:2])
+        for rup, all_rup in zip(rups, all_rups):
+            self.assertEqual(rup.hypocenter, all_rup.hypocenter)
+            self.assertEqual(rup.mag, all_rup.mag)
+            self.assertEqual(rup.rake, all_rup.rake)
+            self.assertEqual(rup.surface.get_dip(),
+                             all_rup.surface.get_dip())
+
+    def test_conservative(self):
+        # the ruptures discarded by the filter must be farther than the
+        # integration distance from the site, also for the large ruptures
+        # near the surface or near the lower seismogenic depth, which are
+        # shifted to fit in the seismogenic layer
+        integration_distance = 50.
+        array = numpy.array([
+            (lon, 0., depth, mag, np.strike, np.dip, np.rake, 1., 1)
+            for lon in numpy.arange(0.3, 1.5, 0.04)  # from 33 to 163 km
+            for depth in (1., 14.) for mag in (7., 7.5)
+            for _prob, np in NPD.data], bg_rupture_dt)
+        ok = filter_background_ruptures(
+            array, self.sites, integration_distance, NPD,
+            self.usd, self.lsd)
+        rups = build_background_ruptures(
+            PoissonTOM(50.), array, self.usd, self.lsd)
+        rrup = numpy.array([rup.surface.get_min_distance(self.sites.mesh)[0]
+                            for rup in rups])
+        close = rrup <= integration_distance
+        self.assertTrue(close.any())
+        self.assertFalse(ok.all())
+        self.assertTrue(ok[close].all())
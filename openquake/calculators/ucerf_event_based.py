@@ -23,6 +23,7 @@ import logging
 import math
 import random
 import functools
+import collections
 import h5py
 import numpy
 
@@ -53,6 +54,12 @@ from openquake.commonlib.sourceconverter import SourceConverter
 U16 = numpy.uint16
 U32 = numpy.uint32
 F32 = numpy.float32
+F64 = numpy.float64
+
+# memory budget of the RuptureCache and rough size of a PlanarSurface
+# object, including its mesh
+CACHE_MAXBYTES = 512 * 1024 ** 2
+PLANE_NBYTES = 4096
 
 # DEFAULT VALUES FOR UCERF BACKGROUND MODELS
 DEFAULT_MESH_SPACING = 1.0
@@ -72,7 +79,73 @@ NPD = PMF([(0.15, NodalPlane(0.0, 90.0, 0.0)),
            (0.05, NodalPlane(325.0, 45.0, 90.))])
 
 
-def prefilter_ruptures(hdf5, ridx, idx_set, sites, integration_distance):
+class RuptureCache(object):
+    """
+    Cache for the arrays read from the UCERF file and for the surfaces
+    built from them, to be used inside a task. When the approximate size
+    of the cached objects exceeds `maxbytes` the least recently used
+    objects are discarded.
+
+    :param maxbytes: the memory budget of the cache, in bytes
+    """
+    def __init__(self, maxbytes=CACHE_MAXBYTES):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.data = collections.OrderedDict()  # key -> (value, nbytes)
+
+    def get(self, key, build):
+        """
+        :param key: the key of the object
+        :param build: a function returning a pair (object, nbytes)
+        :returns: the cached object, built if missing
+        """
+        try:
+            value, nbytes = self.data.pop(key)
+        except KeyError:
+            value, nbytes = build()
+            self.nbytes += nbytes
+            while self.nbytes > self.maxbytes and self.data:
+                _key, (_value, size) = self.data.popitem(last=False)
+                self.nbytes -= size
+        self.data[key] = (value, nbytes)  # move at the end of the queue
+        return value
+
+    def get_array(self, hdf5, path, dtype=None):
+        """
+        :param hdf5: the UCERF file, as an open h5py.File object
+        :param path: the path of a dataset in the UCERF file
+        :param dtype: if given, convert the array to the given dtype
+        :returns: the array stored in the dataset
+        """
+        def build():
+            array = hdf5[path][:]
+            if dtype is not None:
+                array = array.astype(dtype)
+            return array, array.nbytes
+        return self.get(path, build)
+
+
+def get_centroids(hdf5, ridx, idx_set, cache):
+    """
+    :param hdf5:
+        Source of UCERF file as h5py.File object
+    :param list ridx:
+        List of indices composing the rupture sections
+    :param dict idx_set:
+        Set of indices for the branch
+    :param cache:
+        a :class:`RuptureCache` instance
+    :returns:
+        an array with the centroids of all the sections of the rupture
+    """
+    return numpy.concatenate([
+        cache.get_array(hdf5, "{:s}/{:s}/Centroids".format(
+            idx_set["sec_idx"], str(idx)), "float64")
+        for idx in ridx])
+
+
+def prefilter_ruptures(hdf5, ridx, idx_set, sites, integration_distance,
+                       cache=None):
     """
     Determines if a rupture is likely to be inside the integration distance
     by considering the set of fault plane centroids.
@@ -87,48 +160,39 @@ def prefilter_ruptures(hdf5, ridx, idx_set, sites, integration_distance):
         Sites for consideration (can be None!)
     :param float integration_distance:
         Maximum distance from rupture to site for consideration
+    :param cache:
+        a :class:`RuptureCache` instance (if None, a new one is used)
     """
     # Generate array of sites
     if not sites:
         return True
-    centroids = numpy.array([[0., 0., 0.]], dtype="f")
-    for idx in ridx:
-        trace_idx = "{:s}/{:s}".format(idx_set["sec_idx"], str(idx))
-        centroids = numpy.vstack([
-            centroids,
-            hdf5[trace_idx + "/Centroids"][:].astype("float64")])
-    centroids = centroids[1:, :]
+    centroids = get_centroids(hdf5, ridx, idx_set, cache or RuptureCache())
     distance = min_geodetic_distance(centroids[:, 0], centroids[:, 1],
                                      sites.lons, sites.lats)
     return numpy.any(distance <= integration_distance)
 
 
-def get_ucerf_rupture(hdf5, iloc, idx_set, tom, sites,
-                      integration_distance, mesh_spacing=DEFAULT_MESH_SPACING,
-                      trt=DEFAULT_TRT):
+def build_ucerf_surface(hdf5, ridx, idx_set, mesh_spacing, cache):
     """
     :param hdf5:
         Source Model hdf5 object as instance of :class: h5py.File
-    :param int iloc:
-        Location of the rupture plane in the hdf5 file
+    :param list ridx:
+        List of indices composing the rupture sections
     :param dict idx_set:
         Set of indices for the branch
-    Generates a rupture set from a sample of the background model
-    :param tom:
-        Temporal occurrence model as instance of :class:
-        openquake.hazardlib.tom.TOM
-    :param sites:
-        Sites for consideration (can be None!)
+    :param float mesh_spacing:
+        Spacing (km) of fault mesh
+    :param cache:
+        a :class:`RuptureCache` instance
+    :returns:
+        a triple (MultiSurface, hypocentre, approximate size in bytes)
     """
-    ridx = hdf5[idx_set["geol_idx"] + "/RuptureIndex"][iloc]
     surface_set = []
-    if not prefilter_ruptures(
-            hdf5, ridx, idx_set, sites, integration_distance):
-        return None, None
     for idx in ridx:
         # Build simple fault surface
         trace_idx = "{:s}/{:s}".format(idx_set["sec_idx"], str(idx))
-        rup_plane = hdf5[trace_idx + "/RupturePlanes"][:].astype("float64")
+        rup_plane = cache.get_array(
+            hdf5, trace_idx + "/RupturePlanes", "float64")
         for jloc in range(0, rup_plane.shape[2]):
             top_left = Point(rup_plane[0, 0, jloc],
                              rup_plane[0, 1, jloc],
@@ -152,15 +216,63 @@ def get_ucerf_rupture(hdf5, iloc, idx_set, tom, sites,
             except ValueError as evl:
                 raise ValueError(evl, trace_idx, top_left, top_right,
                                  bottom_right, bottom_left)
+    hypocentre = surface_set[len(surface_set) // 2].get_middle_point()
+    return (MultiSurface(surface_set), hypocentre,
+            len(surface_set) * PLANE_NBYTES)
+
+
+def get_ucerf_rupture(hdf5, iloc, idx_set, tom, sites,
+                      integration_distance, mesh_spacing=DEFAULT_MESH_SPACING,
+                      trt=DEFAULT_TRT, cache=None, section_distances=None):
+    """
+    :param hdf5:
+        Source Model hdf5 object as instance of :class: h5py.File
+    :param int iloc:
+        Location of the rupture plane in the hdf5 file
+    :param dict idx_set:
+        Set of indices for the branch
+    Generates a rupture set from a sample of the background model
+    :param tom:
+        Temporal occurrence model as instance of :class:
+        openquake.hazardlib.tom.TOM
+    :param sites:
+        Sites for consideration (can be None!)
+    :param cache:
+        a :class:`RuptureCache` instance (if None, a new one is used);
+        the surfaces of the ruptures sampled many times are built once
+    :param section_distances:
+        if given, an array with the minimum distance of each section from
+        the sites, used instead of the centroids to prefilter the rupture
+    """
+    if cache is None:
+        cache = RuptureCache()
+
+    def read_ridx():
+        ridx = hdf5[idx_set["geol_idx"] + "/RuptureIndex"][iloc]
+        return ridx, ridx.nbytes
+    ridx = cache.get((idx_set["geol_idx"], iloc), read_ridx)
+    if section_distances is not None:
+        if section_distances[ridx].min() > integration_distance:
+            return None, None
+    elif not prefilter_ruptures(
+            hdf5, ridx, idx_set, sites, integration_distance, cache):
+        return None, None
+
+    def build():
+        surface, hypocentre, nbytes = build_ucerf_surface(
+            hdf5, ridx, idx_set, mesh_spacing, cache)
+        return (surface, hypocentre), nbytes
+    surface, hypocentre = cache.get(
+        (idx_set["geol_idx"], idx_set["sec_idx"], iloc, mesh_spacing), build)
 
     rupture = ParametricProbabilisticRupture(
-        hdf5[idx_set["mag_idx"]][iloc],  # Magnitude
-        hdf5[idx_set["rake_idx"]][iloc],  # Rake
+        cache.get_array(hdf5, idx_set["mag_idx"])[iloc],  # Magnitude
+        cache.get_array(hdf5, idx_set["rake_idx"])[iloc],  # Rake
         trt,  # Tectonic Region Type
-        surface_set[len(surface_set)/2].get_middle_point(),  # Hypocentre
-        MultiSurface(surface_set),
+        hypocentre,  # Hypocentre
+        surface,
         CharacteristicFaultSource,
-        hdf5[idx_set["rate_idx"]][iloc],  # Rate of events
+        cache.get_array(hdf5, idx_set["rate_idx"])[iloc],  # Rate of events
         tom)
 
     # Get rupture index code string
@@ -316,6 +428,146 @@ def get_rupture_surface(mag, nodal_plane, hypocenter, msr,
                          left_top, right_top, right_bottom, left_bottom)
 
 
+# the point ruptures sampled from the background model, stored as arrays
+bg_rupture_dt = numpy.dtype([
+    ('lon', F64), ('lat', F64), ('depth', F64), ('mag', F64),
+    ('strike', F64), ('dip', F64), ('rake', F64), ('rate', F64),
+    ('n_occ', U32)])
+
+
+def sample_background_points(locations, occurrence, mag, npd, hdd):
+    """
+    :param numpy.ndarray locations:
+        Array of locations [Longitude, Latitude] of the point sources
+    :param numpy.ndarray occurrence:
+        Annual rates of occurrence
+    :param float mag:
+        Magnitude
+    :param npd:
+        Nodal plane distribution as instance of :class:
+        openquake.hazardlib.pmf.PMF
+    :param hdd:
+        Hypocentral depth distribution as instance of :class:
+        openquake.hazardlib.pmf.PMF
+    :returns:
+        an array of dtype bg_rupture_dt, with a sampled hypocentral depth
+        and nodal plane for each location; the field n_occ is not set
+    """
+    n_vals = len(locations)
+    depths = hdd.sample_pairs(n_vals)
+    nodal_planes = npd.sample_pairs(n_vals)
+    array = numpy.zeros(n_vals, bg_rupture_dt)
+    if n_vals == 0:
+        return array
+    array['lon'] = locations[:, 0]
+    array['lat'] = locations[:, 1]
+    array['depth'] = [depth for _prob, depth in depths]
+    array['mag'] = mag
+    array['strike'] = [np.strike for _prob, np in nodal_planes]
+    array['dip'] = [np.dip for _prob, np in nodal_planes]
+    array['rake'] = [np.rake for _prob, np in nodal_planes]
+    array['rate'] = (occurrence *
+                     numpy.array([prob for prob, _np in nodal_planes]) *
+                     numpy.array([prob for prob, _depth in depths]))
+    return array
+
+
+def get_horizontal_reach(mag, nodal_plane, depths, msr, rupture_aspect_ratio,
+                         upper_seismogenic_depth, lower_seismogenic_depth):
+    """
+    Calculate an upper limit for the horizontal distance between the
+    epicentre and the points of the ruptures built by
+    :func:`get_rupture_surface`, i.e. the half diagonal of the surface
+    projection plus the horizontal shift of the rupture centre needed
+    to fit the rupture inside the seismogenic layer.
+
+    :param nodal_plane:
+        Instance of :class:`openquake.hazardlib.geo.nodalplane.NodalPlane`.
+    :param depths:
+        an array of hypocentral depths
+    :returns:
+        an array of distances in km, one per depth
+    """
+    rup_length, rup_width = get_rupture_dimensions(
+        mag, nodal_plane, msr, rupture_aspect_ratio, upper_seismogenic_depth,
+        lower_seismogenic_depth)
+    rdip = math.radians(nodal_plane.dip)
+    hheight = rup_width * math.sin(rdip) / 2
+    rup_proj_width = rup_width * math.cos(rdip)
+    # vertical shift of the rupture centre, as in get_rupture_surface
+    vshift = upper_seismogenic_depth - depths + hheight
+    below = lower_seismogenic_depth - depths - hheight
+    vshift = numpy.where(vshift < 0, numpy.minimum(below, 0), vshift)
+    hshift = numpy.abs(vshift / math.tan(rdip))
+    return math.sqrt(rup_length ** 2 + rup_proj_width ** 2) / 2 + hshift
+
+
+def filter_background_ruptures(array, sites, integration_distance, npd,
+                               upper_seismogenic_depth,
+                               lower_seismogenic_depth, msr=WC1994(),
+                               aspect=1.5):
+    """
+    Determine in a single vectorized pass which sampled point ruptures can
+    be within the integration distance from the sites, by considering the
+    distance of the epicentres from the sites minus the maximum horizontal
+    distance between the epicentres and the ruptures (see
+    :func:`get_horizontal_reach`). The filter is conservative: the ruptures
+    discarded are farther than the integration distance from all sites.
+
+    :param array:
+        an array of dtype bg_rupture_dt
+    :param sites:
+        Sites for consideration (can be None!)
+    :param float integration_distance:
+        Maximum distance from rupture to site for consideration
+    :param npd:
+        Nodal plane distribution as instance of :class:
+        openquake.hazardlib.pmf.PMF
+    :returns:
+        Boolean vector, True for the ruptures to keep
+    """
+    if not sites or len(array) == 0:
+        return numpy.ones(len(array), dtype=bool)
+    reaches = numpy.zeros(len(array))
+    for mag in numpy.unique(array['mag']):
+        for _prob, nodal_plane in npd.data:
+            idx = ((array['mag'] == mag) &
+                   (array['dip'] == nodal_plane.dip) &
+                   (array['rake'] == nodal_plane.rake))
+            reaches[idx] = get_horizontal_reach(
+                mag, nodal_plane, array['depth'][idx], msr, aspect,
+                upper_seismogenic_depth, lower_seismogenic_depth)
+    distances = min_geodetic_distance(
+        sites.lons, sites.lats, array['lon'], array['lat'])
+    return distances - reaches <= integration_distance
+
+
+def build_background_ruptures(tom, array, upper_seismogenic_depth,
+                              lower_seismogenic_depth, msr=WC1994(),
+                              aspect=1.5, trt=DEFAULT_TRT):
+    """
+    :param tom:
+        Temporal occurrence model as instance of :class:
+        openquake.hazardlib.tom.TOM
+    :param array:
+        an array of dtype bg_rupture_dt
+    :returns:
+        List of ruptures, one for each record in the array
+    """
+    ruptures = []
+    for rec in array:
+        hypocentre = Point(rec['lon'], rec['lat'], rec['depth'])
+        nodal_plane = NodalPlane(rec['strike'], rec['dip'], rec['rake'])
+        surface = get_rupture_surface(rec['mag'], nodal_plane,
+                                      hypocentre, msr, aspect,
+                                      upper_seismogenic_depth,
+                                      lower_seismogenic_depth)
+        ruptures.append(ParametricProbabilisticRupture(
+            rec['mag'], rec['rake'], trt, hypocentre, surface,
+            PointSource, rec['rate'], tom))
+    return ruptures
+
+
 def generate_background_ruptures(tom, locations, occurrence, mag, npd,
                                  hdd, upper_seismogenic_depth,
                                  lower_seismogenic_depth, msr=WC1994(),
@@ -349,22 +601,10 @@ def generate_background_ruptures(tom, locations, occurrence, mag, npd,
     :returns:
         List of ruptures
     """
-    ruptures = []
-    n_vals = len(locations)
-    depths = hdd.sample_pairs(n_vals)
-    nodal_planes = npd.sample_pairs(n_vals)
-    for i, (x, y) in enumerate(locations):
-        hypocentre = Point(x, y, depths[i][1])
-        surface = get_rupture_surface(mag, nodal_planes[i][1],
-                                      hypocentre, msr, aspect,
-                                      upper_seismogenic_depth,
-                                      lower_seismogenic_depth)
-        rupture_probability = (occurrence[i] * nodal_planes[i][0] *
-                               depths[i][0])
-        ruptures.append(ParametricProbabilisticRupture(
-            mag, nodal_planes[i][1].rake, trt, hypocentre, surface,
-            PointSource, rupture_probability, tom))
-    return ruptures
+    array = sample_background_points(locations, occurrence, mag, npd, hdd)
+    return build_background_ruptures(
+        tom, array, upper_seismogenic_depth, lower_seismogenic_depth,
+        msr, aspect, trt)
 
 
 def prefilter_background_model(hdf5, sites, integration_distance, msr=WC1994(),
@@ -402,9 +642,13 @@ def prefilter_background_model(hdf5, sites, integration_distance, msr=WC1994(),
 def sample_background_model(
         hdf5, tom, filter_idx, min_mag, npd, hdd,
         upper_seismogenic_depth, lower_seismogenic_depth, msr=WC1994(),
-        aspect=1.5, trt=DEFAULT_TRT):
+        aspect=1.5, trt=DEFAULT_TRT, sites=None, integration_distance=None):
     """
-    Generates a rupture set from a sample of the background model
+    Generates a rupture set from a sample of the background model.
+    The sampled point ruptures are kept in an array and filtered in a
+    single pass; rupture objects are built only for the ruptures close
+    to the sites.
+
     :param tom:
         Temporal occurrence model as instance of :class:
         openquake.hazardlib.tom.TOM
@@ -426,6 +670,8 @@ def sample_background_model(
         Lower seismogenic depth (km)
     :param msr:
         Magnitude scaling relation
+    :param sites:
+        Sites for consideration (can be None!)
     :param float integration_distance:
         Maximum distance from rupture to site for consideration
     """
@@ -440,20 +686,22 @@ def sample_background_model(
     valid_locs = hdf5["Grid/Locations"][filter_idx, :]
     # Sample remaining rates
     sampler = tom.sample_number_of_occurrences(rates)
-    background_ruptures = []
-    background_n_occ = []
+    arrays = [numpy.zeros(0, bg_rupture_dt)]
     for i, mag in enumerate(mags):
         rate_idx = numpy.where(sampler[:, i])[0]
-        rate_cnt = sampler[rate_idx, i]
-        occurrence = rates[rate_idx, i]
-        locations = valid_locs[rate_idx, :]
-        ruptures = generate_background_ruptures(
-            tom, locations, occurrence,
-            mag, npd, hdd, upper_seismogenic_depth,
-            lower_seismogenic_depth, msr, aspect, trt)
-        background_ruptures.extend(ruptures)
-        background_n_occ.extend(rate_cnt.tolist())
-    return background_ruptures, background_n_occ
+        array = sample_background_points(
+            valid_locs[rate_idx, :], rates[rate_idx, i], mag, npd, hdd)
+        array['n_occ'] = sampler[rate_idx, i]
+        arrays.append(array)
+    array = numpy.concatenate(arrays)
+    if integration_distance is not None:
+        array = array[filter_background_ruptures(
+            array, sites, integration_distance, npd,
+            upper_seismogenic_depth, lower_seismogenic_depth, msr, aspect)]
+    background_ruptures = build_background_ruptures(
+        tom, array, upper_seismogenic_depth, lower_seismogenic_depth,
+        msr, aspect, trt)
+    return background_ruptures, array['n_occ'].tolist()
 
 
 # this is a fake source object built around the HDF5 UCERF file
@@ -514,19 +762,79 @@ class UCERFSESControl(object):
         self.integration_distance = integration_distance
         self.sites = None
         self.background_idx = None
+        self.section_distances = {}  # sec_idx -> distances from the sites
         self.num_ruptures = 0
 
-    def update_background_site_filter(self, sites, integration_distance=1000.):
+    def update_background_site_filter(self, sites, integration_distance=1000.,
+                                      hdf5=None):
         """
         We can apply the filtering of the background sites as a pre-processing
         step - this is done here rather than in the sampling of the ruptures
-        themselves
+        themselves. If `hdf5` is not given, the UCERF file is opened.
         """
+        if hdf5 is None:
+            with h5py.File(self.source_file, 'r') as hdf5:
+                return self.update_background_site_filter(
+                    sites, integration_distance, hdf5)
         self.sites = sites
         self.integration_distance = integration_distance
-        with h5py.File(self.source_file, 'r') as hdf5:
-            self.background_idx = prefilter_background_model(
-                hdf5, self.sites, integration_distance, self.msr, self.aspect)
+        self.background_idx = prefilter_background_model(
+            hdf5, self.sites, integration_distance, self.msr, self.aspect)
+
+    def update_section_filter(self, sec_idxs, sites, hdf5=None):
+        """
+        Compute, for each section in the given section groups, the minimum
+        distance between its centroids and the sites. The distances are
+        computed once and used to prefilter the fault ruptures in all the
+        branches. If `hdf5` is not given, the UCERF file is opened.
+
+        :param sec_idxs: paths of section groups in the UCERF file
+        :param sites: the site collection
+        """
+        if hdf5 is None:
+            with h5py.File(self.source_file, 'r') as hdf5:
+                return self.update_section_filter(sec_idxs, sites, hdf5)
+        for sec_idx in sec_idxs:
+            group = hdf5[sec_idx]
+            distances = numpy.zeros(max(int(key) for key in group) + 1)
+            distances.fill(numpy.inf)
+            for key in group:
+                centroids = group[key]["Centroids"][:].astype("float64")
+                distances[int(key)] = min_geodetic_distance(
+                    centroids[:, 0], centroids[:, 1],
+                    sites.lons, sites.lats).min()
+            self.section_distances[sec_idx] = distances
+
+    def get_expected_ruptures(self, branch_ids, hdf5):
+        """
+        Estimate the number of ruptures generated by each branch in the
+        investigation time, by considering the fault ruptures passing the
+        section filter and the filtered background model.
+
+        :param branch_ids: a list of branch codes
+        :param hdf5: the UCERF file, as an open h5py.File object
+        :returns: a dictionary branch_id -> expected number of ruptures
+        """
+        mags = hdf5["Grid/Magnitudes"][:]
+        bg_rate = hdf5["Grid/RateArray"][self.background_idx, :][
+            :, mags >= self.min_mag].sum()
+        close = {}  # (geol_idx, sec_idx) -> boolean array over the ruptures
+        expected = {}
+        for branch_id in branch_ids:
+            idxset = self.build_idx_set(branch_id)
+            rates = hdf5[idxset["rate_idx"]][:]
+            key = idxset["geol_idx"], idxset["sec_idx"]
+            distances = self.section_distances.get(idxset["sec_idx"])
+            if distances is None:  # no filtering
+                close[key] = numpy.ones(len(rates), bool)
+            elif key not in close:
+                ridxs = hdf5[idxset["geol_idx"] + "/RuptureIndex"][:]
+                close[key] = numpy.array(
+                    [distances[ridx].min() <= self.integration_distance
+                     for ridx in ridxs])
+            expected[branch_id] = (
+                rates[close[key]].sum() + bg_rate) * self.inv_time
+        return expected
 
     def update_seed(self, seed):
         """
@@ -544,45 +852,58 @@ class UCERFSESControl(object):
         return 1
 
     def generate_event_set(self, branch_id, sites=None,
-                           integration_distance=1000.):
+                           integration_distance=1000., hdf5=None, cache=None):
         """
-        Generates the event set corresponding to a particular branch
+        Generates the event set corresponding to a particular branch.
+        The file and the cache can be passed from outside, to keep them
+        open across the stochastic event sets.
+
+        :param hdf5: the UCERF file; if None, the file is opened
+        :param cache: a :class:`RuptureCache`; if None, a new one is used
         """
+        if hdf5 is None:
+            with h5py.File(self.source_file, 'r') as hdf5:
+                return self.generate_event_set(
+                    branch_id, sites, integration_distance, hdf5, cache)
+        if cache is None:
+            cache = RuptureCache()
         if sites:
-            self.update_background_site_filter(sites, integration_distance)
+            self.update_background_site_filter(
+                sites, integration_distance, hdf5)
         idxset = self.build_idx_set(branch_id)
 
         # get rates from file
-        with h5py.File(self.source_file, 'r') as hdf5:
-            rates = hdf5[idxset["rate_idx"]][:]
-            occurrences = self.tom.sample_number_of_occurrences(rates)
-            indices = numpy.where(occurrences)[0]
-            logging.info('Considering %s %s', branch_id, indices)
-
-            # get ruptures from the indices
-            ruptures = []
-            rupture_occ = []
-            for idx, n_occ in zip(indices, occurrences[indices]):
-                ucerf_rup, _ = get_ucerf_rupture(
-                    hdf5, idx, idxset, self.tom, self.sites,
-                    self.integration_distance, self.mesh_spacing,
-                    self.tectonic_region_type)
-                if ucerf_rup:
-                    ruptures.append(ucerf_rup)
-                    rupture_occ.append(n_occ)
-
-            # sample background sources
-            background_ruptures, background_n_occ = sample_background_model(
-                hdf5,
-                self.tom,
-                self.background_idx,
-                self.min_mag,
-                self.npd, self.hdd,
-                self.usd, self.lsd,
-                self.msr, self.aspect,
-                self.tectonic_region_type)
-            ruptures.extend(background_ruptures)
-            rupture_occ.extend(background_n_occ)
+        rates = cache.get_array(hdf5, idxset["rate_idx"])
+        occurrences = self.tom.sample_number_of_occurrences(rates)
+        indices = numpy.where(occurrences)[0]
+        logging.info('Considering %s %s', branch_id, indices)
+
+        # get ruptures from the indices
+        ruptures = []
+        rupture_occ = []
+        for idx, n_occ in zip(indices, occurrences[indices]):
+            ucerf_rup, _ = get_ucerf_rupture(
+                hdf5, idx, idxset, self.tom, self.sites,
+                self.integration_distance, self.mesh_spacing,
+                self.tectonic_region_type, cache,
+                self.section_distances.get(idxset["sec_idx"]))
+            if ucerf_rup:
+                ruptures.append(ucerf_rup)
+                rupture_occ.append(n_occ)
+
+        # sample background sources
+        background_ruptures, background_n_occ = sample_background_model(
+            hdf5,
+            self.tom,
+            self.background_idx,
+            self.min_mag,
+            self.npd, self.hdd,
+            self.usd, self.lsd,
+            self.msr, self.aspect,
+            self.tectonic_region_type,
+            self.sites, self.integration_distance)
+        ruptures.extend(background_ruptures)
+        rupture_occ.extend(background_n_occ)
         return ruptures, rupture_occ
 
     @staticmethod
@@ -640,9 +961,10 @@ def compute_ruptures(branch_info, source, sitecol, oqparam, monitor):
     """
     Returns the ruptures as a TRT set
     :param str branch_info:
-        Tuple of (ltbr, branch_id, branch_weight)
+        List of triples (trt_model_id, ltbr, branch_id)
     :param source:
-        Instance of the UCERFSESControl object
+        Instance of the UCERFSESControl object, with the background and
+        section filters already set
     :param sitecol:
         Site collection :class: openquake.hazardlib.site.SiteCollection
     :param info:
@@ -656,41 +978,48 @@ def compute_ruptures(branch_info, source, sitecol, oqparam, monitor):
     serial = 1
     filter_mon = monitor('update_background_site_filter', measuremem=False)
     event_mon = monitor('sampling ruptures', measuremem=False)
-    for trt_model_id, (ltbrid, branch_id, _) in enumerate(branch_info):
-        t0 = time.time()
-        with filter_mon:
-            source.update_background_site_filter(sitecol, integration_distance)
-
-        # set the seed before calling generate_event_set
-        numpy.random.seed(oqparam.random_seed + trt_model_id)
-        ses_ruptures = []
-        for ses_idx in range(1, oqparam.ses_per_logic_tree_path + 1):
-            with event_mon:
-                rups, n_occs = source.generate_event_set(
-                    branch_id, sitecol, integration_distance)
-            for i, rup in enumerate(rups):
-                rup.seed = oqparam.random_seed  # to think
-                rrup = rup.surface.get_min_distance(sitecol.mesh)
-                r_sites = sitecol.filter(rrup <= integration_distance)
-                if r_sites is None:
-                    continue
-                indices = r_sites.indices
-                events = []
-                for j in range(n_occs[i]):
-                    # NB: the first 0 is a placeholder for the eid that will be
-                    # set later, in EventBasedRuptureCalculator.post_execute;
-                    # the second 0 is the sampling ID
-                    events.append((0, ses_idx, j, 0))
-                if len(events):
-                    ses_ruptures.append(
-                        event_based.EBRupture(
-                            rup, indices,
-                            numpy.array(events, event_based.event_dt),
-                            source.source_id, trt_model_id, serial))
-                    serial += 1
-        dt = time.time() - t0
-        res.calc_times[trt_model_id] = (ltbrid, dt)
-        res[trt_model_id] = ses_ruptures
+    # the UCERF file is kept open and the geometries are cached
+    # for all the branches and stochastic event sets of the task
+    cache = RuptureCache()
+    with h5py.File(source.source_file, 'r') as hdf5:
+        if source.background_idx is None:  # not computed by the controller
+            with filter_mon:
+                source.update_background_site_filter(
+                    sitecol, integration_distance, hdf5)
+        for trt_model_id, ltbrid, branch_id in branch_info:
+            t0 = time.time()
+
+            # set the seed before calling generate_event_set
+            numpy.random.seed(oqparam.random_seed + trt_model_id)
+            ses_ruptures = []
+            for ses_idx in range(1, oqparam.ses_per_logic_tree_path + 1):
+                with event_mon:
+                    rups, n_occs = source.generate_event_set(
+                        branch_id, hdf5=hdf5, cache=cache)
+                for i, rup in enumerate(rups):
+                    rup.seed = oqparam.random_seed  # to think
+                    rrup = rup.surface.get_min_distance(sitecol.mesh)
+                    r_sites = sitecol.filter(rrup <= integration_distance)
+                    if r_sites is None:
+                        continue
+                    indices = r_sites.indices
+                    events = []
+                    for j in range(n_occs[i]):
+                        # NB: the first 0 is a placeholder for the eid that
+                        # will be set later, in
+                        # EventBasedRuptureCalculator.post_execute;
+                        # the second 0 is the sampling ID
+                        events.append((0, ses_idx, j, 0))
+                    if len(events):
+                        ses_ruptures.append(
+                            event_based.EBRupture(
+                                rup, indices,
+                                numpy.array(events, event_based.event_dt),
+                                source.source_id, trt_model_id, serial))
+                        serial += 1
+            dt = time.time() - t0
+            res.calc_times[trt_model_id] = (ltbrid, dt)
+            res[trt_model_id] = ses_ruptures
     res.trt = DEFAULT_TRT
     return res
 
@@ -736,13 +1065,27 @@ class UCERFEventBasedRuptureCalculator(
         """
         Run the ucerf rupture calculation
         """
-        id_set = [(key, self.smlt.branches[key].value,
-                  self.smlt.branches[key].weight)
-                  for key in self.smlt.branches]
+        oq = self.oqparam
+        branches = sorted(self.smlt.branches.items())
+        id_set = [(ordinal, key, branch.value)
+                  for ordinal, (key, branch) in enumerate(branches)]
+        # the filters depend only on the sites and the integration distance,
+        # so they are computed once and sent to the tasks with the source;
+        # the branches are distributed according to the expected ruptures
+        with self.monitor('filtering the UCERF model', autoflush=True), \
+                h5py.File(self.source.source_file, 'r') as hdf5:
+            self.source.update_background_site_filter(
+                self.sitecol, oq.maximum_distance[DEFAULT_TRT], hdf5)
+            self.source.update_section_filter(
+                set(self.source.build_idx_set(branch_id)["sec_idx"]
+                    for _, _, branch_id in id_set), self.sitecol, hdf5)
+            expected = self.source.get_expected_ruptures(
+                [branch_id for _, _, branch_id in id_set], hdf5)
         ruptures_by_trt_id = parallel.apply_reduce(
             compute_ruptures,
             (id_set, self.source, self.sitecol, self.oqparam, self.monitor),
-            concurrent_tasks=self.oqparam.concurrent_tasks, agg=self.agg)
+            concurrent_tasks=self.oqparam.concurrent_tasks, agg=self.agg,
+            weight=lambda item: expected[item[2]])
         self.rlzs_assoc = self.csm.info.get_rlzs_assoc(
             functools.partial(self.count_eff_ruptures, ruptures_by_trt_id))
         self.datastore['csm_info'] = self.csm.info
@@ -87,7 +87,8 @@ def run2(job_haz, job_risk, concurrent_tasks, pdb, exports, params, monitor):
     return rcalc
 
 
-def _run(job_ini, concurrent_tasks, pdb, loglevel, hc, exports, params):
+def _run(job_ini, concurrent_tasks, pdb, loglevel, hc, exports, params,
+         resume=None):
     global calc_path
     logging.basicConfig(level=getattr(logging, loglevel.upper()))
     job_inis = job_ini.split(',')
@@ -110,12 +111,19 @@ def _run(job_ini, concurrent_tasks, pdb, loglevel, hc, exports, params):
                 raise SystemExit(
                     'There are %d old calculations, cannot '
                     'retrieve the %s' % (len(calc_ids), hc_id))
-        calc = base.calculators(oqparam, monitor)
+        if resume is not None:  # resume a previous calculation
+            oqparam.checkpoints = True
+        calc = base.calculators(oqparam, monitor, resume,
+                                resume=resume is not None)
         with calc.monitor:
             calc.run(concurrent_tasks=concurrent_tasks, pdb=pdb,
                      exports=exports, hazard_calculation_id=hc_id,
                      rlz_ids=rlz_ids, **params)
     else:  # run hazard + risk
+        if resume is not None:
+            raise SystemExit('--resume is not supported when running hazard '
+                             'and risk together: resume the hazard or the '
+                             'risk calculation with its own job file')
         calc = run2(
             job_inis[0], job_inis[1], concurrent_tasks, pdb,
             exports, params, monitor)
@@ -129,7 +137,7 @@ def _run(job_ini, concurrent_tasks, pdb, loglevel, hc, exports, params):
 
 
 def run(job_ini, slowest, hc, param, concurrent_tasks=CT, exports='',
-        loglevel='info', pdb=None):
+        loglevel='info', pdb=None, resume=None):
     """
     Run a calculation.
     """
@@ -139,14 +147,15 @@ def run(job_ini, slowest, hc, param, concurrent_tasks=CT, exports='',
     if slowest:
         prof = cProfile.Profile()
         stmt = ('_run(job_ini, concurrent_tasks, pdb, loglevel, hc, '
-                'exports, params)')
+                'exports, params, resume)')
         prof.runctx(stmt, globals(), locals())
         pstat = calc_path + '.pstat'
         prof.dump_stats(pstat)
         print('Saved profiling info in %s' % pstat)
         print(get_pstats(pstat, slowest))
     else:
-        _run(job_ini, concurrent_tasks, pdb, loglevel, hc, exports, params)
+        _run(job_ini, concurrent_tasks, pdb, loglevel, hc, exports, params,
+             resume)
 
 parser = sap.Parser(run)
 parser.arg('job_ini', 'calculation configuration file '
@@ -162,3 +171,5 @@ parser.opt('exports', 'export formats as a comma-separated string',
 parser.opt('loglevel', 'logging level',
            choices='debug info warn error critical'.split())
 parser.flg('pdb', 'enable post mortem debugging', '-d')
+parser.opt('resume', 'resume the calculation with the given ID '
+           '(started with checkpoints=true)', type=int)
@@ -358,6 +358,44 @@ class DataStore(collections.MutableMapping):
         return '<%s %d>' % (self.__class__.__name__, self.calc_id)
 
 
+class Checkpoint(object):
+    """
+    Store the results of the tasks of a calculation in the datastore,
+    under the group `checkpoints/<name>`, one pickled dataset per task
+    number. It is used by :class:`openquake.commonlib.parallel.TaskManager`
+    to resubmit only the missing tasks when a calculation is resumed.
+
+    :param dstore: a DataStore instance
+    :param name: the name of the task
+    """
+    def __init__(self, dstore, name):
+        self.dstore = dstore
+        self.key = 'checkpoints/' + name
+
+    def __contains__(self, task_no):
+        return '%s/%06d' % (self.key, task_no) in self.dstore
+
+    def save(self, task_no, result):
+        """
+        Save the result of the given task and flush the datastore
+        """
+        self.dstore['%s/%06d' % (self.key, task_no)] = numpy.array(
+            pickle.dumps(result, pickle.HIGHEST_PROTOCOL))
+        self.dstore.flush()
+
+    def items(self):
+        """
+        :returns: a list of pairs (task_no, result) ordered by task number
+        """
+        if self.key not in self.dstore:
+            return []
+        return [(int(name), self.dstore['%s/%s' % (self.key, name)])
+                for name in sorted(self.dstore[self.key])]
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.key)
+
+
 class Fake(dict):
     """
     A fake datastore as a dict subclass, useful in tests and such
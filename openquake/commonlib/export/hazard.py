@@ -17,7 +17,6 @@
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
 import re
-import pickle
 import logging
 import operator
 import collections
@@ -677,37 +676,57 @@ DisaggMatrix = collections.namedtuple(
     'DisaggMatrix', 'poe iml dim_labels matrix')
 
 
+DISAGG_RES_FMT = 'poe-%(poe)s-rlz-%(rlz)s-%(imt)s-%(lon)s-%(lat)s'
+
+
 @export.add(('disagg', 'xml'))
 def export_disagg_xml(ekey, dstore):
     oq = dstore['oqparam']
-    rlzs = dstore['csm_info'].get_rlzs_assoc().realizations
-    group = dstore['disagg']
+    rlzs_assoc = dstore['csm_info'].get_rlzs_assoc()
+    rlzs = rlzs_assoc.realizations
+    sm_id = {rlz.ordinal: i
+             for i, rlzs_ in enumerate(rlzs_assoc.rlzs_by_smodel)
+             for rlz in rlzs_}
+    sitemesh = dstore['sitemesh']
+    bins = dstore['disagg-bins']
+    imls = dstore['disagg/iml'].value
+    dsets = [dstore['disagg/' + '_'.join(dim_labels)]
+             for dim_labels in disagg.pmf_map]
+    imts = list(oq.imtls)
+    pmf_shapes = {}  # (sm_id, sid) -> list of PMF shapes
     fnames = []
     writercls = hazard_writers.DisaggXMLWriter
-    for key in group:
-        matrix = pickle.loads(group[key].value)
-        attrs = group[key].attrs
-        rlz = rlzs[attrs['rlzi']]
-        poe = attrs['poe']
-        iml = attrs['iml']
-        imt, sa_period, sa_damping = from_string(attrs['imt'])
-        fname = dstore.export_path(key + '.xml')
-        lon, lat = attrs['location']
+    for sid, rlzi, p, m in zip(*numpy.where(~numpy.isnan(imls))):
+        rlz = rlzs[rlzi]
+        poe = oq.poes_disagg[p]
+        iml = imls[sid, rlzi, p, m]
+        imt, sa_period, sa_damping = from_string(imts[m])
+        lon, lat = sitemesh[sid]
+        key = (sm_id[rlzi], sid)
+        mag, dist, lons, lats, eps, trts = edges = bins[key]
+        if key not in pmf_shapes:  # the PMFs without the zero padding
+            zeros = numpy.zeros([len(e) - 1 for e in edges[:-1]] +
+                                [len(trts)])
+            pmf_shapes[key] = [fn(zeros).shape
+                               for fn in disagg.pmf_map.values()]
+        fname = dstore.export_path(DISAGG_RES_FMT % dict(
+            poe=poe, rlz=rlzi, imt=imts[m], lon=lon, lat=lat) + '.xml')
         # TODO: add poe=poe below
         writer = writercls(
             fname, investigation_time=oq.investigation_time,
             imt=imt, smlt_path='_'.join(rlz.sm_lt_path),
             gsimlt_path=rlz.gsim_rlz.uid, lon=lon, lat=lat,
             sa_period=sa_period, sa_damping=sa_damping,
-            mag_bin_edges=attrs['mag_bin_edges'],
-            dist_bin_edges=attrs['dist_bin_edges'],
-            lon_bin_edges=attrs['lon_bin_edges'],
-            lat_bin_edges=attrs['lat_bin_edges'],
-            eps_bin_edges=attrs['eps_bin_edges'],
-            tectonic_region_types=attrs['trts'],
+            mag_bin_edges=mag, dist_bin_edges=dist,
+            lon_bin_edges=lons, lat_bin_edges=lats,
+            eps_bin_edges=eps, tectonic_region_types=trts,
         )
-        data = [DisaggMatrix(poe, iml, dim_labels, matrix[i])
-                for i, dim_labels in enumerate(disagg.pmf_map)]
+        data = []
+        for dset, dim_labels, shape in zip(
+                dsets, disagg.pmf_map, pmf_shapes[key]):
+            matrix = dset[(sid, rlzi, p, m) +
+                          tuple(slice(0, n) for n in shape)]
+            data.append(DisaggMatrix(poe, iml, dim_labels, matrix))
         writer.serialize(data)
         fnames.append(fname)
     return sorted(fnames)
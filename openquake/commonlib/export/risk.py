@@ -139,7 +139,7 @@ def export_avg_losses_stats(ekey, dstore):
     return writer.getsaved()
 
 
-# this is used by classical_risk
+# this is used by scenario_risk
 @export.add(('agg_losses-rlzs', 'csv'))
 def export_agg_losses(ekey, dstore):
     """
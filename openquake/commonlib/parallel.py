@@ -233,6 +233,12 @@ class TaskManager(object):
       print tm.reduce()
 
     Progress report is built-in.
+
+    If a `checkpoint` object is passed (see
+    :class:`openquake.commonlib.datastore.Checkpoint`) the results of the
+    tasks are saved as soon as they are received; tasks which results were
+    saved in a previous run are not submitted again and their stored
+    results are aggregated instead.
     """
     executor = executor
     progress = staticmethod(logging.info)
@@ -244,13 +250,13 @@ class TaskManager(object):
         cls.executor = ProcessPoolExecutor()
 
     @classmethod
-    def starmap(cls, task, task_args, name=None):
+    def starmap(cls, task, task_args, name=None, checkpoint=None):
         """
         Spawn a bunch of tasks with the given list of arguments
 
         :returns: a TaskManager object with a .result method.
         """
-        self = cls(task, name)
+        self = cls(task, name, checkpoint)
         for i, a in enumerate(task_args, 1):
             cls.progress('Submitting task %s #%d', self.name, i)
             if isinstance(a[-1], Monitor):  # add incremental task number
@@ -303,10 +309,13 @@ class TaskManager(object):
         self = cls.starmap(task, [(chunk,) + args for chunk in chunks], name)
         return self.reduce(agg, acc, posthook)
 
-    def __init__(self, oqtask, name=None):
+    def __init__(self, oqtask, name=None, checkpoint=None):
         self.oqtask = oqtask
         self.task_func = getattr(oqtask, 'task_func', oqtask)
         self.name = name or oqtask.__name__
+        self.checkpoint = checkpoint
+        self.task_no = 0  # incremented at each call to .submit
+        self.task_nos = []  # the task numbers of the submitted tasks
         self.results = []
         self.sent = AccumDict()
         self.received = []
@@ -318,8 +327,12 @@ class TaskManager(object):
         Submit a function with the given arguments to the process pool
         and add a Future to the list `.results`. If the variable
         OQ_DISTRIBUTE is set, the function is run in process and the
-        result is returned.
+        result is returned. If the result of the task is already
+        stored in the checkpoint, nothing is submitted.
         """
+        self.task_no += 1
+        if self.checkpoint is not None and self.task_no in self.checkpoint:
+            return {}
         check_mem_usage()
         # log a warning if too much memory is used
         if self.no_distribute:
@@ -331,6 +344,7 @@ class TaskManager(object):
             res = self._submit(piks)
         self.sent += sent
         self.results.append(res)
+        self.task_nos.append(self.task_no)
         return sent
 
     def _submit(self, piks):
@@ -363,6 +377,8 @@ class TaskManager(object):
 
             backend = current_app().backend
             amqp_backend = backend.__class__.__name__.startswith('AMQP')
+            task_no = {res.task_id: no
+                       for res, no in zip(self.results, self.task_nos)}
             rset = ResultSet(self.results)
             for task_id, result_dict in rset.iter_native():
                 idx = self.task_ids.index(task_id)
@@ -372,7 +388,7 @@ class TaskManager(object):
                 if isinstance(result, BaseException):
                     raise result
                 self.received.append(len(result))
-                acc = agg(acc, result.unpickle())
+                acc = agg(acc, result.unpickle(), task_no[task_id])
                 if amqp_backend:
                     # work around a celery bug
                     del backend._cache[task_id]
@@ -380,6 +396,7 @@ class TaskManager(object):
 
         elif distribute == 'futures':
 
+            task_no = dict(zip(self.results, self.task_nos))
             for future in as_completed(self.results):
                 check_mem_usage()
                 # log a warning if too much memory is used
@@ -387,7 +404,7 @@ class TaskManager(object):
                 if isinstance(result, BaseException):
                     raise result
                 self.received.append(len(result))
-                acc = agg(acc, result.unpickle())
+                acc = agg(acc, result.unpickle(), task_no[future])
             return acc
 
     def reduce(self, agg=operator.add, acc=None, posthook=None):
@@ -401,6 +418,14 @@ class TaskManager(object):
         """
         if acc is None:
             acc = AccumDict()
+        if self.checkpoint is not None:
+            # aggregate the results stored in a previous run
+            done = self.checkpoint.items()
+            if done:
+                self.progress('Reading the results of %d task(s) from %s',
+                              len(done), self.checkpoint)
+            for task_no, val in done:
+                acc = agg(acc, val)
         num_tasks = len(self.results)
         if num_tasks == 0:
             logging.warn('No tasks were submitted')
@@ -409,17 +434,21 @@ class TaskManager(object):
         log_percent = log_percent_gen(self.name, num_tasks, self.progress)
         next(log_percent)
 
-        def agg_and_percent(acc, triple):
+        def agg_and_percent(acc, triple, task_no):
             (val, exc, mon) = triple
             if exc:
                 raise RuntimeError(val)
+            if self.checkpoint is not None:
+                self.checkpoint.save(task_no, val)
             res = agg(acc, val)
             next(log_percent)
             mon.flush()
             return res
 
         if self.no_distribute:
-            agg_result = reduce(agg_and_percent, self.results, acc)
+            agg_result = acc
+            for triple, task_no in zip(self.results, self.task_nos):
+                agg_result = agg_and_percent(agg_result, triple, task_no)
         else:
             self.progress('Sent %s of data in %d task(s)',
                           humansize(sum(self.sent.values())), num_tasks)
@@ -430,6 +459,7 @@ class TaskManager(object):
         if posthook:
             posthook(self)
         self.results = []
+        self.task_nos = []
         return agg_result
 
     def wait(self):
@@ -36,9 +36,11 @@ from openquake.risklib import riskmodels, riskinput
 from openquake.commonlib import datastore
 from openquake.commonlib.oqvalidation import OqParam
 from openquake.commonlib.node import read_nodes, LiteralNode, context
-from openquake.commonlib import nrml, valid, logictree, InvalidFile
+from openquake.commonlib import (
+    nrml, valid, logictree, parallel, InvalidFile)
 from openquake.commonlib.riskmodels import get_risk_models
 from openquake.baselib.general import groupby, AccumDict, writetmp
+from openquake.baselib.performance import Monitor
 from openquake.baselib.python3compat import configparser
 
 from openquake.commonlib import source, sourceconverter
@@ -375,9 +377,51 @@ def possibly_gunzip(fname):
     return fname
 
 
+def _parse_trt_models(parser, fname, apply_unc):
+    # parse a source model file and convert the errors coming from
+    # obsolete complex fault sources into InvalidFile errors
+    try:
+        return parser.parse_trt_models(fname, apply_unc)
+    except ValueError as e:
+        if str(e) in ('Surface does not conform with Aki & '
+                      'Richards convention',
+                      'Edges points are not in the right order'):
+            raise InvalidFile('''\
+    %s: %s. Probably you are using an obsolete model.
+    In that case you can fix the file with the command
+    python -m openquake.engine.tools.correct_complex_sources %s
+    ''' % (fname, e, fname))
+        else:
+            raise
+
+
+@parallel.litetask
+def _parse_source_model(fname, paths, converter, cachedir, source_model_lt,
+                        monitor):
+    # called by get_source_models; parse a source model file once and
+    # apply the uncertainties of each logic tree path to a copy of the
+    # sources; returns a dictionary source model ordinal -> TrtModels
+    parser = source.SourceModelParser(converter, cachedir)
+    acc = {}
+    for ordinal, smpath in paths:
+        apply_unc = source_model_lt.make_apply_uncertainties(smpath)
+        acc[ordinal] = _parse_trt_models(parser, fname, apply_unc)
+    return acc
+
+
+def _update(acc, dic):
+    # aggregation function used by get_source_models
+    acc.update(dic)
+    return acc
+
+
 def get_source_models(oqparam, source_model_lt, in_memory=True):
     """
     Build all the source models generated by the logic tree.
+    If there are several source model files and `concurrent_tasks` is
+    nonzero, the files are parsed in parallel, one task per file;
+    the source models are yielded in the same order as in the
+    sequential case.
 
     :param oqparam:
         an :class:`openquake.commonlib.oqvalidation.OqParam` instance
@@ -395,32 +439,42 @@ def get_source_models(oqparam, source_model_lt, in_memory=True):
         oqparam.complex_fault_mesh_spacing,
         oqparam.width_of_mfd_bin,
         oqparam.area_source_discretization)
-    parser = source.SourceModelParser(converter)
+    if oqparam.cache_source_models:
+        cachedir = os.path.join(datastore.DATADIR, 'source_models')
+    else:
+        cachedir = None
+    parser = source.SourceModelParser(converter, cachedir)
 
     # consider only the effective realizations
     rlzs = logictree.get_effective_rlzs(source_model_lt)
     samples_by_lt_path = source_model_lt.samples_by_lt_path()
     num_source_models = len(rlzs)
+    fnames = [possibly_gunzip(os.path.join(oqparam.base_path, rlz.value))
+              for rlz in rlzs]
+    paths_by_fname = collections.OrderedDict()
+    for i, (fname, rlz) in enumerate(zip(fnames, rlzs)):
+        paths_by_fname.setdefault(fname, []).append((i, rlz.lt_path))
+    if (in_memory and oqparam.concurrent_tasks and
+            len(paths_by_fname) > 1):
+        mon = Monitor('parse source models')
+        trt_models_by_ordinal = parallel.starmap(
+            _parse_source_model,
+            [(fname, paths, converter, cachedir, source_model_lt, mon)
+             for fname, paths in paths_by_fname.items()]).reduce(_update, {})
+        for fname, paths in paths_by_fname.items():
+            parser.fname_hits[fname] += len(paths)
+    else:
+        trt_models_by_ordinal = {}
     for i, rlz in enumerate(rlzs):
         sm = rlz.value  # name of the source model
         smpath = rlz.lt_path
         num_samples = samples_by_lt_path[smpath]
-        fname = possibly_gunzip(os.path.join(oqparam.base_path, sm))
-        if in_memory:
+        fname = fnames[i]
+        if i in trt_models_by_ordinal:  # already parsed in parallel
+            trt_models = trt_models_by_ordinal.pop(i)
+        elif in_memory:
             apply_unc = source_model_lt.make_apply_uncertainties(smpath)
-            try:
-                trt_models = parser.parse_trt_models(fname, apply_unc)
-            except ValueError as e:
-                if str(e) in ('Surface does not conform with Aki & '
-                              'Richards convention',
-                              'Edges points are not in the right order'):
-                    raise InvalidFile('''\
-    %s: %s. Probably you are using an obsolete model.
-    In that case you can fix the file with the command
-    python -m openquake.engine.tools.correct_complex_sources %s
-    ''' % (fname, e, fname))
-                else:
-                    raise
+            trt_models = _parse_trt_models(parser, fname, apply_unc)
         else:  # just collect the TRT models
             smodel = next(read_nodes(fname, lambda el: 'sourceModel' in el.tag,
                                      source.nodefactory['sourceModel']))
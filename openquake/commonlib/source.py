@@ -17,9 +17,11 @@
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import division
+import os
 import sys
 import copy
 import math
+import hashlib
 import logging
 import operator
 import collections
@@ -28,11 +30,11 @@ from xml.etree import ElementTree as etree
 
 import numpy
 
-from openquake.baselib.python3compat import raise_
+from openquake.baselib.python3compat import raise_, pickle
 from openquake.baselib.general import (
-    AccumDict, groupby, block_splitter, group_array)
+    AccumDict, groupby, block_splitter, split_in_blocks, group_array)
+from openquake.hazardlib import __version__ as hazardlib_version
 from openquake.hazardlib.site import Tile
-from openquake.hazardlib.probability_map import ProbabilityMap
 from openquake.commonlib.node import read_nodes
 from openquake.commonlib import logictree, sourceconverter, parallel, valid
 from openquake.commonlib.nrml import nodefactory, PARSE_NS_MAP
@@ -42,6 +44,7 @@ U16 = numpy.uint16
 U32 = numpy.uint32
 I32 = numpy.int32
 F32 = numpy.float32
+F64 = numpy.float64
 
 
 class DuplicatedID(Exception):
@@ -227,18 +230,93 @@ class TrtModel(collections.Sequence):
         return len(self.sources)
 
 
+def get_cache_key(fname, converter):
+    """
+    :param fname:
+        the full pathname of a source model file
+    :param converter:
+        :class:`openquake.commonlib.source.SourceConverter` instance
+    :returns:
+        a SHA1 hex digest of the file content and of the parameters
+        of the converter, including the version of hazardlib
+    """
+    sha1 = hashlib.sha1()
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    params = (hazardlib_version, converter.__class__.__name__,
+              converter.tom.time_span, converter.rupture_mesh_spacing,
+              converter.complex_fault_mesh_spacing,
+              converter.width_of_mfd_bin,
+              converter.area_source_discretization)
+    sha1.update(repr(params).encode('utf8'))
+    return sha1.hexdigest()
+
+
 class SourceModelParser(object):
     """
-    A source model parser featuring a cache.
+    A source model parser featuring a cache. If a `cachedir` is given,
+    the converted sources are also pickled there, in a file named after
+    the SHA1 of the source model file and of the converter parameters,
+    and are read back from it in subsequent runs.
 
     :param converter:
         :class:`openquake.commonlib.source.SourceConverter` instance
+    :param cachedir:
+        directory where to store the converted sources (or None)
     """
-    def __init__(self, converter):
+    def __init__(self, converter, cachedir=None):
         self.converter = converter
+        self.cachedir = cachedir
         self.sources = {}  # cache fname -> sources
         self.fname_hits = collections.Counter()  # fname -> number of calls
 
+    def get_sources(self, fname):
+        """
+        :param fname:
+            the full pathname of the source model file
+        :returns:
+            the converted sources, possibly read from the caches
+        """
+        try:
+            return self.sources[fname]
+        except KeyError:
+            pass
+        if self.cachedir is None:
+            sources = self.parse_sources(fname)
+        else:
+            sources = self.read_or_parse_sources(fname)
+        self.sources[fname] = sources
+        return sources
+
+    def read_or_parse_sources(self, fname):
+        """
+        Read the sources from the cache directory if there is a cache file
+        for the given source model file; otherwise parse the file and
+        store the sources in the cache directory.
+
+        :param fname:
+            the full pathname of the source model file
+        """
+        key = get_cache_key(fname, self.converter)
+        cachefile = os.path.join(self.cachedir, key + '.pik')
+        if os.path.exists(cachefile):
+            with open(cachefile, 'rb') as f:
+                sources = pickle.load(f)
+            logging.info('Read %d sources from %s', len(sources), cachefile)
+            return sources
+        sources = self.parse_sources(fname)
+        if not os.path.exists(self.cachedir):
+            os.makedirs(self.cachedir)
+        # write on a temporary file and then rename it, so that a killed
+        # process or a concurrent calculation cannot leave a corrupted cache
+        tmpfile = '%s.%d' % (cachefile, os.getpid())
+        with open(tmpfile, 'wb') as f:
+            pickle.dump(sources, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmpfile, cachefile)
+        logging.info('Stored %d sources in %s', len(sources), cachefile)
+        return sources
+
     def parse_trt_models(self, fname, apply_uncertainties=None):
         """
         :param fname:
@@ -246,10 +324,7 @@ class SourceModelParser(object):
         :param apply_uncertainties:
             a function modifying the sources (or None)
         """
-        try:
-            sources = self.sources[fname]
-        except KeyError:
-            sources = self.sources[fname] = self.parse_sources(fname)
+        sources = self.get_sources(fname)
         # NB: deepcopy is *essential* here
         sources = map(copy.deepcopy, sources)
         for src in sources:
@@ -309,6 +384,8 @@ class RlzsAssoc(collections.Mapping):
     :attr gsim_by_trt: list of dictionaries {trt: gsim}
     :attr rlzs_assoc: dictionary {trt_model_id, gsim: rlzs}
     :attr rlzs_by_smodel: list of lists of realizations
+    :attr weights: array with the weights of the realizations
+    :attr indices_by_key: dictionary {trt_model_id, gsim: rlz indices}
 
     For instance, for the non-trivial logic tree in
     :mod:`openquake.qa_tests_data.classical.case_15`, which has 4 tectonic
@@ -330,7 +407,11 @@ class RlzsAssoc(collections.Mapping):
         self.rlzs_assoc = collections.defaultdict(list)
         self.gsim_by_trt = []  # rlz.ordinal -> {trt: gsim}
         self.rlzs_by_smodel = [[] for _ in range(len(csm_info.source_models))]
+        self.realizations = []  # flat list set by _init
+        self.weights = numpy.zeros(0)
+        self.indices_by_key = {}
         self.gsims_by_trt_id = {}
+        self.rlzs_by_gsim = {}  # trt_id -> {gsim: rlzs}
         self.sm_ids = {}
         self.samples = {}
         for sm in csm_info.source_models:
@@ -341,9 +422,12 @@ class RlzsAssoc(collections.Mapping):
     def _init(self):
         """
         Finalize the initialization of the RlzsAssoc object by setting
-        the (reduced) weights of the realizations and the attribute
-        gsims_by_trt_id.
+        the (reduced) weights of the realizations and the lookup tables
+        realizations, weights, indices_by_key, gsims_by_trt_id and
+        rlzs_by_gsim.
         """
+        self.realizations = [rlz for rlzs in self.rlzs_by_smodel
+                             for rlz in rlzs]
         if self.num_samples:
             assert len(self.realizations) == self.num_samples
             for rlz in self.realizations:
@@ -357,22 +441,24 @@ class RlzsAssoc(collections.Mapping):
                              'weights are being rescaled')
             for rlz in self.realizations:
                 rlz.weight = rlz.weight / tot_weight
+        self.weights = numpy.array([rlz.weight for rlz in self.realizations])
+        index = {rlz.ordinal: i for i, rlz in enumerate(self.realizations)}
+        self.indices_by_key = {
+            key: numpy.array([index[rlz.ordinal] for rlz in rlzs], U32)
+            for key, rlzs in self.rlzs_assoc.items()}
 
         self.gsims_by_trt_id = groupby(
             self.rlzs_assoc, operator.itemgetter(0),
             lambda group: sorted(gsim for trt_id, gsim in group))
-
-    @property
-    def realizations(self):
-        """Flat list with all the realizations"""
-        return sum(self.rlzs_by_smodel, [])
+        self.rlzs_by_gsim = {
+            trt_id: {gsim: self[trt_id, str(gsim)] for gsim in gsims}
+            for trt_id, gsims in self.gsims_by_trt_id.items()}
 
     def get_rlzs_by_gsim(self, trt_id):
         """
         Returns a dictionary gsim -> rlzs
         """
-        return {gsim: self[trt_id, str(gsim)]
-                for gsim in self.gsims_by_trt_id[trt_id]}
+        return self.rlzs_by_gsim[trt_id]
 
     def get_rlzs_by_trt_id(self):
         """
@@ -421,18 +507,6 @@ class RlzsAssoc(collections.Mapping):
         assoc._init()
         return assoc
 
-    # used in classical and event_based calculators
-    def combine_curves(self, results):
-        """
-        :param results: dictionary (trt_model_id, gsim) -> curves
-        :returns: a dictionary rlz -> aggregate curves
-        """
-        acc = {rlz: ProbabilityMap() for rlz in self.realizations}
-        for key in results:
-            for rlz in self.rlzs_assoc[key]:
-                acc[rlz] |= results[key]
-        return acc
-
     # used in riskinput
     def combine(self, results, agg=agg_prob):
         """
@@ -476,15 +550,24 @@ class RlzsAssoc(collections.Mapping):
         r4: 0.03 + 0.04 (T1C + T2D)
         r5: 0.03 + 0.05 (T1C + T2E)
 
-        In reality, the `combine_curves` method is used with hazard_curves and
-        the aggregation function is the `agg_curves` function, a composition of
-        probability, which however is close to the sum for small probabilities.
+        In reality, with hazard curves the aggregation function is the
+        default `agg_prob` function, a composition of probability, which
+        however is close to the sum for small probabilities.
+
+        The aggregation is performed with a gather/scatter on an array
+        of shape (R, ...) by using the precomputed `indices_by_key`, so the
+        aggregation function must work on numpy arrays.
         """
-        ad = {rlz: 0 for rlz in self.realizations}
+        if not results:
+            return {rlz: 0 for rlz in self.realizations}
+        first = numpy.asarray(next(iter(results.values())))
+        dtype = first.dtype if first.dtype.kind == 'f' else F64
+        acc = numpy.zeros((len(self.realizations),) + first.shape, dtype)
         for key, value in results.items():
-            for rlz in self.rlzs_assoc[key]:
-                ad[rlz] = agg(ad[rlz], value)
-        return ad
+            idx = self.indices_by_key.get(key)
+            if idx is not None:
+                acc[idx] = agg(acc[idx], value)
+        return dict(zip(self.realizations, acc))
 
     def __iter__(self):
         return iter(self.rlzs_assoc)
@@ -644,7 +727,7 @@ class CompositionInfo(object):
                 logging.warn('No realizations for %s, %s',
                              '_'.join(smodel.path), smodel.name)
         # NB: realizations could be filtered away by logic tree reduction
-        if assoc.realizations:
+        if idx:
             assoc._init()
         return assoc
 
@@ -833,8 +916,9 @@ class SourceManager(object):
     """
     def __init__(self, csm, taskfunc, maximum_distance,
                  dstore, monitor, random_seed=None,
-                 filter_sources=True, num_tiles=1):
-        self.tm = parallel.TaskManager(taskfunc)
+                 filter_sources=True, num_tiles=1, checkpoint=None,
+                 concurrent_tasks=None):
+        self.tm = parallel.TaskManager(taskfunc, checkpoint=checkpoint)
         self.csm = csm
         self.maximum_distance = maximum_distance
         self.random_seed = random_seed
@@ -842,6 +926,7 @@ class SourceManager(object):
         self.monitor = monitor
         self.filter_sources = filter_sources
         self.num_tiles = num_tiles
+        self.concurrent_tasks = concurrent_tasks
         self.rlzs_assoc = csm.info.get_rlzs_assoc()
         self.split_map = {}  # trt_model_id, source_id -> split sources
         self.source_chunks = []
@@ -867,31 +952,34 @@ class SourceManager(object):
         :param kind: a string 'light', 'heavy' or 'all'
         :param tile: a :class:`openquake.hazardlib.site.Tile` instance
         :returns: the sources of the given kind affecting the given tile
+
+        The filtering and the splitting of the sources are performed in
+        parallel by the task `_filter_split_sources`; the heavy sources are
+        split only the first time, since they are cached in the split_map.
         """
-        filter_mon = self.monitor('filtering sources')
-        split_mon = self.monitor('splitting sources')
-        for src in self.csm.get_sources(kind):
-            filter_time = split_time = 0
-            if self.filter_sources:
-                with filter_mon:
-                    try:
-                        if src not in tile:
-                            continue
-                    except:
-                        etype, err, tb = sys.exc_info()
-                        msg = 'An error occurred with source id=%s: %s'
-                        msg %= (src.source_id, err)
-                        raise_(etype, msg, tb)
-                filter_time = filter_mon.dt
+        sources = list(self.csm.get_sources(kind))
+        if not sources:
+            return
+        triples = [(i, src, kind == 'heavy' and
+                    (src.trt_model_id, src.id) not in self.split_map)
+                   for i, src in enumerate(sources)]
+        if self.filter_sources or any(t[2] for t in triples):
+            blocks = split_in_blocks(
+                triples, self.concurrent_tasks or 1,
+                weight=lambda triple: triple[1].weight)
+            results = parallel.starmap(
+                _filter_split_sources,
+                [(block, tile, self.filter_sources, self.monitor.new())
+                 for block in blocks]).reduce()
+        else:  # nothing to do
+            results = {i: (None, 0, 0) for i, _src, _split in triples}
+        for i in sorted(results):
+            src = sources[i]
+            split_sources, filter_time, split_time = results[i]
             if kind == 'heavy':
-                if (src.trt_model_id, src.id) not in self.split_map:
-                    logging.info('splitting %s of weight %s',
-                                 src, src.weight)
-                    with split_mon:
-                        sources = list(sourceconverter.split_source(src))
-                        self.split_map[src.trt_model_id, src.id] = sources
-                    split_time = split_mon.dt
-                    self.set_serial(src, sources)
+                if split_sources is not None:
+                    self.split_map[src.trt_model_id, src.id] = split_sources
+                    self.set_serial(src, split_sources)
                 for ss in self.split_map[src.trt_model_id, src.id]:
                     ss.id = src.id
                     yield ss
@@ -910,9 +998,6 @@ class SourceManager(object):
             else:
                 self.infos[key] = info
 
-        filter_mon.flush()
-        split_mon.flush()
-
     def set_serial(self, src, split_sources=()):
         """
         Set a serial number per each rupture in a source, managing also the
@@ -979,6 +1064,46 @@ class SourceManager(object):
             del self.source_chunks
 
 
+@parallel.litetask
+def _filter_split_sources(triples, tile, filter_sources, monitor):
+    """
+    Filter and split a block of sources.
+
+    :param triples: a list of triples (index, source, split_flag)
+    :param tile: a :class:`openquake.hazardlib.site.Tile` instance
+    :param filter_sources: if False, do not filter the sources
+    :param monitor: a Monitor instance
+    :returns:
+        a dictionary index -> (split_sources, filter_time, split_time)
+        for the sources affecting the tile; split_sources is None for
+        the sources which are not split
+    """
+    filter_mon = monitor('filtering sources')
+    split_mon = monitor('splitting sources')
+    acc = AccumDict()
+    for idx, src, split in triples:
+        filter_time = split_time = 0
+        if filter_sources:
+            with filter_mon:
+                try:
+                    if src not in tile:
+                        continue
+                except:
+                    etype, err, tb = sys.exc_info()
+                    msg = 'An error occurred with source id=%s: %s'
+                    msg %= (src.source_id, err)
+                    raise_(etype, msg, tb)
+            filter_time = filter_mon.dt
+        split_sources = None
+        if split:
+            logging.info('splitting %s of weight %s', src, src.weight)
+            with split_mon:
+                split_sources = list(sourceconverter.split_source(src))
+            split_time = split_mon.dt
+        acc[idx] = (split_sources, filter_time, split_time)
+    return acc
+
+
 @parallel.litetask
 def count_eff_ruptures(sources, sitecol, siteidx, rlzs_assoc, monitor):
     """
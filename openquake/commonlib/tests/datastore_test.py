@@ -21,7 +21,7 @@ import os
 import unittest
 import tempfile
 import numpy
-from openquake.commonlib.datastore import DataStore, view, read
+from openquake.commonlib.datastore import DataStore, Checkpoint, view, read
 
 
 @view.add('key1_upper')
@@ -86,6 +86,15 @@ class DataStoreTestCase(unittest.TestCase):
         attrs = sorted(self.dstore.attrs.items())
         self.assertEqual(attrs, [('a', 2), ('b', 2)])
 
+    def test_checkpoint(self):
+        ckp = Checkpoint(self.dstore, 'task')
+        self.assertEqual(ckp.items(), [])
+        ckp.save(2, {'n': 2})
+        ckp.save(1, {'n': 1})
+        self.assertIn(1, ckp)
+        self.assertNotIn(3, ckp)
+        self.assertEqual(ckp.items(), [(1, {'n': 1}), (2, {'n': 2})])
+
     def test_export_path(self):
         path = self.dstore.export_path('hello.txt')
         mo = re.match('\./hello_\d+', path)
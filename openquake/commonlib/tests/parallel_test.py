@@ -64,6 +64,20 @@ class TaskManagerTestCase(unittest.TestCase):
         parallel.TaskManager.restart()
         self.assertEqual(res, {'a': {'n': 10}, 'c': {'n': 15}, 'b': {'n': 20}})
 
+    def test_checkpoint(self):
+        class FakeCheckpoint(dict):
+            def save(self, task_no, result):
+                self[task_no] = result
+
+            def items(self):
+                return sorted(dict.items(self))
+        ckp = FakeCheckpoint({2: {'n': 20}})  # the second task is done
+        all_data = [('a' * 10,), ('b' * 20,), ('c' * 15,)]
+        tm = parallel.starmap(get_length, all_data, checkpoint=ckp)
+        self.assertEqual(tm.task_nos, [1, 3])
+        self.assertEqual(tm.reduce(), {'n': 45})
+        self.assertEqual(ckp, {1: {'n': 10}, 2: {'n': 20}, 3: {'n': 15}})
+
     def test_litetask(self):
         # signature preservation
         self.assertEqual(get_len.__code__.co_varnames, ('data', 'monitor'))
@@ -17,6 +17,8 @@
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import shutil
+import tempfile
 import unittest
 from io import BytesIO
 
@@ -34,7 +36,7 @@ from openquake.hazardlib.tom import PoissonTOM
 from openquake.commonlib import tests, nrml_examples, readinput
 from openquake.commonlib import sourceconverter as s
 from openquake.commonlib.source import (
-    SourceModelParser, DuplicatedID, CompositionInfo)
+    SourceModelParser, DuplicatedID, CompositionInfo, get_cache_key)
 from openquake.commonlib.nrml import nodefactory
 from openquake.commonlib.node import read_nodes
 from openquake.baselib.general import assert_close
@@ -721,6 +723,23 @@ class TrtModelTestCase(unittest.TestCase):
             '<TrtModel #0 Active Shallow Crust, 2 source(s), -1'
             ' effective rupture(s)>')
 
+    def test_cachedir(self):
+        cachedir = tempfile.mkdtemp()
+        try:
+            parser = SourceModelParser(self.parser.converter, cachedir)
+            sources = parser.get_sources(MIXED_SRC_MODEL)
+            [cachefile] = os.listdir(cachedir)
+            self.assertEqual(cachefile, get_cache_key(
+                MIXED_SRC_MODEL, self.parser.converter) + '.pik')
+            # a new parser reads the sources from the cache file
+            parser = SourceModelParser(self.parser.converter, cachedir)
+            cached = parser.get_sources(MIXED_SRC_MODEL)
+            self.assertEqual([src.source_id for src in cached],
+                             [src.source_id for src in sources])
+            assert_close(cached, sources)
+        finally:
+            shutil.rmtree(cachedir)
+
 
 class RuptureConverterTestCase(unittest.TestCase):
 
@@ -815,6 +834,17 @@ Subduction Interface,b3,SadighEtAl1997(),w=1.0>''')
 1,ChiouYoungs2008(): ['<1,b1_b3_b6,b2_b3,w=0.5>']
 4,SadighEtAl1997(): ['<5,b1_b3_b8,b2_b3,w=0.5>']
 5,ChiouYoungs2008(): ['<5,b1_b3_b8,b2_b3,w=0.5>']>""")
+        numpy.testing.assert_equal(assoc.weights, [.5, .5])
+        numpy.testing.assert_equal(
+            assoc.indices_by_key[4, 'SadighEtAl1997()'], [1])
+
+        # test the method combine
+        rlz1, rlz5 = assoc.realizations
+        combined = assoc.combine({(0, 'SadighEtAl1997()'): .1,
+                                  (1, 'ChiouYoungs2008()'): .2,
+                                  (4, 'SadighEtAl1997()'): .3})
+        self.assertAlmostEqual(combined[rlz1], .28)
+        self.assertAlmostEqual(combined[rlz5], .3)
 
         # removing 9 trt_models out of 18
         def count_ruptures(trt_model):
@@ -356,16 +356,17 @@ class CompositeRiskModel(collections.Mapping):
                     imt_taxonomies[rf.imt].add(riskmodel.taxonomy)
         return sorted(imt_taxonomies.items())
 
-    def build_input(self, imt, hazards_by_site, assetcol, eps_dict):
+    def build_input(self, imt, hazard_by_key, assets_by_site, eps=None):
         """
         :param imt: an Intensity Measure Type
-        :param hazards_by_site: an array of hazards per each site
-        :param assetcol: AssetCollection instance
-        :param eps_dict: a dictionary of epsilons
+        :param hazard_by_key:
+            a dictionary key -> array of hazards, one per site
+        :param assets_by_site: array of assets, one per site
+        :param eps: a matrix of epsilons for the given assets or None
         :returns: a :class:`RiskInput` instance
         """
         return RiskInput(self.get_imt_taxonomies(imt),
-                         hazards_by_site, assetcol, eps_dict)
+                         hazard_by_key, assets_by_site, eps)
 
     def build_inputs_from_ruptures(
             self, sitecol, all_ruptures, trunc_level, correl_model,
@@ -440,17 +441,20 @@ class RiskInput(object):
     imt and site.
 
     :param imt_taxonomies: a pair (IMT, taxonomies)
-    :param hazard_by_site: array of hazards, one per site
+    :param hazard_by_key: dictionary key -> array of hazards, one per site
     :param assets_by_site: array of assets, one per site
-    :param eps_dict: dictionary of epsilons
+    :param eps:
+        matrix of epsilons with a row for each asset in `assets_by_site`,
+        ordered by asset ordinal, or None
     """
-    def __init__(self, imt_taxonomies, hazard_by_site, assets_by_site,
-                 eps_dict):
+    def __init__(self, imt_taxonomies, hazard_by_key, assets_by_site,
+                 eps=None):
         if not imt_taxonomies:
             self.weight = 0
             return
         [(self.imt, taxonomies)] = imt_taxonomies
-        self.hazard_by_site = hazard_by_site
+        self.hazard_by_key = hazard_by_key
+        self.num_sites = len(assets_by_site)
         self.assets_by_site = [
             [a for a in assets if a.taxonomy in taxonomies]
             for assets in assets_by_site]
@@ -462,7 +466,11 @@ class RiskInput(object):
             self.weight += len(assets)
         self.taxonomies = sorted(taxonomies_set)
         self.eids = None  # for API compatibility with RiskInputFromRuptures
-        self.eps = eps_dict
+        self.eps = eps
+        if eps is not None:
+            self.aids = numpy.array(sorted(
+                asset.ordinal for assets in assets_by_site
+                for asset in assets), U32)
 
     @property
     def imt_taxonomies(self):
@@ -472,9 +480,12 @@ class RiskInput(object):
     def epsilon_getter(self, asset_ordinals):
         """
         :param asset_ordinals: list of ordinals of the assets
-        :returns: a closure returning an array of epsilons from the event IDs
+        :returns: a closure returning a matrix of epsilons, one row per asset
         """
-        return lambda: [self.eps[aid] for aid in asset_ordinals]
+        if self.eps is None:
+            return lambda: numpy.zeros(len(asset_ordinals), F32)
+        rows = numpy.searchsorted(self.aids, asset_ordinals)
+        return lambda: self.eps[rows]
 
     def get_hazard(self, rlzs_assoc, monitor=Monitor()):
         """
@@ -485,8 +496,11 @@ class RiskInput(object):
         :returns:
             list of hazard dictionaries imt -> rlz -> haz per each site
         """
-        return [{self.imt: rlzs_assoc.combine(hazard)}
-                for hazard in self.hazard_by_site]
+        hazards = []
+        for i in range(self.num_sites):
+            hazard = {key: haz[i] for key, haz in self.hazard_by_key.items()}
+            hazards.append({self.imt: rlzs_assoc.combine(hazard)})
+        return hazards
 
     def __repr__(self):
         return '<%s IMT=%s, taxonomy=%s, weight=%d>' % (
@@ -592,8 +606,9 @@ class RiskInputFromRuptures(object):
         if not hasattr(self, 'eps'):
             return lambda aid, eids: None
 
-        def geteps(aid, eids):
-            return self.eps[aid, [self.eid2idx[eid] for eid in eids]]
+        def geteps(aids, eids):
+            # aids can be a single asset ordinal or an array of ordinals
+            return self.eps[aids][..., [self.eid2idx[eid] for eid in eids]]
         return geteps
 
     def get_hazard(self, rlzs_assoc, monitor=Monitor()):
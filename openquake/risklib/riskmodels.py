@@ -18,7 +18,6 @@
 
 from __future__ import division
 import inspect
-import functools
 import numpy
 
 from openquake.baselib.general import CallableDict, AccumDict
@@ -282,11 +281,62 @@ def rescale(curves, values):
     Multiply the losses in each curve of kind (losses, poes) by the
     corresponding value.
     """
+    curves = numpy.array(curves, float)
     n = len(curves)
     assert n == len(values), (n, len(values))
-    losses = [curves[i, 0] * values[i] for i in range(n)]
-    poes = curves[:, 1]
-    return numpy.array([[losses[i], poes[i]] for i in range(n)])
+    curves[:, 0] *= numpy.asarray(values)[:, None]
+    return curves
+
+
+class CurveCache(object):
+    """
+    A bounded cache of classical loss ratio curves, keyed by a string
+    (or tuple) identifying the vulnerability function and by the content
+    of the hazard curve, so that sites and realizations with the same
+    hazard curve are computed only once. The cache is cleared when it
+    contains `maxsize` curves.
+
+    :param hazard_imtls: the intensity measure types and levels
+    :param steps: the number of steps between loss ratios
+    :param maxsize: the maximum number of cached curves
+    """
+    def __init__(self, hazard_imtls, steps, maxsize=10000):
+        self.hazard_imtls = hazard_imtls
+        self.steps = steps
+        self.maxsize = maxsize
+        self.data = {}
+
+    def get(self, key, vf, hazard_curves):
+        """
+        :param key: a key identifying the vulnerability function
+        :param vf: a vulnerability function
+        :param hazard_curves: a sequence of S hazard curves
+        :returns: an array of S loss ratio curves, of shape (S, 2, C)
+
+        The curves missing in the cache are computed with a single call
+        to :func:`openquake.risklib.scientific.classical`.
+        """
+        hazard_curves = numpy.asarray(hazard_curves, float)
+        keys = [(key, hc.tobytes()) for hc in hazard_curves]
+        missing = self._missing(keys)  # key -> index of the hazard curve
+        if len(self.data) + len(missing) > self.maxsize:
+            self.data.clear()
+            missing = self._missing(keys)
+        if missing:
+            idxs = sorted(missing.values())
+            curves = scientific.classical(
+                vf, self.hazard_imtls[vf.imt], hazard_curves[idxs],
+                self.steps)
+            for i, curve in zip(idxs, curves):
+                self.data[keys[i]] = curve
+        return numpy.array([self.data[k] for k in keys])
+
+    def _missing(self, keys):
+        missing = {}
+        for i, k in enumerate(keys):
+            if k not in self.data and k not in missing:
+                missing[k] = i
+        return missing
 
 
 @registry.add('classical_risk', 'classical', 'disaggregation')
@@ -388,6 +438,35 @@ class Classical(RiskModel):
         self.loss_ratios = {
             lt: vf.mean_loss_ratios_with_steps(lrem_steps_per_interval)
             for lt, vf in vulnerability_functions.items()}
+        self.curve_cache = CurveCache(hazard_imtls, lrem_steps_per_interval)
+
+    def get_curves(self, loss_type, hazard_curves):
+        """
+        :param str loss_type: the loss type considered
+        :param hazard_curves: a sequence of S hazard curves
+        :returns: the loss ratio curves, an array of shape (S, 2, C)
+        """
+        return self.curve_cache.get(
+            loss_type, self.risk_functions[loss_type], hazard_curves)
+
+    def get_curve(self, loss_type, hazard_curve):
+        """
+        :param str loss_type: the loss type considered
+        :param hazard_curve: an array of poes
+        :returns: the loss ratio curve, an array of shape (2, C)
+        """
+        return self.get_curves(loss_type, [hazard_curve])[0]
+
+    def out_by_lr(self, imt, assets, hazard, epsgetter):
+        """
+        Compute the loss ratio curves of all the realizations at once
+        and then the outputs, as in :meth:`RiskModel.out_by_lr`.
+        """
+        hazard_curves = [haz for haz in hazard.values() if len(haz)]
+        if hazard_curves:
+            for loss_type in self.get_loss_types(imt):
+                self.get_curves(loss_type, hazard_curves)  # fill the cache
+        return RiskModel.out_by_lr(self, imt, assets, hazard, epsgetter)
 
     def __call__(self, loss_type, assets, hazard_curve, _eps=None):
         """
@@ -404,12 +483,13 @@ class Classical(RiskModel):
             a :class:`openquake.risklib.scientific.Classical.Output` instance.
         """
         n = len(assets)
-        vf = self.risk_functions[loss_type]
-        imls = self.hazard_imtls[vf.imt]
-        curves = [scientific.classical(
-            vf, imls, hazard_curve, self.lrem_steps_per_interval)] * n
-        average_losses = utils.numpy_map(scientific.average_loss, curves)
-        maps = scientific.loss_map_matrix(self.conditional_loss_poes, curves)
+        curve = self.get_curve(loss_type, hazard_curve)
+        curves = [curve] * n
+        # the average loss and the loss maps are computed on the curve
+        # and rescaled by the asset values
+        average_losses = scientific.average_loss(curve)
+        maps = scientific.loss_map_matrix(
+            self.conditional_loss_poes, [curve])  # shape (P, 1)
         values = get_values(loss_type, assets)
 
         if self.insured_losses and loss_type != 'occupants':
@@ -516,17 +596,20 @@ class ProbabilisticEventBased(RiskModel):
         loss_ratios = numpy.zeros((N, E, I), F32)
         vf = self.risk_functions[loss_type]
         means, covs, idxs = vf.interpolate(gmvs)
-        for i, asset in enumerate(assets):
-            epsilons = epsgetter(asset.ordinal, eids)
-            if epsilons is not None:
-                ratios = vf.sample(means, covs, idxs, epsilons)
-            else:
-                ratios = means
-            loss_ratios[i, idxs, 0] = ratios
-            if self.insured_losses and loss_type != 'occupants':
-                loss_ratios[i, idxs, 1] = scientific.insured_losses(
-                    ratios,  asset.deductible(loss_type),
-                    asset.insurance_limit(loss_type))
+        # matrix of epsilons N x E for all the assets
+        epsilons = epsgetter(
+            numpy.array([asset.ordinal for asset in assets]), eids)
+        if epsilons is not None:
+            ratios = vf.sample(means, covs, idxs, epsilons)
+        else:
+            ratios = means
+        loss_ratios[:, idxs, 0] = ratios
+        if self.insured_losses and loss_type != 'occupants':
+            deductibles = [a.deductible(loss_type) for a in assets]
+            limits = [a.insurance_limit(loss_type) for a in assets]
+            loss_ratios[:, idxs, 1] = scientific.insured_losses(
+                ratios, numpy.array(deductibles)[:, None],
+                numpy.array(limits)[:, None])
         return scientific.Output(
             assets, loss_type, loss_ratios=loss_ratios, eids=eids)
 
@@ -550,6 +633,43 @@ class ClassicalBCR(RiskModel):
         self.asset_life_expectancy = asset_life_expectancy
         self.hazard_imtls = hazard_imtls
         self.lrem_steps_per_interval = lrem_steps_per_interval
+        self.curve_cache = CurveCache(hazard_imtls, lrem_steps_per_interval)
+
+    def get_curves(self, loss_type, hazard_curves):
+        """
+        :param str loss_type: the loss type considered
+        :param hazard_curves: a sequence of S hazard curves
+        :returns:
+            the original and retrofitted loss ratio curves, two arrays of
+            shape (S, 2, C)
+        """
+        return (self.curve_cache.get(
+                    (loss_type, 'orig'), self.risk_functions[loss_type],
+                    hazard_curves),
+                self.curve_cache.get(
+                    (loss_type, 'retro'), self.retro_functions[loss_type],
+                    hazard_curves))
+
+    def get_eals(self, loss_type, hazard_curve):
+        """
+        :param str loss_type: the loss type considered
+        :param hazard_curve: an array of poes
+        :returns: the original and retrofitted expected annual loss ratios
+        """
+        orig, retro = self.get_curves(loss_type, [hazard_curve])
+        return (scientific.average_loss(orig[0]),
+                scientific.average_loss(retro[0]))
+
+    def out_by_lr(self, imt, assets, hazard, epsgetter):
+        """
+        Compute the loss ratio curves of all the realizations at once
+        and then the outputs, as in :meth:`RiskModel.out_by_lr`.
+        """
+        hazard_curves = [haz for haz in hazard.values() if len(haz)]
+        if hazard_curves:
+            for loss_type in self.get_loss_types(imt):
+                self.get_curves(loss_type, hazard_curves)  # fill the cache
+        return RiskModel.out_by_lr(self, imt, assets, hazard, epsgetter)
 
     def __call__(self, loss_type, assets, hazard, _eps=None, _eids=None):
         """
@@ -562,32 +682,20 @@ class ClassicalBCR(RiskModel):
         """
         n = len(assets)
         self.assets = assets
-        vf = self.risk_functions[loss_type]
-        imls = self.hazard_imtls[vf.imt]
-        vf_retro = self.retro_functions[loss_type]
-        curves_orig = functools.partial(scientific.classical, vf, imls,
-                                        steps=self.lrem_steps_per_interval)
-        curves_retro = functools.partial(scientific.classical, vf_retro, imls,
-                                         steps=self.lrem_steps_per_interval)
-        original_loss_curves = utils.numpy_map(curves_orig, [hazard] * n)
-        retrofitted_loss_curves = utils.numpy_map(curves_retro, [hazard] * n)
-
-        eal_original = utils.numpy_map(
-            scientific.average_loss, original_loss_curves)
-
-        eal_retrofitted = utils.numpy_map(
-            scientific.average_loss, retrofitted_loss_curves)
-
-        bcr_results = [
-            scientific.bcr(
-                eal_original[i], eal_retrofitted[i],
-                self.interest_rate, self.asset_life_expectancy,
-                asset.value(loss_type), asset.retrofitted(loss_type))
-            for i, asset in enumerate(assets)]
-
-        return scientific.Output(
-            assets, loss_type,
-            data=list(zip(eal_original, eal_retrofitted, bcr_results)))
+        # all the assets share the same hazard curve, so the expected
+        # annual loss ratios are the same and the BCRs are computed
+        # for all the assets at once
+        eal_original, eal_retrofitted = self.get_eals(loss_type, hazard)
+        values = get_values(loss_type, assets)
+        costs = numpy.array([a.retrofitted(loss_type) for a in assets])
+        bcr_results = scientific.bcr(
+            eal_original, eal_retrofitted,
+            self.interest_rate, self.asset_life_expectancy, values, costs)
+        data = numpy.zeros((n, 3))  # shape (N, 3)
+        data[:, 0] = eal_original
+        data[:, 1] = eal_retrofitted
+        data[:, 2] = bcr_results
+        return scientific.Output(assets, loss_type, data=data)
 
 
 @registry.add('scenario_risk', 'scenario')
@@ -621,8 +729,7 @@ class Scenario(RiskModel):
         vf = self.risk_functions[loss_type]
         means, covs, idxs = vf.interpolate(ground_motion_values)
         loss_ratio_matrix = numpy.zeros((len(assets), len(epsilons[0])))
-        for i, eps in enumerate(epsilons):
-            loss_ratio_matrix[i, idxs] = vf.sample(means, covs, idxs, eps)
+        loss_ratio_matrix[:, idxs] = vf.sample(means, covs, idxs, epsilons)
         # another matrix of N x E elements
         loss_matrix = (loss_ratio_matrix.T * values).T
         # an array of E elements
@@ -631,9 +738,9 @@ class Scenario(RiskModel):
         if self.insured_losses and loss_type != "occupants":
             deductibles = [a.deductible(loss_type) for a in assets]
             limits = [a.insurance_limit(loss_type) for a in assets]
-            insured_loss_ratio_matrix = utils.numpy_map(
-                scientific.insured_losses,
-                loss_ratio_matrix, deductibles, limits)
+            insured_loss_ratio_matrix = scientific.insured_losses(
+                loss_ratio_matrix, numpy.array(deductibles)[:, None],
+                numpy.array(limits)[:, None])
             insured_loss_matrix = (insured_loss_ratio_matrix.T * values).T
         else:
             insured_loss_matrix = numpy.empty_like(loss_ratio_matrix)
@@ -673,8 +780,7 @@ class Damage(RiskModel):
         """
         n = len(assets)
         ffs = self.risk_functions[loss_type]
-        damages = numpy.array(
-            [scientific.scenario_damage(ffs, gmv) for gmv in gmvs])
+        damages = scientific.scenario_damage(ffs, gmvs)
         return scientific.Output(assets, loss_type, damages=[damages] * n)
 
 
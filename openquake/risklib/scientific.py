@@ -124,6 +124,12 @@ def fine_graining(points, steps):
 #
 
 
+# (distribution, imls, mean loss ratios, covs, steps) -> (loss_ratios, lrem)
+# the cache is cleared when it contains LREM_CACHE_SIZE matrices
+LREM_CACHE = {}
+LREM_CACHE_SIZE = 1000
+
+
 class VulnerabilityFunction(object):
     dtype = numpy.dtype([('iml', F32), ('loss_ratio', F32), ('cov', F32)])
 
@@ -219,9 +225,9 @@ class VulnerabilityFunction(object):
         :param idxs:
            array of E booleans with E >= E'
         :param epsilons:
-           array of E floats
+           array of E floats, or matrix N x E with the epsilons of N assets
         :returns:
-           array of E' loss ratios
+           array of E' loss ratios, or matrix N x E' of loss ratios
         """
         self.set_distribution(epsilons)
         return self.distribution.sample(means, covs, None, idxs)
@@ -322,27 +328,36 @@ class VulnerabilityFunction(object):
         assert covs is None or all(x >= 0.0 for x in covs)
         assert distribution in ["LN", "BT"]
 
-    @utils.memoized
     def loss_ratio_exceedance_matrix(self, steps):
         """Compute the LREM (Loss Ratio Exceedance Matrix).
 
+        The matrices are cached in LREM_CACHE by function content and
+        steps, so they are not recomputed when the function is unpickled
+        in another task running in the same process; the cache is cleared
+        when it contains LREM_CACHE_SIZE matrices.
+
         :param int steps:
             Number of steps between loss ratios.
         """
+        key = (self.distribution_name, self.imls.tobytes(),
+               self.mean_loss_ratios.tobytes(), self.covs.tobytes(), steps)
+        try:
+            return LREM_CACHE[key]
+        except KeyError:
+            pass
 
         # add steps between mean loss ratio values
-        loss_ratios = self.mean_loss_ratios_with_steps(steps)
+        loss_ratios = numpy.asarray(
+            self.mean_loss_ratios_with_steps(steps), float)
 
         # LREM has number of rows equal to the number of loss ratios
         # and number of columns equal to the number of imls
-        lrem = numpy.empty((loss_ratios.size, self.imls.size), float)
-
-        for row, loss_ratio in enumerate(loss_ratios):
-            for col, (mean_loss_ratio, stddev) in enumerate(
-                    zip(self.mean_loss_ratios, self.stddevs)):
-                lrem[row][col] = self.distribution.survival(
-                    loss_ratio, mean_loss_ratio, stddev)
-        return loss_ratios, lrem
+        lrem = self.distribution.survival(
+            loss_ratios[:, None], self.mean_loss_ratios, self.stddevs)
+        if len(LREM_CACHE) >= LREM_CACHE_SIZE:
+            LREM_CACHE.clear()
+        LREM_CACHE[key] = result = loss_ratios, lrem
+        return result
 
     @utils.memoized
     def mean_imls(self):
@@ -577,18 +592,24 @@ class FragilityFunctionDiscrete(object):
         self._interp = interpolate.interp1d(self.imls, self.poes)
         return self._interp
 
-    def __call__(self, iml):
+    def __call__(self, imls):
         """
-        Compute the Probability of Exceedance (PoE) for the given
-        Intensity Measure Level (IML).
+        Compute the Probabilities of Exceedance (PoEs) for the given
+        Intensity Measure Levels (IMLs), a scalar or an array.
         """
         highest_iml = self.imls[-1]
-
-        if self.no_damage_limit and iml < self.no_damage_limit:
-            return 0.
+        imls = numpy.array(imls, float)
+        if self.no_damage_limit:
+            # the levels below the limit have zero PoE; they are replaced
+            # with a level in the range to keep the interpolation happy
+            no_damage = imls < self.no_damage_limit
+            imls[no_damage] = highest_iml
         # when the intensity measure level is above
         # the range, we use the highest one
-        return self.interp(highest_iml if iml > highest_iml else iml)
+        poes = self.interp(numpy.minimum(imls, highest_iml))
+        if self.no_damage_limit:
+            poes[no_damage] = 0.
+        return poes
 
     # so that the curve is pickeable
     def __getstate__(self):
@@ -800,8 +821,7 @@ class DegenerateDistribution(Distribution):
         return means
 
     def survival(self, loss_ratio, mean, _stddev):
-        return numpy.piecewise(
-            loss_ratio, [loss_ratio > mean or not mean], [0, 1])
+        return numpy.where((loss_ratio > mean) | (mean == 0), 0., 1.)
 
 
 def make_epsilons(matrix, seed, correlation):
@@ -841,7 +861,7 @@ class LogNormalDistribution(Distribution):
         if self.epsilons is None:
             raise ValueError("A LogNormalDistribution must be initialized "
                              "before you can use it")
-        eps = self.epsilons[idxs]
+        eps = self.epsilons[..., idxs]  # works also for a matrix N x E
         sigma = numpy.sqrt(numpy.log(covs ** 2.0 + 1.0))
         probs = means / numpy.sqrt(1 + covs ** 2) * numpy.exp(eps * sigma)
         return probs
@@ -850,16 +870,17 @@ class LogNormalDistribution(Distribution):
         # scipy does not handle correctly the limit case stddev = 0.
         # In that case, when `mean` > 0 the survival function
         # approaches to a step function, otherwise (`mean` == 0) we
-        # returns 0
-        if stddev == 0:
-            return numpy.piecewise(
-                loss_ratio, [loss_ratio > mean or not mean], [0, 1])
+        # returns 0; the arguments can be arrays, broadcast together
+        loss_ratio, mean, stddev = numpy.broadcast_arrays(
+            loss_ratio, mean, stddev)
+        step = DegenerateDistribution().survival(loss_ratio, mean, stddev)
 
         variance = stddev ** 2.0
-
-        sigma = numpy.sqrt(numpy.log((variance / mean ** 2.0) + 1.0))
-        mu = mean ** 2.0 / numpy.sqrt(variance + mean ** 2.0)
-        return stats.lognorm.sf(loss_ratio, sigma, scale=mu)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            sigma = numpy.sqrt(numpy.log((variance / mean ** 2.0) + 1.0))
+            mu = mean ** 2.0 / numpy.sqrt(variance + mean ** 2.0)
+            sf = stats.lognorm.sf(loss_ratio, sigma, scale=mu)
+        return numpy.where(stddev == 0, step, sf)
 
 
 @DISTRIBUTIONS.add('BT')
@@ -1013,10 +1034,8 @@ class CurveBuilder(object):
         :poe_matrix: an N x C matrix of PoEs
         :returns: a vector of N values
         """
-        curves = []
-        for avalue, poes in zip(asset_values, poe_matrix):
-            curves.append((self.ratios * avalue, poes))
-        return loss_map_matrix([clp], curves)[0]
+        loss_matrix = numpy.outer(asset_values, self.ratios)
+        return conditional_loss_ratios(loss_matrix, poe_matrix, [clp])[0]
 
     def build_loss_maps(self, assetcol, rcurves):
         """
@@ -1081,13 +1100,17 @@ def event_based(loss_values, ses_ratio, curve_resolution):
 # Scenario Damage
 #
 
-def scenario_damage(fragility_functions, gmv):
+def scenario_damage(fragility_functions, gmvs):
     """
-    Compute the damage state fractions for the given ground motion value.
-    Return am array of M values where M is the numbers of damage states.
+    Compute the damage state fractions for the given ground motion values.
+    Return a matrix of E x M values where E is the number of ground motion
+    values and M is the numbers of damage states; if a single ground motion
+    value is given, return an array of M values.
     """
-    return pairwise_diff(
-        [1] + [ff(gmv) for ff in fragility_functions] + [0])
+    poes = numpy.array([ff(gmvs) for ff in fragility_functions])
+    ones = numpy.ones((1,) + poes.shape[1:])
+    zeros = numpy.zeros((1,) + poes.shape[1:])
+    return pairwise_diff(numpy.concatenate([ones, poes, zeros])).T
 
 #
 # Classical Damage
@@ -1131,16 +1154,15 @@ def classical_damage(
         poes = numpy.array(hazard_poes)
     afe = annual_frequency_of_exceedence(poes, investigation_time)
     annual_frequency_of_occurrence = pairwise_diff(
-        pairwise_mean([afe[0]] + list(afe) + [afe[-1]]))
-    poes_per_damage_state = []
-    for ff in fragility_functions:
-        frequency_of_exceedence_per_damage_state = numpy.dot(
-            annual_frequency_of_occurrence, list(map(ff, imls)))
-        poe_per_damage_state = 1. - numpy.exp(
-            - frequency_of_exceedence_per_damage_state *
-            risk_investigation_time)
-        poes_per_damage_state.append(poe_per_damage_state)
-    poos = pairwise_diff([1] + poes_per_damage_state + [0])
+        pairwise_mean(numpy.concatenate([[afe[0]], afe, [afe[-1]]])))
+    # matrix of PoEs with a row for each limit state and a column per IML
+    ff_poes = numpy.array([ff(imls) for ff in fragility_functions])
+    frequency_of_exceedence_per_damage_state = numpy.dot(
+        ff_poes, annual_frequency_of_occurrence)
+    poes_per_damage_state = 1. - numpy.exp(
+        - frequency_of_exceedence_per_damage_state * risk_investigation_time)
+    poos = pairwise_diff(
+        numpy.concatenate([[1.], poes_per_damage_state, [0.]]))
     return poos
 
 #
@@ -1157,30 +1179,31 @@ def classical(vulnerability_function, hazard_imls, hazard_poes, steps=10):
     :param hazard_imls:
         the hazard intensity measure type and levels
     :type hazard_poes:
-        the hazard curve
+        the hazard curve, or a matrix of hazard curves, one per row
     :param int steps:
         Number of steps between loss ratios.
+    :returns:
+        an array of shape (2, C) with loss ratios and poes, or an array
+        of shape (S, 2, C) if a matrix of S hazard curves is given
     """
-    assert len(hazard_imls) == len(hazard_poes), (
-        len(hazard_imls), len(hazard_poes))
+    hazard_poes = numpy.asarray(hazard_poes)
+    assert len(hazard_imls) == hazard_poes.shape[-1], (
+        len(hazard_imls), hazard_poes.shape[-1])
     vf = vulnerability_function
-    imls = vf.mean_imls()
     loss_ratios, lrem = vf.loss_ratio_exceedance_matrix(steps)
 
     # saturate imls to hazard imls
-    min_val, max_val = hazard_imls[0], hazard_imls[-1]
-    numpy.putmask(imls, imls < min_val, min_val)
-    numpy.putmask(imls, imls > max_val, max_val)
+    imls = numpy.clip(vf.mean_imls(), hazard_imls[0], hazard_imls[-1])
 
-    # interpolate the hazard curve
+    # interpolate the hazard curves
     poes = interpolate.interp1d(hazard_imls, hazard_poes)(imls)
 
-    # compute the poos
-    pos = pairwise_diff(poes)
-    lrem_po = numpy.empty(lrem.shape)
-    for idx, po in enumerate(pos):
-        lrem_po[:, idx] = lrem[:, idx] * po  # column * po
-    return numpy.array([loss_ratios, lrem_po.sum(axis=1)])
+    # compute the poos and multiply them by the LREM, for all the curves
+    pos = poes[..., :-1] - poes[..., 1:]
+    curves = numpy.empty(hazard_poes.shape[:-1] + (2, len(loss_ratios)))
+    curves[..., 0, :] = loss_ratios
+    curves[..., 1, :] = numpy.dot(pos, lrem.T)
+    return curves
 
 
 def conditional_loss_ratio(loss_ratios, poes, probability):
@@ -1233,6 +1256,48 @@ def conditional_loss_ratio(loss_ratios, poes, probability):
         return (y2 - y1) / (x2 - x1) * (probability - x1) + y1
 
 
+def conditional_loss_ratios(loss_matrix, poe_matrix, probabilities):
+    """
+    Vectorized version of :func:`conditional_loss_ratio`, with the
+    same semantics, working on N curves at the same time.
+
+    :param loss_matrix: an N x C matrix of non-decreasing losses
+    :param poe_matrix: an N x C matrix of non-increasing PoEs
+    :param probabilities: P probability values
+    :returns: a matrix of shape (P, N)
+    """
+    losses = numpy.asarray(loss_matrix, float)
+    poes = numpy.asarray(poe_matrix, float)
+    N, C = poes.shape
+    out = numpy.zeros((len(probabilities), N))
+    if N == 0:
+        return out
+    # the curves with NaNs (if any) are managed by the scalar function
+    nan = numpy.isnan(poes).any(axis=1)
+    rows = numpy.arange(N)
+    for p, probability in enumerate(probabilities):
+        # index of the last PoE greater than the probability; it is the
+        # same as the one found by bisect on the reversed PoEs
+        idx1 = numpy.clip(
+            C - 1 - (poes <= probability).sum(axis=1), 0, max(C - 2, 0))
+        idx2 = numpy.minimum(idx1 + 1, C - 1)
+        x1, x2 = poes[rows, idx1], poes[rows, idx2]
+        y1, y2 = losses[rows, idx1], losses[rows, idx2]
+        equal = poes == probability
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            interp = (y2 - y1) / (x2 - x1) * (probability - x1) + y1
+        out[p] = numpy.select(
+            [probability > poes[:, 0], probability < poes[:, -1],
+             equal.any(axis=1)],
+            [0., losses[:, -1],
+             numpy.where(equal, losses, -numpy.inf).max(axis=1)],
+            interp)
+        for i in rows[nan]:
+            out[p, i] = conditional_loss_ratio(
+                losses[i], poes[i], probability)
+    return out
+
+
 #
 # Insured Losses
 #
@@ -1252,11 +1317,13 @@ def insured_losses(losses, deductible, insured_limit):
     - if the loss is 3 (< 5) the company does not pay anything
     - if the loss is 20 the company pays 20 - 5 = 15
     - if the loss is 101 the company pays 100 - 5 = 95
+
+    `deductible` and `insured_limit` can also be arrays broadcastable
+    to the losses, for instance with a value per asset for a matrix of
+    losses N x E.
     """
-    return numpy.piecewise(
-        losses,
-        [losses < deductible, losses > insured_limit],
-        [0, insured_limit - deductible, lambda x: x - deductible])
+    return numpy.minimum(
+        numpy.maximum(losses, deductible), insured_limit) - deductible
 
 
 def insured_loss_curve(curve, deductible, insured_limit):
@@ -1311,39 +1378,43 @@ def bcr(eal_original, eal_retrofitted, interest_rate,
 
 def pairwise_mean(values):
     "Averages between a value and the next value in a sequence"
-    return numpy.array([numpy.mean(pair) for pair in utils.pairwise(values)])
+    values = numpy.asarray(values)
+    return (values[:-1] + values[1:]) / 2.
 
 
 def pairwise_diff(values):
     "Differences between a value and the next value in a sequence"
-    return numpy.array([x - y for x, y in utils.pairwise(values)])
+    values = numpy.asarray(values)
+    return values[:-1] - values[1:]
 
 
-def mean_std(fractions):
+def mean_std(fractions, axis=0):
     """
     Given an N x M matrix, returns mean and std computed on the rows,
-    i.e. two M-dimensional vectors.
+    i.e. two M-dimensional vectors. With a different `axis` the
+    statistics are computed along that axis of an array of any shape.
     """
-    return numpy.mean(fractions, axis=0), numpy.std(fractions, axis=0, ddof=1)
+    return (numpy.mean(fractions, axis=axis),
+            numpy.std(fractions, axis=axis, ddof=1))
 
 
 def loss_map_matrix(poes, curves):
     """
-    Wrapper around :func:`openquake.risklib.scientific.conditional_loss_ratio`.
+    Wrapper around :func:`conditional_loss_ratios`.
     Return a matrix of shape (num-poes, num-curves). The curves are lists of
     pairs (loss_ratios, poes).
     """
-    return numpy.array(
-        [[conditional_loss_ratio(curve[0], curve[1], poe)
-          for curve in curves] for poe in poes]
-    ).reshape((len(poes), len(curves)))
+    if len(curves) == 0:
+        return numpy.zeros((len(poes), 0))
+    curves = numpy.asarray(curves, float)
+    return conditional_loss_ratios(curves[:, 0], curves[:, 1], poes)
 
 
 def mean_curve(values, weights=None):
     """
     Compute the mean by using numpy.average on the first axis.
     """
-    if weights:
+    if weights is not None and len(weights):
         weights = list(map(float, weights))
         assert abs(sum(weights) - 1.) < 1E-12, sum(weights) - 1.
     else:
@@ -1376,34 +1447,83 @@ def quantile_curve(curves, quantile, weights=None):
         # more or less copied from the scipy mquantiles function, just special
         # cased for what we need (and a lot faster)
         arr = numpy.array(curves).reshape(len(curves), -1)
-        p = numpy.array(quantile)
-        m = 0.4 + p * 0.2
-        n = len(arr)
-        aleph = n * p + m
-        k = numpy.floor(aleph.clip(1, n - 1)).astype(int)
-        gamma = (aleph - k).clip(0, 1)
-        data = numpy.sort(arr, axis=0).transpose()
-        return (1.0 - gamma) * data[:, k - 1] + gamma * data[:, k]
+        return _quantiles(arr, [quantile])[0]
 
     # Each curve needs to be associated with a weight
     assert len(weights) == len(curves)
-    weights = numpy.array(weights, dtype=numpy.float64)
-
-    result_curve = []
-    np_curves = numpy.array(curves).reshape(len(curves), -1)
-    np_weights = numpy.array(weights)
-    for poes in np_curves.transpose():
-        sorted_poe_idxs = numpy.argsort(poes)
-        sorted_weights = np_weights[sorted_poe_idxs]
-        sorted_poes = poes[sorted_poe_idxs]
-        cum_weights = numpy.cumsum(sorted_weights)
-        result_curve.append(numpy.interp(quantile, cum_weights, sorted_poes))
+    arr = numpy.array(curves).reshape(len(curves), -1)
+    [result_curve] = _weighted_quantiles(arr, [quantile], weights)
 
     shape = getattr(curves[0], 'shape', None)
     if shape:  # passed a sequence of arrays
-        return numpy.array(result_curve).reshape(shape)
+        return result_curve.reshape(shape)
     else:  # passed a sequence of numbers
-        return result_curve
+        return list(result_curve)
+
+
+def quantile_curves(curves, quantiles, weights=None):
+    """
+    Compute several quantiles of a set of curves in a single pass, with
+    the same semantics of :func:`quantile_curve`: the curves are sorted
+    only once along the realization axis.
+
+    :param curves:
+        array-like of R curves, each one of shape S
+    :param quantiles:
+        a sequence of Q quantiles in the range [0.0, 1.0]
+    :param weights:
+        Array-like of R weights, or None
+    :returns:
+        A numpy array of shape (Q,) + S
+    """
+    assert len(curves)
+    arr = numpy.array(curves)
+    shape = (len(quantiles),) + arr.shape[1:]
+    arr = arr.reshape(len(arr), -1)
+    if weights is None:
+        return _quantiles(arr, quantiles).reshape(shape)
+    assert len(weights) == len(curves)
+    return _weighted_quantiles(arr, quantiles, weights).reshape(shape)
+
+
+def _quantiles(arr, quantiles):
+    # unweighted quantiles of a matrix R x M, returns a matrix Q x M
+    p = numpy.array(quantiles)
+    m = 0.4 + p * 0.2
+    n = len(arr)
+    aleph = n * p + m
+    k = numpy.floor(aleph.clip(1, n - 1)).astype(int)
+    gamma = (aleph - k).clip(0, 1)
+    data = numpy.sort(arr, axis=0)
+    return ((1.0 - gamma) * data[k - 1].T + gamma * data[k].T).T
+
+
+def _weighted_quantiles(arr, quantiles, weights):
+    # weighted quantiles of a matrix R x M, returns a matrix Q x M;
+    # this is a vectorized version of numpy.interp(q, cum_weights, poes)
+    # applied to each column of the sorted matrix
+    R, M = arr.shape
+    idxs = numpy.argsort(arr, axis=0)
+    cols = numpy.arange(M)
+    poes = arr[idxs, cols]
+    cum_weights = numpy.cumsum(
+        numpy.array(weights, numpy.float64)[idxs], axis=0)
+    result = numpy.zeros((len(quantiles), M))
+    for i, q in enumerate(quantiles):
+        # index of the last cumulative weight <= q, for each column
+        j = (cum_weights <= q).sum(axis=0) - 1
+        j1 = numpy.minimum(j + 1, R - 1)
+        j0 = numpy.maximum(j, 0)
+        x0 = cum_weights[j0, cols]
+        x1 = cum_weights[j1, cols]
+        y0 = poes[j0, cols]
+        y1 = poes[j1, cols]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            res = (y1 - y0) / (x1 - x0) * (q - x0) + y0
+        res[j < 0] = poes[0][j < 0]
+        res[j >= R - 1] = poes[R - 1][j >= R - 1]
+        result[i] = res
+    return result
 
 
 # TODO: remove this from openquake.risklib.qa_tests.bcr_test
@@ -1433,10 +1553,9 @@ def quantile_matrix(values, quantiles, weights):
     :returns:
         a matrix Q x N
     """
-    result = numpy.zeros((len(quantiles), values.shape[1]))
-    for i, q in enumerate(quantiles):
-        result[i] = quantile_curve(values, q, weights)
-    return result
+    if not len(quantiles):
+        return numpy.zeros((0, values.shape[1]))
+    return quantile_curves(values, quantiles, weights)
 
 
 def exposure_statistics(
@@ -1513,11 +1632,13 @@ def asset_statistics(
     """
     mean_curve_ = numpy.array([losses, mean_curve(curves_poes, weights)])
     mean_map = loss_map_matrix(poes, [mean_curve_]).reshape(len(poes))
-    quantile_curves = numpy.array(
-        [[losses, quantile_curve(curves_poes, quantile, weights)]
-         for quantile in quantiles]).reshape((len(quantiles), 2, len(losses)))
-    quantile_maps = loss_map_matrix(poes, quantile_curves).transpose()
-    return (mean_curve_, mean_map, quantile_curves, quantile_maps)
+    quantile_curves_ = numpy.zeros((len(quantiles), 2, len(losses)))
+    if len(quantiles):
+        quantile_curves_[:, 0] = losses
+        quantile_curves_[:, 1] = quantile_curves(
+            curves_poes, quantiles, weights)
+    quantile_maps = loss_map_matrix(poes, quantile_curves_).transpose()
+    return (mean_curve_, mean_map, quantile_curves_, quantile_maps)
 
 
 def normalize_curves(curves):
@@ -1586,8 +1707,10 @@ class SimpleStats(object):
             new = newarray[field]
             data = [array[field][:, i] for i in range(len(self.rlzs))]
             new[:, 0] = mean_curve(data, weights)
-            for i, q in enumerate(self.quantiles, 1):
-                new[:, i] = quantile_curve(data, q, weights)
+            if self.quantiles:
+                qcurves = quantile_curves(data, self.quantiles, weights)
+                for i, qcurve in enumerate(qcurves, 1):
+                    new[:, i] = qcurve
         dstore[newname] = newarray
         dstore[newname].attrs['nbytes'] = newarray.nbytes
         dstore[newname].attrs['statnames'] = self.names
@@ -1758,6 +1881,56 @@ class StatsBuilder(object):
                         maps[name + ins][aid] = map_
         return curves, maps
 
+    def build_curves_maps(self, curves, weights):
+        """
+        Vectorized version of `build` + `get_curves_maps`, to be used when
+        the loss curves of the different realizations are defined on the
+        same losses, as in the classical calculator (the losses of the
+        first realization are used, like in :func:`normalize_curves`).
+        The mean and the quantiles are computed in a single pass for all
+        the assets.
+
+        :param curves:
+            a composite array of shape (N, R) with fields losses, poes,
+            avg (and losses_ins, poes_ins, avg_ins if insured)
+        :param weights:
+            a list of R weights
+        :returns:
+            statistical loss curves and maps per asset as composite arrays
+            of shape (N, Q1); the insured loss maps are not computed
+        """
+        N, R = curves.shape
+        Q1 = len(self.mean_quantiles)
+        stat_curves = numpy.zeros((N, Q1), curves.dtype)
+        if self.conditional_loss_poes:
+            stat_maps = numpy.zeros((N, Q1), self.loss_maps_dt)
+        else:
+            stat_maps = []
+        for i in range(self.insured_losses + 1):  # insured index
+            ins = '_ins' if i else ''
+            losses = curves['losses' + ins][:, 0]  # shape (N, C)
+            poes = curves['poes' + ins].transpose(1, 0, 2)  # (R, N, C)
+            avgs = curves['avg' + ins].T  # shape (R, N)
+            mq_poes = _combine_mq(
+                mean_curve(poes, weights),
+                quantile_curves(poes, self.quantiles, weights))
+            mq_avgs = _combine_mq(
+                mean_curve(avgs, weights),
+                quantile_curves(avgs, self.quantiles, weights))
+            stat_curves['losses' + ins] = losses[:, None]
+            stat_curves['poes' + ins] = mq_poes.transpose(1, 0, 2)
+            stat_curves['avg' + ins] = mq_avgs.T
+            if self.conditional_loss_poes and not ins:
+                C = losses.shape[-1]
+                mq_losses = numpy.repeat(losses[:, None], Q1, axis=1)
+                maps = conditional_loss_ratios(  # shape (P, N * Q1)
+                    mq_losses.reshape(-1, C),
+                    mq_poes.transpose(1, 0, 2).reshape(-1, C),
+                    self.conditional_loss_poes)
+                for poe, map_ in zip(self.conditional_loss_poes, maps):
+                    stat_maps['poe~%s' % poe] = map_.reshape(N, Q1)
+        return stat_curves, stat_maps
+
     def _loss_curves(self, assets, mean, mean_averages,
                      quantile, quantile_averages):
         mq_curves = _combine_mq(mean, quantile)  # shape (Q1, N, 2, C)
@@ -18,6 +18,7 @@
 
 import unittest
 
+import numpy
 from openquake.risklib import scientific
 
 
@@ -36,3 +37,13 @@ class RiskCommonTestCase(unittest.TestCase):
             eal_orig, eal_retrofitted, interest,
             life_expectancy, 1, retrofitting_cost)
         self.assertAlmostEqual(result, expected_result, delta=2e-5)
+
+    def test_compute_bcr_many_assets(self):
+        # the BCRs can be computed for many assets at once
+        values = numpy.array([1., 2., 3.])
+        costs = numpy.array([0.1, 0.3, 0.2])
+        result = scientific.bcr(0.00838, 0.00587, 0.05, 40, values, costs)
+        expected = [scientific.bcr(0.00838, 0.00587, 0.05, 40, value, cost)
+                    for value, cost in zip(values, costs)]
+        numpy.testing.assert_allclose(result, expected)
+        self.assertAlmostEqual(result[0], 0.43405, delta=2e-5)
@@ -16,11 +16,12 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
+import pickle
 import unittest
 import numpy
 from scipy.interpolate import interp1d
 
-from openquake.risklib import scientific
+from openquake.risklib import scientific, riskmodels
 
 
 class ClassicalTestCase(unittest.TestCase):
@@ -111,6 +112,24 @@ class ClassicalTestCase(unittest.TestCase):
             0.25263157,
             scientific.conditional_loss_ratio(loss_ratios, poes, 0.1))
 
+    def test_conditional_loss_ratios(self):
+        # the vectorized version must give the same results of the scalar
+        # one, including duplicated PoEs, out of range values and NaNs
+        loss_matrix = [[0.19, 0.20, 0.21, 0.24, 0.27, 0.30],
+                       [0.21, 0.24, 0.27, 0.30, 0.33, 0.36],
+                       [0.10, 0.20, 0.30, 0.40, 0.50, 0.60]]
+        poe_matrix = [[0.131, 0.131, 0.131, 0.108, 0.089, 0.066],
+                      [0.131, 0.108, 0.108, 0.089, 0.066, 0.066],
+                      [numpy.nan] * 6]
+        probabilities = [0.2, 0.131, 0.13, 0.108, 0.1, 0.066, 0.01]
+        actual = scientific.conditional_loss_ratios(
+            loss_matrix, poe_matrix, probabilities)
+        for p, probability in enumerate(probabilities):
+            for i in range(3):
+                numpy.testing.assert_allclose(
+                    actual[p, i], scientific.conditional_loss_ratio(
+                        loss_matrix[i], poe_matrix[i], probability))
+
     def test_compute_lrem_using_beta_distribution(self):
         expected_lrem = [
             [1.0000000, 1.0000000, 1.0000000, 1.0000000, 1.0000000],
@@ -152,6 +171,39 @@ class ClassicalTestCase(unittest.TestCase):
         numpy.testing.assert_allclose(
             expected_lrem, lrem, rtol=0.0, atol=0.0005)
 
+    def test_lrem_cache(self):
+        # the LREM is cached by content, so it is not recomputed for a copy
+        # of the function, as it happens after unpickling in a task
+        vf = scientific.VulnerabilityFunction(
+            'VF', 'PGA', self.imls, self.mean_loss_ratios, self.covs, "LN")
+        vf_copy = pickle.loads(pickle.dumps(vf))
+        self.assertIs(vf.loss_ratio_exceedance_matrix(3),
+                      vf_copy.loss_ratio_exceedance_matrix(3))
+
+        # the matrix must be the same as the one computed cell by cell
+        loss_ratios, lrem = vf.loss_ratio_exceedance_matrix(3)
+        dist = scientific.LogNormalDistribution()
+        for row, loss_ratio in enumerate(loss_ratios):
+            for col, (mean, stddev) in enumerate(
+                    zip(vf.mean_loss_ratios, vf.stddevs)):
+                numpy.testing.assert_allclose(
+                    lrem[row, col], dist.survival(loss_ratio, mean, stddev))
+
+    def test_lrem_cache_size(self):
+        # the cache is cleared when full, so it cannot grow indefinitely
+        vf = scientific.VulnerabilityFunction(
+            'VF', 'PGA', self.imls, self.mean_loss_ratios, self.covs, "LN")
+        size = scientific.LREM_CACHE_SIZE
+        scientific.LREM_CACHE_SIZE = 2
+        try:
+            scientific.LREM_CACHE.clear()
+            for steps in (1, 2, 3):
+                vf.loss_ratio_exceedance_matrix(steps)
+                self.assertLessEqual(len(scientific.LREM_CACHE), 2)
+            self.assertEqual(len(scientific.LREM_CACHE), 1)
+        finally:
+            scientific.LREM_CACHE_SIZE = size
+
     def test_bin_width_from_imls(self):
         imls = [0.1, 0.2, 0.4, 0.6]
         covs = [0.5, 0.5, 0.5, 0.5]
@@ -192,3 +244,47 @@ class ClassicalTestCase(unittest.TestCase):
         for loss, poe in expected_curve:
             numpy.testing.assert_allclose(
                 poe, actual_poes_interp(loss), atol=0.005)
+
+    def test_compute_many_loss_ratio_curves(self):
+        # the curves computed from a matrix of hazard curves must be
+        # the same as the curves computed one hazard curve at the time
+        hazard_imls = [0.01, 0.08, 0.17, 0.26, 0.36, 0.55, 0.7]
+        hazard_curves = numpy.array([
+            [0.99, 0.96, 0.89, 0.82, 0.7, 0.4, 0.01],
+            [0.98, 0.9, 0.8, 0.6, 0.3, 0.1, 0.001],
+            [0.99, 0.96, 0.89, 0.82, 0.7, 0.4, 0.01]])
+        vf = scientific.VulnerabilityFunction(
+            'VF', 'PGA', [0.1, 0.2, 0.4, 0.6], [0.05, 0.08, 0.2, 0.4],
+            [0.5, 0.3, 0.2, 0.1], "LN")
+        curves = scientific.classical(vf, hazard_imls, hazard_curves, 2)
+        self.assertEqual(curves.shape, (3, 2, 11))
+        for hazard_curve, curve in zip(hazard_curves, curves):
+            numpy.testing.assert_allclose(
+                curve, scientific.classical(vf, hazard_imls, hazard_curve, 2))
+
+    def test_curve_cache(self):
+        # the distinct hazard curves are computed with a single call
+        # and the repeated ones are read from the cache
+        hazard_imls = [0.01, 0.08, 0.17, 0.26, 0.36, 0.55, 0.7]
+        hc1 = [0.99, 0.96, 0.89, 0.82, 0.7, 0.4, 0.01]
+        hc2 = [0.98, 0.9, 0.8, 0.6, 0.3, 0.1, 0.001]
+        vf = scientific.VulnerabilityFunction(
+            'VF', 'PGA', [0.1, 0.2, 0.4, 0.6], [0.05, 0.08, 0.2, 0.4],
+            [0.5, 0.3, 0.2, 0.1], "LN")
+        cache = riskmodels.CurveCache({'PGA': hazard_imls}, 2, maxsize=3)
+        curves = cache.get('structural', vf, [hc1, hc2, hc1])
+        self.assertEqual(curves.shape, (3, 2, 11))
+        self.assertEqual(len(cache.data), 2)
+        for hc, curve in zip([hc1, hc2, hc1], curves):
+            numpy.testing.assert_allclose(
+                curve, scientific.classical(vf, hazard_imls, hc, 2))
+
+        # a different key does not use the curves of the first one
+        cache.get('nonstructural', vf, [hc1])
+        self.assertEqual(len(cache.data), 3)
+
+        # the cache is cleared when full
+        curves = cache.get('structural', vf, [hc2, [0.5] * 7])
+        self.assertEqual(len(cache.data), 2)
+        numpy.testing.assert_allclose(
+            curves[0], scientific.classical(vf, hazard_imls, hc2, 2))
@@ -166,6 +166,19 @@ class VulnerabilityFunctionTestCase(unittest.TestCase):
         numpy.testing.assert_allclose(
             expected_lrs, self.test_func(test_input, epsilons))
 
+    def test_sample_matrix(self):
+        # sampling a matrix of epsilons N x E must give the same loss
+        # ratios as sampling the epsilons of each asset separately
+        gmvs = numpy.array([0.004, 0.006, 0.01, 0.02, 0.03])
+        eps = scientific.make_epsilons(
+            numpy.zeros((3, 5)), seed=42, correlation=0)
+        means, covs, idxs = self.test_func.interpolate(gmvs)
+        matrix = self.test_func.sample(means, covs, idxs, eps)
+        self.assertEqual(matrix.shape, (3, 4))
+        for row, epsilons in zip(matrix, eps):
+            numpy.testing.assert_allclose(
+                row, self.test_func.sample(means, covs, idxs, epsilons))
+
     def test_loss_ratio_interp_many_values_clipped(self):
         # Given a list of IML values (abscissae), test for proper interpolation
         # of loss ratios (ordinates).
@@ -536,6 +549,24 @@ class FragilityFunctionTestCase(unittest.TestCase):
         self._close_to([0.975, 0.025, 0.],
                        scientific.scenario_damage(ffs, 0.075))
 
+    def test_scenario_damage_many_gmvs(self):
+        # the damage matrix computed on an array of ground motion values
+        # must be the same as the damage computed one value at the time
+        ffs = [
+            scientific.FragilityFunctionDiscrete(
+                'LS1', [0.05, 0.1, 0.3, 0.5, 0.7],
+                [0, 0.05, 0.20, 0.50, 1.00], 0.075),
+            scientific.FragilityFunctionDiscrete(
+                'LS2', [0.05, 0.1, 0.3, 0.5, 0.7],
+                [0, 0.00, 0.05, 0.20, 0.50], 0.075)]
+        gmvs = numpy.array([0.02, 0.075, 0.08, 0.3, 0.65, 0.9])
+        damages = scientific.scenario_damage(ffs, gmvs)
+        self.assertEqual(damages.shape, (6, 3))
+        for gmv, damage in zip(gmvs, damages):
+            numpy.testing.assert_allclose(
+                damage, scientific.scenario_damage(ffs, gmv))
+        numpy.testing.assert_allclose(damages[0], [1., 0., 0.])
+
     def _close_to(self, expected, actual):
         numpy.testing.assert_allclose(actual, expected, atol=0.0, rtol=0.05)
 
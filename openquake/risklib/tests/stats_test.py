@@ -56,6 +56,20 @@ class MeanCurveTestCase(unittest.TestCase):
             expected_mean_curve,
             scientific.mean_curve(curves, weights=weights))
 
+    def test_compute_mean_curve_weights_array(self):
+        # the weights can be given as a numpy array, as in RlzsAssoc
+        curves = [
+            [1.0, 0.85, 0.67, 0.3],
+            [0.87, 0.76, 0.59, 0.21],
+            [0.62, 0.41, 0.37, 0.0],
+        ]
+        weights = numpy.array([0.5, 0.3, 0.2])
+
+        expected_mean_curve = numpy.array([0.885, 0.735, 0.586, 0.213])
+        numpy.testing.assert_allclose(
+            expected_mean_curve,
+            scientific.mean_curve(curves, weights=weights))
+
     def test_compute_mean_curve_weights_None(self):
         # If all weight values are None, ignore the weights altogether
         curves = [
@@ -167,6 +181,33 @@ class QuantileCurveTestCase(unittest.TestCase):
 
         numpy.testing.assert_allclose(expected_curve, actual_curve)
 
+    def test_quantile_curves(self):
+        # all the quantiles computed in a single pass must be the same
+        # as the ones computed column by column with numpy.interp over
+        # the sorted values and the cumulative weights; the curves
+        # contain ties and some weights are zero
+        curves = numpy.random.RandomState(42).random_sample((10, 4, 3))
+        curves = curves.round(1)
+        weights = numpy.array([0, .1, .2, 0, .1, .1, .2, 0, .2, .1])
+        quantiles = [0., 0.05, 0.1, 0.15, 0.3, 0.5, 0.85, 1.]
+        qcurves = scientific.quantile_curves(curves, quantiles, weights)
+        self.assertEqual(qcurves.shape, (8, 4, 3))
+        columns = curves.reshape(10, -1).T
+        for q, qcurve in zip(quantiles, qcurves):
+            expected = []
+            for poes in columns:
+                idxs = numpy.argsort(poes)
+                expected.append(numpy.interp(
+                    q, numpy.cumsum(weights[idxs]), poes[idxs]))
+            numpy.testing.assert_allclose(qcurve.flatten(), expected)
+
+        # unweighted quantiles, compared with scipy
+        for q, qcurve in zip(quantiles, scientific.quantile_curves(
+                curves, quantiles)):
+            expected = mstats.mquantiles(
+                curves.reshape(10, -1), prob=q, axis=0)[0]
+            numpy.testing.assert_allclose(qcurve.flatten(), expected)
+
 
 class NormalizeTestCase(unittest.TestCase):
 
@@ -249,3 +290,30 @@ class StatsTestCase(unittest.TestCase):
 
         # remove only if the test pass
         shutil.rmtree(tempdir)
+
+    def test_build_curves_maps(self):
+        # the vectorized statistics must be the same as the ones computed
+        # with build + get_curves_maps when the losses are the same for
+        # all realizations
+        assets = [asset('a1', 101), asset('a2', 151), asset('a3', 91)]
+        baselosses = numpy.array([.10, .14, .17, .20, .21])
+        weights = [0.3, 0.7]
+        curves = numpy.zeros((3, 2), self.builder.loss_curve_dt)
+        outputs = []
+        for r, w in enumerate(weights):
+            lc = loss_curves(assets, baselosses, 0)
+            lc[:, 1] *= (r + 1) / 2.
+            curves['losses'][:, r] = lc[:, 0]
+            curves['poes'][:, r] = lc[:, 1]
+            curves['avg'][:, r] = avg = [.1 * (r + 1), .12, .13]
+            outputs.append(scientific.Output(
+                [a.id for a in assets], 'structural', weight=w,
+                loss_curves=lc, insured_curves=None,
+                average_losses=avg, average_insured_losses=None))
+        curves1, maps1 = self.builder.get_curves_maps(
+            self.builder.build(outputs))
+        curves2, maps2 = self.builder.build_curves_maps(curves, weights)
+        for name in curves1.dtype.names:
+            aaae(curves2[name], curves1[name].swapaxes(0, 1))
+        for name in maps1.dtype.names:
+            aaae(maps2[name], maps1[name].T, decimal=4)